@@ -16,6 +16,13 @@ class DatabaseConfig:
     user: str = os.getenv("DB_USER", "postgres")
     password: str | None = os.getenv("DB_PASSWORD")
     port: int = int(os.getenv("DB_PORT", "5432"))
+    # Пул соединений (используется в режиме DatabaseManager(pooled=True)).
+    # DB_POOL_MAX_SIZE должен быть не меньше DB_POOL_MIN_CONNECTIONS
+    pool_min_size: int = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+    pool_max_size: int = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+    pool_health_check: bool = os.getenv("DB_POOL_HEALTH_CHECK", "true").lower() == "true"
+    # Размер пачки строк, забираемой серверным курсором в DatabaseManager.iter_query
+    itersize: int = int(os.getenv("DB_ITERSIZE", "2000"))
 
 
 @dataclass
@@ -28,13 +35,75 @@ class LlmConfig:
     default_model: str = os.getenv("LLM_DEFAULT_MODEL", "x-ai/grok-4-fast")
     check_model: str = os.getenv("LLM_CHECK_MODEL", "mistralai/ministral-8b")
     perplexity_model: str = os.getenv("LLM_PERPLEXITY_MODEL", "perplexity/sonar")
+    # Дополнительные точки доступа (llm/endpoints.py) через запятую, строго "base_url|api_key[|вес]".
+    # Пара LLM_URL/OPENROUTER_API_KEY всегда первая в пуле.
+    # Лимиты RPM/TPM и Retry-After учитываются отдельно для каждой точки
+    extra_endpoints: str = os.getenv("LLM_ENDPOINTS", "")
+    # Дешевая модель первого уровня каскада parse_chunk (пусто — каскад отключен)
+    cheap_model: str = os.getenv("LLM_CHEAP_MODEL", "")
+    # Общий HTTP-транспорт клиентов (llm/transport.py): пул соединений, keep-alive, HTTP/2, таймауты
+    http_max_connections: int = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+    http_max_keepalive_connections: int = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20"))
+    http_keepalive_expiry: float = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "60"))
+    http2: bool = os.getenv("LLM_HTTP2", "false").lower() == "true"
+    http_connect_timeout: float = float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT", "10"))
+    http_read_timeout: float = float(os.getenv("LLM_HTTP_READ_TIMEOUT", "120"))
+    http_write_timeout: float = float(os.getenv("LLM_HTTP_WRITE_TIMEOUT", "30"))
+    http_pool_timeout: float = float(os.getenv("LLM_HTTP_POOL_TIMEOUT", "30"))
+    # Формат чанков parse_chunk: "verbose" (полные ключи) или "compact"
+    # (короткие ключи, без пустых полей и person_id)
+    chunk_format: str = os.getenv("LLM_CHUNK_FORMAT", "verbose")
+    # Лимиты провайдера на модель: запросов и токенов в минуту (0 — без ограничения)
+    default_rpm: int = int(os.getenv("LLM_DEFAULT_RPM", "0"))
+    default_tpm: int = int(os.getenv("LLM_DEFAULT_TPM", "0"))
+    check_rpm: int = int(os.getenv("LLM_CHECK_RPM", "0"))
+    check_tpm: int = int(os.getenv("LLM_CHECK_TPM", "0"))
+    perplexity_rpm: int = int(os.getenv("LLM_PERPLEXITY_RPM", "0"))
+    perplexity_tpm: int = int(os.getenv("LLM_PERPLEXITY_TPM", "0"))
+    cheap_rpm: int = int(os.getenv("LLM_CHEAP_RPM", "0"))
+    cheap_tpm: int = int(os.getenv("LLM_CHEAP_TPM", "0"))
+    # Хеджирование запросов поиска (llm/hedging.py): дубликат запроса после перцентиля
+    # недавних задержек, не больше доли LLM_HEDGE_BUDGET от числа запросов
+    hedge_enabled: bool = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+    hedge_percentile: float = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+    hedge_budget: float = float(os.getenv("LLM_HEDGE_BUDGET", "0.1"))
+    # Оценка токенов ответа для TPM, если max_tokens не задан
+    output_tokens_estimate: int = int(os.getenv("LLM_OUTPUT_TOKENS_ESTIMATE", "500"))
+    # JSONL-трасса каждого вызова LLM: токены, стоимость, задержка (пусто — не писать)
+    usage_trace_path: str = os.getenv("LLM_USAGE_TRACE_PATH", "")
+    # Персистентный кэш ответов (llm/response_cache.py)
+    cache_enabled: bool = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+    cache_path: str = os.getenv("LLM_CACHE_PATH", ".cache/llm_responses.sqlite3")
+    cache_max_entries: int = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "200000"))
+    cache_max_age_seconds: int = int(os.getenv("LLM_CACHE_MAX_AGE_SECONDS", str(30 * 24 * 3600)))
+    # Модели через запятую, для которых кэш не используется
+    cache_bypass_models: tuple[str, ...] = tuple(
+        m.strip() for m in os.getenv("LLM_CACHE_BYPASS_MODELS", "").split(",") if m.strip()
+    )
 
 
 source_table_name = "person_source_data"
 cleaned_table_name = "cleaned_person_source_data"
 result_table_name = "testperson_result_data"
+watermark_table_name = "pipeline_watermarks"
+jobs_table_name = "pipeline_jobs"
 
-CHUNK_SIZE = 10
+# Минимальный DB_POOL_MAX_SIZE (sync и async пулы): потоковое чтение держит одно соединение, запись берет второе
+DB_POOL_MIN_CONNECTIONS = 2
+
+# Чанки для parse_chunk собираются по бюджету токенов (промпт + ожидаемый ответ);
+# CHUNK_SIZE — верхний предел количества записей в чанке
+CHUNK_SIZE = 40
+CHUNK_TOKEN_BUDGET = 3000
+# Ожидаемые токены ответа на одну запись: служебные ключи JSON и сокращенное описание
+CHUNK_OUTPUT_TOKENS_PER_ROW = 40
+CHUNK_OUTPUT_ABOUT_TOKENS = 40
+# Слишком длинные описания обрезаются перед отправкой в LLM
+MAX_ABOUT_CHARS = 1000
+# Каскад моделей: описание длиннее этого порога, дословно повторенное
+# дешевой моделью, считается непереработанным и эскалируется
+CASCADE_ECHO_MIN_LENGTH = 40
+PRE_LLM_BATCH_SIZE = 5000
 
 EMOJI_PATTERN = re.compile(r"["
     r"\U0001F600-\U0001F64F"  # эмотиконы
@@ -57,33 +126,179 @@ PATH_PERSON_TG_AVATARS = 'telegram/avatars/'
 
 ASYNC_LLM_REQUESTS_WORKERS = 2
 MAX_RETRIES = 3
+# Базовая пауза перед повтором (удваивается с каждой попыткой, Retry-After провайдера имеет приоритет)
+RETRY_BACKOFF_SECONDS = 1.0
 ASYNC_SEARCH_REQUESTS_WORKERS = 5
+# Пул точек доступа: после скольких ошибок подряд точка исключается, базовое
+# время исключения (удваивается при повторных) и его максимум в секундах
+ENDPOINT_EJECT_AFTER_ERRORS = 3
+ENDPOINT_EJECT_SECONDS = 10.0
+ENDPOINT_MAX_EJECT_SECONDS = 300.0
+# Исключение точки при отказе в ключе (401/403) или нехватке баланса (402)
+ENDPOINT_AUTH_EJECT_SECONDS = 3600.0
+# Цены моделей для учета расхода (llm/usage.py): модель -> (вход, выход) в USD за 1M токенов.
+# Модели без цены учитываются только по токенам
+LLM_PRICES_PER_MILLION: dict[str, tuple[float, float]] = {}
+# Хеджирование: сколько задержек накопить до первого дубликата, окно задержек
+# и минимальное ожидание перед дубликатом в секундах
+HEDGE_MIN_SAMPLES = 20
+HEDGE_LATENCY_WINDOW = 200
+HEDGE_MIN_DELAY_SECONDS = 2.0
+# Пакетная проверка summary (postcheck): размер пакета и максимальное ожидание его наполнения.
+# На этапе поиска размер ограничивается текущей параллельностью поиска
+POSTCHECK_BATCH_SIZE = 10
+POSTCHECK_BATCH_MAX_DELAY = 0.5
+
+# Дедупликация одинаковых (имя, фамилия, описание) в этапах --llm и --search:
+# в LLM уходит одна запись группы, результат записывается всей группе
+DEDUPE_ENABLED = True
+# Сколько результатов завершенных групп держать в памяти для поздних дубликатов
+DEDUPE_MAX_RESULTS = 100000
+# Размер пакета записи результатов дубликатам
+DEDUPE_FANOUT_BATCH_SIZE = 500
+
+# Быстрый путь --llm (utils/fast_path.py): чистые записи помечаются валидными без LLM.
+# Словарь имен необязателен: без файла проверяется только форма имени
+FAST_PATH_ENABLED = True
+FIRST_NAMES_LEXICON_PATH = 'data/first_names.txt'
+FAST_PATH_MAX_ABOUT_LENGTH = 80
+# Маркеры роли (нижний регистр), один из которых должен быть в описании отдельным словом
+FAST_PATH_ROLE_MARKERS = [
+    "основатель", "сооснователь", "директор", "руководитель", "генеральный",
+    "разработчик", "программист", "инженер", "дизайнер", "маркетолог", "аналитик",
+    "менеджер", "юрист", "адвокат", "врач", "продюсер", "предприниматель",
+    "founder", "co-founder", "ceo", "cto", "cfo", "coo", "cmo", "head of",
+    "developer", "engineer", "designer", "manager", "analyst", "lawyer", "producer",
+]
+
+# Маркеры ответов поиска вида «информация не найдена» (нижний регистр).
+# Используются в оценке confidence и в локальном предфильтре postcheck (llm/prefilter.py)
+SUMMARY_NO_INFO_MARKERS = [
+    "поиск по запросу",
+    "найти не удалось",
+    "данных не найдено",
+    "информации не найдено",
+    "не удалось найти",
+    "недостаточно информации",
+    "отсутствует информация",
+    "no information",
+    "could not find",
+]
+# Предфильтр: короче MIN_LENGTH — заглушка; с маркером и короче STUB_MAX_LENGTH — заглушка;
+# без маркеров, не короче POSITIVE_MIN_LENGTH и с POSITIVE_MIN_SOURCES источниками — валидно
+PREFILTER_MIN_LENGTH = 80
+PREFILTER_STUB_MAX_LENGTH = 400
+PREFILTER_POSITIVE_MIN_LENGTH = 300
+PREFILTER_POSITIVE_MIN_SOURCES = 2
+
+# Адаптивная параллельность запросов к моделям (llm/concurrency.py).
+# ASYNC_*_WORKERS задают начальный лимит, дальше он растет на успешных
+# ответах и снижается на 429/5xx и таймаутах в пределах [MIN, MAX]
+ADAPTIVE_MIN_CONCURRENCY = 1
+ADAPTIVE_MAX_CONCURRENCY = 32
+ADAPTIVE_DECREASE_FACTOR = 0.5
+
+# Очередь задач этапов (--queue): статусы, аренда и число попыток
+JOB_STATUS_PENDING = "pending"
+JOB_STATUS_IN_PROGRESS = "in_progress"
+JOB_STATUS_DONE = "done"
+JOB_STATUS_FAILED = "failed"
+JOB_LEASE_SECONDS = 900
+JOB_MAX_ATTEMPTS = 3
+# Условия отбора персон в очередь для каждого этапа
+JOB_STAGE_FILTERS = {
+    "llm": "TRUE",
+    "search": "valid",
+    "photos": "valid AND summary IS NOT NULL AND TRIM(summary) != ''",
+}
 
 SELECT_PERSONS_BASE_QUERY = f"SELECT * FROM {result_table_name}"
-UPDATE_MEANINGFUL_FIELDS_QUERY = f"""
-    UPDATE {result_table_name}
-    SET meaningful_first_name = %s,
-        meaningful_last_name = %s,
-        meaningful_about = %s
-    WHERE person_id = %s
-"""
-UPDATE_LLM_RESULTS_QUERY = f"""
-    UPDATE {result_table_name}
-    SET meaningful_first_name = %s,
-        meaningful_last_name = %s,
-        meaningful_about = %s,
-        valid = %s
-    WHERE person_id = %s
+SELECT_PERSONS_BY_IDS_QUERY = f"{SELECT_PERSONS_BASE_QUERY} WHERE person_id = ANY(%s) ORDER BY person_id"
+# Колонки staging-таблицы для COPY-обновления в pre_llm (ключевая колонка первой)
+MEANINGFUL_FIELDS_COLUMNS = {
+    "person_id": "bigint",
+    "meaningful_first_name": "text",
+    "meaningful_last_name": "text",
+    "meaningful_about": "text",
+}
+BULK_UPDATE_LLM_RESULTS_QUERY = f"""
+    UPDATE {result_table_name} AS t
+    SET meaningful_first_name = v.meaningful_first_name,
+        meaningful_last_name = v.meaningful_last_name,
+        meaningful_about = v.meaningful_about,
+        valid = v.valid
+    FROM (VALUES %s) AS v(person_id, meaningful_first_name, meaningful_last_name, meaningful_about, valid)
+    WHERE t.person_id = v.person_id
+    RETURNING t.person_id
 """
-UPDATE_SUMMARY_QUERY = f"""
-    UPDATE {result_table_name}
-    SET summary = %s,
-        urls = %s,
-        confidence = %s
-    WHERE person_id = %s
+BULK_UPDATE_LLM_RESULTS_TEMPLATE = "(%s::bigint, %s::text, %s::text, %s::text, %s::boolean)"
+BULK_UPDATE_SUMMARY_QUERY = f"""
+    UPDATE {result_table_name} AS t
+    SET summary = v.summary,
+        urls = v.urls,
+        confidence = v.confidence
+    FROM (VALUES %s) AS v(person_id, summary, urls, confidence)
+    WHERE t.person_id = v.person_id
 """
+BULK_UPDATE_SUMMARY_TEMPLATE = "(%s::bigint, %s::text, %s::text[], %s::text)"
 UPDATE_PHOTOS_QUERY = f"""
     UPDATE {result_table_name}
     SET photos = %s
     WHERE person_id = %s
 """
+CREATE_JOBS_TABLE_QUERY = f"""
+    CREATE TABLE IF NOT EXISTS {jobs_table_name} (
+        person_id bigint NOT NULL,
+        stage text NOT NULL,
+        status text NOT NULL DEFAULT '{JOB_STATUS_PENDING}',
+        attempts integer NOT NULL DEFAULT 0,
+        worker_id text,
+        lease_expires_at timestamp without time zone,
+        updated_at timestamp without time zone NOT NULL DEFAULT now(),
+        PRIMARY KEY (stage, person_id)
+    );
+    CREATE INDEX IF NOT EXISTS {jobs_table_name}_claim_idx
+    ON {jobs_table_name} (stage, person_id) WHERE status != '{JOB_STATUS_DONE}'
+"""
+# {where} подставляется из JOB_STAGE_FILTERS
+ENQUEUE_JOBS_QUERY = f"""
+    INSERT INTO {jobs_table_name} (person_id, stage)
+    SELECT person_id, %s FROM {result_table_name} WHERE {{where}}
+    ON CONFLICT (stage, person_id) DO NOTHING
+"""
+CLAIM_JOBS_QUERY = f"""
+    UPDATE {jobs_table_name} AS j
+    SET status = '{JOB_STATUS_IN_PROGRESS}',
+        worker_id = %s,
+        attempts = j.attempts + 1,
+        lease_expires_at = now() + make_interval(secs => %s),
+        updated_at = now()
+    WHERE (j.stage, j.person_id) IN (
+        SELECT stage, person_id FROM {jobs_table_name}
+        WHERE stage = %s
+        AND (
+            status = '{JOB_STATUS_PENDING}'
+            OR (status = '{JOB_STATUS_IN_PROGRESS}' AND lease_expires_at < now() AND attempts < %s)
+            OR (status = '{JOB_STATUS_FAILED}' AND attempts < %s)
+        )
+        ORDER BY person_id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING j.person_id
+"""
+COMPLETE_JOBS_QUERY = f"""
+    UPDATE {jobs_table_name}
+    SET status = %s,
+        lease_expires_at = NULL,
+        updated_at = now()
+    WHERE stage = %s AND person_id = ANY(%s) AND worker_id = %s
+"""
+FAIL_EXPIRED_JOBS_QUERY = f"""
+    UPDATE {jobs_table_name}
+    SET status = '{JOB_STATUS_FAILED}',
+        lease_expires_at = NULL,
+        updated_at = now()
+    WHERE stage = %s AND status = '{JOB_STATUS_IN_PROGRESS}'
+    AND lease_expires_at < now() AND attempts >= %s
+"""
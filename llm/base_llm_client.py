@@ -1,10 +1,39 @@
+import asyncio
+import contextvars
 import json
 import logging
+import time
 from typing import Any
 
+import config
+import httpx
 from config import PATH_PROMPTS, LlmConfig
 from jinja2 import Environment, FileSystemLoader
-from openai import AsyncOpenAI, OpenAI
+from llm.concurrency import AdaptiveLimiter, get_limiter
+from llm.endpoints import Endpoint, EndpointPool, get_endpoint_pool
+from llm.rate_limiter import (
+    ModelRateLimiter,
+    estimate_tokens,
+    get_rate_limiter,
+    note_retry_after,
+    retry_after_delay,
+)
+from llm.response_cache import ResponseCache, get_response_cache
+from llm.transport import get_async_http_client, get_sync_http_client, http_timeout
+from llm.usage import UsageTracker, get_usage_tracker
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AsyncOpenAI,
+    AuthenticationError,
+    OpenAI,
+    PermissionDeniedError,
+    RateLimitError,
+)
+
+# Был ли последний ответ запроса к LLM в текущей задаче asyncio (или потоке) взят из кэша
+_served_from_cache: contextvars.ContextVar[bool] = contextvars.ContextVar("llm_served_from_cache", default=False)
 
 
 class BaseLLMClient:
@@ -14,7 +43,9 @@ class BaseLLMClient:
     возвращает безопасные пустые значения.
     Attributes:
         config (LlmConfig): Конфигурация LLM клиента
-        client: Клиент OpenAI
+        endpoint_pool (EndpointPool): Пул точек доступа (base_url, ключ API)
+        usage (UsageTracker): Общий учет токенов, стоимости и задержки вызовов
+        response_cache: Общий персистентный кэш ответов (None, если отключен)
         logger: Логгер для записи событий
     """
 
@@ -24,9 +55,11 @@ class BaseLLMClient:
             config: Конфигурация LLM. Если не указана, используется по умолчанию.
         """
         self.config: LlmConfig = config or LlmConfig()
-        self.client = OpenAI(base_url=self.config.url, api_key=self.config.key)
-        self.async_client = AsyncOpenAI(base_url=self.config.url, api_key=self.config.key)
+        self._clients: dict[str, OpenAI] = {}
+        self._async_clients: dict[str, tuple[httpx.AsyncClient, AsyncOpenAI]] = {}
         self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self.endpoint_pool: EndpointPool = self._build_endpoint_pool()
+        self.usage: UsageTracker = get_usage_tracker(self.config.usage_trace_path)
         self.logger.debug("Базовый LLM клиент инициализирован",
                           extra={"config": self.config}
                           )
@@ -34,6 +67,195 @@ class BaseLLMClient:
             loader=FileSystemLoader(PATH_PROMPTS),
             autoescape=True
         )
+        self.response_cache: ResponseCache | None = None
+        if self.config.cache_enabled:
+            self.response_cache = get_response_cache(
+                self.config.cache_path,
+                self.config.cache_max_entries,
+                self.config.cache_max_age_seconds,
+                self.config.cache_bypass_models
+            )
+
+    def _endpoint_entries(self) -> tuple[tuple[str, str | None, float], ...]:
+        """Разбирает LLM_ENDPOINTS в (base_url, ключ, вес); основная пара url/key — первая.
+        Каждая запись — строго "base_url|api_key" или "base_url|api_key|вес".
+        Raises:
+            ValueError: Запись в другом формате (например, только URL или только ключ)
+        """
+        entries = [(self.config.url, self.config.key, 1.0)]
+        for index, item in enumerate(self.config.extra_endpoints.split(","), start=1):
+            if not item.strip():
+                continue
+            parts = [p.strip() for p in item.split("|")]
+            url, key = parts[0], parts[1] if len(parts) > 1 else ""
+            weight = parts[2] if len(parts) > 2 else "1"
+            # ключ API в сообщение не попадает
+            if len(parts) not in (2, 3) or not url.startswith(("http://", "https://")) or not key:
+                raise ValueError(
+                    f"LLM_ENDPOINTS: запись #{index} должна иметь вид base_url|api_key[|вес]"
+                )
+            try:
+                weight_value = float(weight)
+            except ValueError:
+                weight_value = 0.0
+            if weight_value <= 0:
+                raise ValueError(f"LLM_ENDPOINTS: некорректный вес записи #{index} ({url}): {weight}")
+            entries.append((url, key, weight_value))
+        return tuple(entries)
+
+    def _build_endpoint_pool(self) -> EndpointPool:
+        """Возвращает общий для процесса пул точек доступа из конфигурации."""
+        return get_endpoint_pool(
+            self._endpoint_entries(),
+            config.ENDPOINT_EJECT_AFTER_ERRORS,
+            config.ENDPOINT_EJECT_SECONDS,
+            config.ENDPOINT_MAX_EJECT_SECONDS
+        )
+
+    def client_for(self, endpoint: Endpoint) -> OpenAI:
+        """Синхронный клиент OpenAI точки доступа; создается при первом синхронном вызове."""
+        if endpoint.name not in self._clients:
+            self._clients[endpoint.name] = OpenAI(
+                base_url=endpoint.url, api_key=endpoint.key,
+                http_client=get_sync_http_client(self.config),
+                timeout=http_timeout(self.config)
+            )
+        return self._clients[endpoint.name]
+
+    def async_client_for(self, endpoint: Endpoint) -> AsyncOpenAI:
+        """Асинхронный клиент OpenAI точки доступа поверх общего для процесса HTTP-клиента."""
+        http_client = get_async_http_client(self.config)
+        cached = self._async_clients.get(endpoint.name)
+        if cached is None or cached[0] is not http_client:
+            cached = (http_client, AsyncOpenAI(
+                base_url=endpoint.url, api_key=endpoint.key,
+                http_client=http_client,
+                timeout=http_timeout(self.config)
+            ))
+            self._async_clients[endpoint.name] = cached
+        return cached[1]
+
+    def _limit_key(self, model: str, endpoint: Endpoint) -> str:
+        """Ключ лимитов RPM/TPM и Retry-After: у каждой точки доступа (аккаунта) свои лимиты."""
+        return model if len(self.endpoint_pool) == 1 else f"{model}@{endpoint.name}"
+
+    def _cache_key(self, prompt: str, model: str, response_format: str, temperature: float,
+                   n: int, max_tokens: int | None, extra_body: dict[str, Any] | None) -> str | None:
+        """Возвращает ключ кэша для запроса или None, если кэш для модели не используется."""
+        if self.response_cache is None or not self.response_cache.is_enabled_for(model):
+            return None
+        return ResponseCache.make_key(
+            model, temperature, response_format, prompt,
+            n=n, max_tokens=max_tokens, extra_body=extra_body
+        )
+
+    def _cache_get(self, cache_key: str | None, model: str) -> Any | None:
+        """Возвращает закэшированный completion или None."""
+        if cache_key is None or self.response_cache is None:
+            return None
+        completion = self.response_cache.get(cache_key, model)
+        if completion is not None:
+            self.logger.debug("Ответ LLM взят из кэша", extra={"model": model})
+        return completion
+
+    def _cache_put(self, cache_key: str | None, model: str, completion: Any) -> None:
+        """Сохраняет успешный ответ в кэш (в том числе полученный в обход кэша)."""
+        if cache_key is not None and self.response_cache is not None:
+            self.response_cache.put(cache_key, model, completion)
+
+    def limiter_for(self, model: str,
+                    initial_limit: int = config.ASYNC_LLM_REQUESTS_WORKERS) -> AdaptiveLimiter:
+        """Возвращает общий адаптивный ограничитель параллельности для модели.
+        `initial_limit` учитывается только при первом обращении к модели.
+        Начальный и максимальный лимиты масштабируются на число точек доступа.
+        """
+        endpoints = len(self.endpoint_pool)
+        return get_limiter(
+            model, initial_limit * endpoints,
+            config.ADAPTIVE_MIN_CONCURRENCY, config.ADAPTIVE_MAX_CONCURRENCY * endpoints,
+            decrease_factor=config.ADAPTIVE_DECREASE_FACTOR
+        )
+
+    def _rate_limiter_for(self, model: str, endpoint: Endpoint) -> ModelRateLimiter | None:
+        """Возвращает общий ограничитель RPM/TPM модели на точке доступа или None, если лимиты не заданы."""
+        limits = {
+            self.config.default_model: (self.config.default_rpm, self.config.default_tpm),
+            self.config.check_model: (self.config.check_rpm, self.config.check_tpm),
+            self.config.perplexity_model: (self.config.perplexity_rpm, self.config.perplexity_tpm),
+        }
+        if self.config.cheap_model:
+            limits.setdefault(self.config.cheap_model, (self.config.cheap_rpm, self.config.cheap_tpm))
+        rpm, tpm = limits.get(model, (0, 0))
+        return get_rate_limiter(self._limit_key(model, endpoint), rpm, tpm)
+
+    def _estimate_request_tokens(self, prompt: str, n: int, max_tokens: int | None) -> int:
+        """Оценивает токены запроса: промпт плюс ожидаемый ответ на каждый вариант."""
+        return estimate_tokens(prompt) + n * (max_tokens or self.config.output_tokens_estimate)
+
+    @staticmethod
+    def _retry_after_seconds(exc: APIStatusError) -> float | None:
+        """Достает паузу из заголовков retry-after-ms / retry-after ответа провайдера."""
+        headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except (TypeError, ValueError):
+            pass
+        return None
+
+    def retry_delay(self, model: str) -> float:
+        """Сколько секунд провайдер просил не слать запросы к модели (по Retry-After).
+        При нескольких точках доступа — минимум по ним.
+        """
+        return min(retry_after_delay(self._limit_key(model, e)) for e in self.endpoint_pool.endpoints)
+
+    def _record_outcome(self, model: str, started: float, endpoint: Endpoint,
+                        exc: Exception | None = None, operation: str = "request",
+                        completion: Any = None) -> None:
+        """Передает ограничителю модели и пулу точек доступа задержку или тип ошибки запроса
+        и учитывает вызов в расходе (токены, стоимость, задержка).
+        """
+        latency = time.monotonic() - started
+        self.usage.record(operation, model, latency, completion,
+                          error=type(exc).__name__ if exc is not None else None,
+                          endpoint=endpoint.name)
+        limiter = self.limiter_for(model)
+        if exc is None:
+            limiter.on_success(latency)
+            self.endpoint_pool.on_success(endpoint, latency)
+        elif isinstance(exc, RateLimitError):
+            retry_after = self._retry_after_seconds(exc)
+            if retry_after:
+                note_retry_after(self._limit_key(model, endpoint), retry_after)
+            if self.endpoint_pool.has_alternative(endpoint):
+                # лимит исчерпан у одного ключа — запросы примут другие точки пула
+                self.endpoint_pool.on_error(endpoint, retry_after or config.ENDPOINT_EJECT_SECONDS)
+            else:
+                limiter.on_overload()
+                self.endpoint_pool.on_error(endpoint)
+        elif isinstance(exc, (AuthenticationError, PermissionDeniedError)) or (
+            isinstance(exc, APIStatusError) and exc.status_code == 402
+        ):
+            # отозванный ключ или закончившийся баланс сам не восстановится
+            self.logger.error(f"Точка доступа [{endpoint.name}] отклонила ключ API: {type(exc).__name__}")
+            self.endpoint_pool.on_error(endpoint, config.ENDPOINT_AUTH_EJECT_SECONDS)
+        elif isinstance(exc, (APITimeoutError, APIConnectionError)) or (
+            isinstance(exc, APIStatusError) and exc.status_code >= 500
+        ):
+            limiter.on_error()
+            self.endpoint_pool.on_error(endpoint)
+
+    @staticmethod
+    def last_response_cached() -> bool:
+        """Взят ли из кэша последний ответ _request_llm/_async_request_llm в текущей задаче."""
+        return _served_from_cache.get()
+
+    def log_cache_stats(self) -> None:
+        """Выводит в лог статистику попаданий в кэш ответов."""
+        if self.response_cache is not None:
+            self.response_cache.log_stats()
 
     def _safe_parse_json(self, raw: str | None) -> dict[str, Any]:
         """Безопасно парсит JSON строку.
@@ -81,6 +303,8 @@ class BaseLLMClient:
         n: int = 1,
         max_tokens: int | None = None,
         extra_body: dict[str, Any] | None = None,
+        use_cache: bool = True,
+        operation: str = "request",
     ) -> tuple[Any, Any | None]:
         """Универсальный метод выполнения запроса к LLM.
         Возвращает кортеж (parsed_content_or_raw, raw_completion_object_or_None).
@@ -94,6 +318,9 @@ class BaseLLMClient:
             n: Количество вариантов ответа
             max_tokens: Максимальное количество токенов в ответе
             extra_body: Дополнительные параметры для запроса
+            use_cache: Брать ответ из кэша, если он есть. Успешный ответ
+                       сохраняется в кэш в любом случае.
+            operation: Имя операции для учета расхода (обычно имя промпта)
         Returns:
             Tuple[Any, Optional[Any]]: Кортеж (результат, объект completion или None)
         """
@@ -116,17 +343,45 @@ class BaseLLMClient:
 
             rf = {"type": response_format} if response_format == "json_object" else None
 
-            self.logger.debug("Вызов OpenAI.chat.completions.create",
-                    extra={"body_preview": {k: body.get(k) for k in list(body)[:5]}}
-                    )
-            completion = self.client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                response_format=rf,
-                temperature=temperature,
-                n=n,
-                extra_body=body or None,
-            )
+            cache_key = self._cache_key(prompt, model, response_format, temperature,
+                                        n, max_tokens, extra_body)
+            completion = self._cache_get(cache_key, model) if use_cache else None
+            from_cache = completion is not None
+            _served_from_cache.set(from_cache)
+            if from_cache:
+                self.usage.record_cache_hit(operation, model)
+            else:
+                self.logger.debug("Вызов OpenAI.chat.completions.create",
+                        extra={"body_preview": {k: body.get(k) for k in list(body)[:5]}}
+                        )
+                endpoint = self.endpoint_pool.acquire()
+                try:
+                    rate_limiter = self._rate_limiter_for(model, endpoint)
+                    estimated_tokens = self._estimate_request_tokens(prompt, n, max_tokens)
+                    wait = retry_after_delay(self._limit_key(model, endpoint))
+                    if rate_limiter is not None:
+                        wait = max(wait, rate_limiter.reserve(estimated_tokens))
+                    if wait > 0:
+                        time.sleep(wait)
+                    started = time.monotonic()
+                    try:
+                        completion = self.client_for(endpoint).chat.completions.create(
+                            model=model,
+                            messages=[{"role": "user", "content": prompt}],
+                            response_format=rf,
+                            temperature=temperature,
+                            n=n,
+                            extra_body=body or None,
+                        )
+                    except Exception as exc:
+                        self._record_outcome(model, started, endpoint, exc, operation)
+                        raise
+                    self._record_outcome(model, started, endpoint, operation=operation,
+                                         completion=completion)
+                finally:
+                    self.endpoint_pool.release(endpoint)
+                if rate_limiter is not None:
+                    rate_limiter.record_usage(estimated_tokens, completion)
 
             content = getattr(getattr(completion, "choices", [None])[0], "message", None)
             raw_text: str | None = None
@@ -141,12 +396,16 @@ class BaseLLMClient:
                 self.logger.debug("LLM вернул JSON объект",
                                  extra={"parsed_keys": list(parsed.keys())}
                                  )
+                if parsed and not from_cache:
+                    self._cache_put(cache_key, model, completion)
                 return parsed, completion
 
             text_result = raw_text or ""
             self.logger.debug("LLM вернул текстовый ответ",
                              extra={"length": len(text_result)}
                              )
+            if text_result and not from_cache:
+                self._cache_put(cache_key, model, completion)
             return text_result, completion
 
         except Exception as exc:
@@ -167,6 +426,8 @@ class BaseLLMClient:
         n: int = 1,
         max_tokens: int | None = None,
         extra_body: dict[str, Any] | None = None,
+        use_cache: bool = True,
+        operation: str = "request",
     ) -> tuple[Any, Any | None]:
         """
         (async) _request_llm
@@ -187,16 +448,45 @@ class BaseLLMClient:
 
             rf = {"type": response_format} if response_format == "json_object" else None
 
-            self.logger.debug("Асинхронный вызов OpenAI.chat.completions.create")
+            cache_key = self._cache_key(prompt, model, response_format, temperature,
+                                        n, max_tokens, extra_body)
+            completion = self._cache_get(cache_key, model) if use_cache else None
+            from_cache = completion is not None
+            _served_from_cache.set(from_cache)
+            if from_cache:
+                self.usage.record_cache_hit(operation, model)
+            else:
+                self.logger.debug("Асинхронный вызов OpenAI.chat.completions.create")
 
-            completion = await self.async_client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                response_format=rf,
-                temperature=temperature,
-                n=n,
-                extra_body=body or None,
-            )
+                # точка выбирается до ожидания лимитов: ожидающий запрос тоже ее нагрузка
+                endpoint = self.endpoint_pool.acquire()
+                try:
+                    rate_limiter = self._rate_limiter_for(model, endpoint)
+                    estimated_tokens = self._estimate_request_tokens(prompt, n, max_tokens)
+                    wait = retry_after_delay(self._limit_key(model, endpoint))
+                    if rate_limiter is not None:
+                        wait = max(wait, rate_limiter.reserve(estimated_tokens))
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    started = time.monotonic()
+                    try:
+                        completion = await self.async_client_for(endpoint).chat.completions.create(
+                            model=model,
+                            messages=[{"role": "user", "content": prompt}],
+                            response_format=rf,
+                            temperature=temperature,
+                            n=n,
+                            extra_body=body or None,
+                        )
+                    except Exception as exc:
+                        self._record_outcome(model, started, endpoint, exc, operation)
+                        raise
+                    self._record_outcome(model, started, endpoint, operation=operation,
+                                         completion=completion)
+                finally:
+                    self.endpoint_pool.release(endpoint)
+                if rate_limiter is not None:
+                    rate_limiter.record_usage(estimated_tokens, completion)
 
             content = getattr(getattr(completion, "choices", [None])[0], "message", None)
             raw_text: str | None = None
@@ -209,8 +499,12 @@ class BaseLLMClient:
 
             if response_format == "json_object":
                 parsed = self._safe_parse_json(raw_text)
+                if parsed and not from_cache:
+                    self._cache_put(cache_key, model, completion)
                 return parsed, completion
 
+            if raw_text and not from_cache:
+                self._cache_put(cache_key, model, completion)
             return raw_text or "", completion
 
         except Exception as exc:
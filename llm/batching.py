@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+
+class MicroBatcher:
+    """Собирает одиночные асинхронные вызовы в пакеты.
+    Вызовы `submit` от разных корутин копятся в общем пакете, который
+    отправляется обработчику, когда набралось `max_size` элементов или
+    с момента первого элемента прошло `max_delay` секунд. Каждый вызов
+    получает свой результат из ответа обработчика.
+    Attributes:
+        name (str): Имя для логов
+        max_size (int): Максимальный размер пакета
+        size_limit (Callable[[], int] | None): Текущий предел размера пакета (например,
+            лимит параллельности вызывающих), чтобы пакет мог набраться без ожидания
+        max_delay (float): Максимальное ожидание наполнения пакета в секундах
+        batches (int): Количество отправленных пакетов
+        items (int): Количество обработанных элементов
+        logger: Логгер для записи событий
+    """
+
+    def __init__(self, handler: Callable[[list[Any]], Awaitable[list[Any]]],
+                 max_size: int, max_delay: float, name: str = "batch",
+                 size_limit: Callable[[], int] | None = None) -> None:
+        """Инициализация сборщика.
+        Args:
+            handler: Корутина, обрабатывающая список элементов и возвращающая
+                     список результатов в том же порядке
+            max_size: Максимальный размер пакета
+            max_delay: Максимальное ожидание наполнения пакета в секундах
+            name: Имя для логов
+            size_limit: Текущий предел размера пакета (если не указан, только max_size)
+        """
+        self.handler = handler
+        self.max_size = max(1, max_size)
+        self.max_delay = max_delay
+        self.name = name
+        self.size_limit = size_limit
+        self.batches = 0
+        self.items = 0
+        self._pending: list[tuple[Any, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+    async def submit(self, item: Any) -> Any:
+        """(async) Добавляет элемент в текущий пакет и ждет его результат."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.batch_size():
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    def batch_size(self) -> int:
+        """Размер, при котором пакет отправляется сразу: max_size, ограниченный size_limit."""
+        if self.size_limit is None:
+            return self.max_size
+        return max(1, min(self.max_size, self.size_limit()))
+
+    def _flush(self) -> None:
+        """Отправляет накопленный пакет обработчику в отдельной задаче."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[Any, asyncio.Future]]) -> None:
+        """(async) Обрабатывает пакет и раздает результаты ожидающим."""
+        self.batches += 1
+        self.items += len(batch)
+        self.logger.debug(f"Пакет [{self.name}]: {len(batch)} элементов")
+        try:
+            results = await self.handler([item for item, _ in batch])
+            for (_, future), result in zip(batch, results, strict=True):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+
+    async def aclose(self) -> None:
+        """(async) Отправляет остаток и дожидается всех пакетов."""
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def log_stats(self) -> None:
+        """Выводит в лог количество элементов и пакетов."""
+        if self.batches:
+            self.logger.info(
+                f"Пакетирование [{self.name}]: {self.items} элементов в {self.batches} запросах "
+                f"(в среднем {self.items / self.batches:.1f})"
+            )
@@ -0,0 +1,66 @@
+from collections.abc import Callable
+from typing import Any
+
+
+class ChunkPacker:
+    """Упаковывает записи в чанки по оценке токенов запроса.
+    Записи добавляются по одной; чанк закрывается, когда следующая запись
+    не помещается в бюджет токенов (промпт + ожидаемый ответ) или достигнут
+    предел количества записей. Запись, которая одна превышает бюджет,
+    уходит отдельным чанком.
+    Attributes:
+        token_budget (int): Бюджет токенов на один запрос
+        max_size (int): Максимальное количество записей в чанке
+        overhead_tokens (int): Токены шаблона промпта без данных
+        chunks (int): Количество выданных чанков
+        rows (int): Количество записей в выданных чанках
+    """
+
+    def __init__(self, token_budget: int, max_size: int, overhead_tokens: int,
+                 row_tokens: Callable[[dict[str, Any]], int]) -> None:
+        """Инициализация упаковщика.
+        Args:
+            token_budget: Бюджет токенов на один запрос
+            max_size: Максимальное количество записей в чанке
+            overhead_tokens: Токены шаблона промпта без данных
+            row_tokens: Оценка токенов одной записи (вход + ответ)
+        """
+        self.token_budget = token_budget
+        self.max_size = max_size
+        self.overhead_tokens = overhead_tokens
+        self.row_tokens = row_tokens
+        self.chunks = 0
+        self.rows = 0
+        self._batch: list[dict[str, Any]] = []
+        self._batch_tokens = overhead_tokens
+
+    def add(self, row: dict[str, Any]) -> list[dict[str, Any]] | None:
+        """Добавляет запись. Возвращает закрытый чанк, если запись в него не поместилась."""
+        tokens = self.row_tokens(row)
+        ready = None
+        if self._batch and (
+            len(self._batch) >= self.max_size
+            or self._batch_tokens + tokens > self.token_budget
+        ):
+            ready = self.flush()
+        self._batch.append(row)
+        self._batch_tokens += tokens
+        return ready
+
+    def flush(self) -> list[dict[str, Any]] | None:
+        """Закрывает текущий чанк и возвращает его (None, если он пуст)."""
+        if not self._batch:
+            return None
+        batch = self._batch
+        self.chunks += 1
+        self.rows += len(batch)
+        self._batch = []
+        self._batch_tokens = self.overhead_tokens
+        return batch
+
+    def pack(self, rows: list[dict[str, Any]]) -> list[list[dict[str, Any]]]:
+        """Упаковывает готовый список записей целиком."""
+        batches = [batch for row in rows if (batch := self.add(row))]
+        if last := self.flush():
+            batches.append(last)
+        return batches
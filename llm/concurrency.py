@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+from typing import Any
+
+
+class AdaptiveLimiter:
+    """Адаптивный ограничитель числа одновременных запросов к модели (AIMD).
+    Лимит растет аддитивно (примерно на 1 за каждое «окно» успешных запросов)
+    и уменьшается мультипликативно только при ответах 429/5xx и таймаутах:
+    задержка LLM сильно зависит от длины ответа и сигналом перегрузки
+    не является (учитывается только для логов). Используется как
+    замена asyncio.Semaphore: тот же интерфейс acquire()/release() и
+    асинхронный контекстный менеджер.
+    Attributes:
+        name (str): Имя ограничителя (обычно название модели)
+        limit (float): Текущий лимит одновременных запросов
+        in_flight (int): Количество выполняющихся запросов
+        logger: Логгер для записи событий
+    """
+
+    def __init__(self, name: str, initial_limit: int, min_limit: int, max_limit: int,
+                 decrease_factor: float = 0.5, cooldown_seconds: float = 1.0) -> None:
+        """Инициализация ограничителя.
+        Args:
+            name: Имя ограничителя для логов
+            initial_limit: Начальный лимит
+            min_limit: Минимальный лимит
+            max_limit: Максимальный лимит
+            decrease_factor: Множитель лимита при перегрузке (429/5xx)
+            cooldown_seconds: Минимальный интервал между двумя снижениями лимита
+        """
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.decrease_factor = decrease_factor
+        self.cooldown_seconds = cooldown_seconds
+        self.in_flight = 0
+        self.successes = 0
+        self.overloads = 0
+        self.errors = 0
+        self._smoothed_latency: float | None = None
+        self._last_decrease = 0.0
+        self._released = asyncio.Event()
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+    async def acquire(self) -> None:
+        """(async) Ожидает свободный слот в пределах текущего лимита."""
+        while self.in_flight >= int(self.limit):
+            self._released.clear()
+            await self._released.wait()
+        self.in_flight += 1
+
+    def release(self) -> None:
+        """Освобождает слот и будит ожидающих."""
+        self.in_flight -= 1
+        self._released.set()
+
+    async def __aenter__(self) -> "AdaptiveLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.release()
+
+    def on_success(self, latency: float) -> None:
+        """Учитывает успешный запрос: лимит растет аддитивно, задержка идет только в статистику."""
+        self.successes += 1
+        self._smoothed_latency = (
+            latency if self._smoothed_latency is None
+            else 0.8 * self._smoothed_latency + 0.2 * latency
+        )
+        self._set_limit(self.limit + 1 / self.limit)
+
+    def on_overload(self) -> None:
+        """Учитывает ответ 429 (превышение лимита провайдера)."""
+        self.overloads += 1
+        self._decrease(self.decrease_factor, "ответ 429")
+
+    def on_error(self) -> None:
+        """Учитывает ответ 5xx или таймаут."""
+        self.errors += 1
+        self._decrease(self.decrease_factor, "ошибка сервера")
+
+    def _decrease(self, factor: float, reason: str) -> None:
+        """Уменьшает лимит не чаще раза за cooldown_seconds."""
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown_seconds:
+            return
+        self._last_decrease = now
+        self._set_limit(self.limit * factor, reason)
+
+    def _set_limit(self, value: float, reason: str | None = None) -> None:
+        """Устанавливает лимит в допустимых границах и логирует изменение целой части."""
+        old_limit = int(self.limit)
+        self.limit = min(max(value, self.min_limit), self.max_limit)
+        if int(self.limit) != old_limit:
+            self.logger.info(
+                f"Лимит параллельности [{self.name}]: {old_limit} → {int(self.limit)}"
+                + (f" ({reason})" if reason else "")
+            )
+
+    def snapshot(self) -> dict[str, Any]:
+        """Текущее состояние ограничителя для логов и метрик."""
+        return {
+            "name": self.name,
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "successes": self.successes,
+            "overloads": self.overloads,
+            "errors": self.errors,
+            "smoothed_latency": self._smoothed_latency,
+        }
+
+
+_limiters: dict[str, AdaptiveLimiter] = {}
+
+
+def get_limiter(model: str, initial_limit: int, min_limit: int, max_limit: int,
+                **kwargs: Any) -> AdaptiveLimiter:
+    """Возвращает общий для процесса ограничитель модели, создавая его при первом обращении."""
+    if model not in _limiters:
+        _limiters[model] = AdaptiveLimiter(model, initial_limit, min_limit, max_limit, **kwargs)
+    return _limiters[model]
+
+
+def log_limiter_stats() -> None:
+    """Выводит в лог состояние всех ограничителей."""
+    logger = logging.getLogger(__name__)
+    for limiter in _limiters.values():
+        stats = limiter.snapshot()
+        logger.info(
+            f"Параллельность [{stats['name']}]: лимит {stats['limit']}, "
+            f"успешно {stats['successes']}, 429: {stats['overloads']}, ошибок: {stats['errors']}"
+        )
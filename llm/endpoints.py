@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class Endpoint:
+    """Точка доступа к LLM: base_url и ключ API.
+    Attributes:
+        name (str): Имя для логов и ключей лимитов (хост и номер, без ключа API)
+        url (str): base_url провайдера
+        key (str | None): Ключ API
+        weight (float): Вес при распределении запросов
+        outstanding (int): Количество выполняющихся запросов
+        requests (int): Всего запросов
+        errors (int): Всего ошибок (401/402/403, 429, 5xx, таймауты, обрывы соединения)
+        consecutive_errors (int): Ошибок подряд
+        ejections (int): Сколько раз точка исключалась из пула
+        eject_streak (int): Исключений подряд без успешного ответа (для удвоения времени)
+        ejected_until (float): До какого момента (time.monotonic) точка исключена
+        successes (int): Успешных запросов
+        latency_total (float): Суммарная задержка успешных запросов
+    """
+
+    def __init__(self, name: str, url: str, key: str | None, weight: float = 1.0) -> None:
+        self.name = name
+        self.url = url
+        self.key = key
+        self.weight = weight if weight > 0 else 1.0
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.ejections = 0
+        self.eject_streak = 0
+        self.ejected_until = 0.0
+        self.latency_total = 0.0
+        self.successes = 0
+
+    def is_healthy(self, now: float) -> bool:
+        """Не исключена ли точка из пула в момент `now`."""
+        return now >= self.ejected_until
+
+
+class EndpointPool:
+    """Пул точек доступа к LLM с балансировкой по наименьшей нагрузке.
+    Запрос уходит в здоровую точку с наименьшим числом выполняющихся запросов
+    относительно ее веса. После `eject_after_errors` ошибок подряд (или сразу
+    при 429) точка исключается на время, которое удваивается при повторных
+    исключениях; по его истечении точка снова получает запросы, и первый
+    успешный ответ сбрасывает счетчики.
+    Attributes:
+        endpoints (list[Endpoint]): Точки доступа пула
+        logger: Логгер для записи событий
+    """
+
+    def __init__(self, endpoints: list[Endpoint], eject_after_errors: int,
+                 eject_seconds: float, max_eject_seconds: float) -> None:
+        """Инициализация пула.
+        Args:
+            endpoints: Точки доступа (не пустой список)
+            eject_after_errors: Сколько ошибок подряд исключают точку из пула
+            eject_seconds: Базовое время исключения
+            max_eject_seconds: Максимальное время исключения
+        """
+        self.endpoints = endpoints
+        self.eject_after_errors = max(1, eject_after_errors)
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max(eject_seconds, max_eject_seconds)
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def acquire(self) -> Endpoint:
+        """Выбирает точку для запроса и учитывает его как выполняющийся."""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [e for e in self.endpoints if e.is_healthy(now)]
+            if healthy:
+                endpoint = min(healthy, key=lambda e: ((e.outstanding + 1) / e.weight, e.requests))
+            else:
+                # все исключены — запрос в точку, которая вернется в пул раньше остальных
+                endpoint = min(self.endpoints, key=lambda e: e.ejected_until)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint: Endpoint) -> None:
+        """Снимает запрос с точки (вызывается и при ошибке, и при отмене)."""
+        with self._lock:
+            endpoint.outstanding = max(0, endpoint.outstanding - 1)
+
+    def has_alternative(self, endpoint: Endpoint) -> bool:
+        """Есть ли в пуле другая здоровая точка."""
+        now = time.monotonic()
+        return any(e is not endpoint and e.is_healthy(now) for e in self.endpoints)
+
+    def on_success(self, endpoint: Endpoint, latency: float) -> None:
+        """Учитывает успешный ответ: сбрасывает серию ошибок точки."""
+        with self._lock:
+            endpoint.successes += 1
+            endpoint.latency_total += latency
+            readmitted = endpoint.eject_streak > 0
+            endpoint.consecutive_errors = 0
+            endpoint.eject_streak = 0
+        if readmitted:
+            self.logger.info(f"Точка доступа [{endpoint.name}] снова в пуле")
+
+    def on_error(self, endpoint: Endpoint, eject_seconds: float | None = None) -> None:
+        """Учитывает ошибку точки.
+        Args:
+            endpoint: Точка доступа
+            eject_seconds: Исключить точку сразу на это время (например, по Retry-After);
+                           если не задано, точка исключается после серии ошибок
+        """
+        with self._lock:
+            endpoint.errors += 1
+            endpoint.consecutive_errors += 1
+            if eject_seconds is None and endpoint.consecutive_errors < self.eject_after_errors:
+                return
+            if eject_seconds is None:
+                eject_seconds = min(self.max_eject_seconds,
+                                    self.eject_seconds * 2 ** endpoint.eject_streak)
+            endpoint.ejections += 1
+            endpoint.eject_streak += 1
+            endpoint.ejected_until = max(endpoint.ejected_until, time.monotonic() + eject_seconds)
+        self.logger.warning(
+            f"Точка доступа [{endpoint.name}] исключена из пула на {eject_seconds:.0f} с "
+            f"(ошибок подряд: {endpoint.consecutive_errors})"
+        )
+
+    def log_stats(self) -> None:
+        """Выводит в лог статистику по точкам доступа."""
+        if len(self.endpoints) < 2:
+            return
+        for e in self.endpoints:
+            avg = e.latency_total / e.successes if e.successes else 0.0
+            self.logger.info(
+                f"Точка доступа [{e.name}]: запросов {e.requests}, успешно {e.successes}, "
+                f"ошибок {e.errors}, исключений {e.ejections}, средняя задержка {avg:.2f} с"
+            )
+
+
+def build_endpoints(entries: tuple[tuple[str, str | None, float], ...]) -> list[Endpoint]:
+    """Создает точки доступа из (base_url, key, weight), нумеруя их в пределах хоста."""
+    endpoints: list[Endpoint] = []
+    seen: dict[str, int] = {}
+    for url, key, weight in entries:
+        host = urlparse(url).netloc or url
+        seen[host] = seen.get(host, 0) + 1
+        endpoints.append(Endpoint(f"{host}#{seen[host]}", url, key, weight))
+    return endpoints
+
+
+_pools: dict[tuple, EndpointPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_endpoint_pool(entries: tuple[tuple[str, str | None, float], ...], eject_after_errors: int,
+                      eject_seconds: float, max_eject_seconds: float) -> EndpointPool:
+    """Возвращает общий для процесса пул точек доступа, создавая его при первом обращении."""
+    with _pools_lock:
+        if entries not in _pools:
+            _pools[entries] = EndpointPool(build_endpoints(entries), eject_after_errors,
+                                           eject_seconds, max_eject_seconds)
+        return _pools[entries]
+
+
+def log_endpoint_stats() -> None:
+    """Выводит в лог статистику всех пулов."""
+    for pool in _pools.values():
+        pool.log_stats()
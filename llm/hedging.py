@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+
+class HedgePolicy:
+    """Хеджирование медленных запросов.
+    Если запрос не вернулся за `percentile`-й перцентиль недавних задержек,
+    отправляется его дубликат; побеждает первый успешный ответ, проигравший
+    запрос отменяется. Доля дубликатов ограничена бюджетом `budget`
+    от числа запросов.
+    Attributes:
+        name (str): Имя для логов
+        percentile (float): Перцентиль задержки, после которого отправляется дубликат
+        budget (float): Максимальная доля дубликатов от числа запросов
+        requests (int): Количество запросов
+        fired (int): Количество отправленных дубликатов
+        wins (int): Сколько раз дубликат ответил раньше исходного запроса
+        skipped (int): Сколько дубликатов не отправлено из-за бюджета
+        logger: Логгер для записи событий
+    """
+
+    def __init__(self, name: str, percentile: float, budget: float, min_samples: int,
+                 window: int, min_delay: float) -> None:
+        """Инициализация.
+        Args:
+            name: Имя для логов (обычно модель)
+            percentile: Перцентиль задержки (0–100)
+            budget: Максимальная доля дубликатов (0.1 — не больше 10% от запросов)
+            min_samples: Сколько задержек нужно накопить до первого дубликата
+            window: Сколько последних задержек учитывать
+            min_delay: Минимальное ожидание перед дубликатом в секундах
+        """
+        self.name = name
+        self.percentile = min(max(percentile, 0.0), 100.0)
+        self.budget = budget
+        self.min_samples = max(1, min_samples)
+        self.min_delay = min_delay
+        self.requests = 0
+        self.fired = 0
+        self.wins = 0
+        self.skipped = 0
+        self._latencies: deque[float] = deque(maxlen=window)
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+    def hedge_delay(self) -> float | None:
+        """Через сколько секунд отправлять дубликат (None — данных пока мало)."""
+        if len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        idx = min(len(ordered) - 1, math.ceil(self.percentile / 100 * len(ordered)) - 1)
+        return max(self.min_delay, ordered[max(idx, 0)])
+
+    def _budget_allows(self) -> bool:
+        return self.fired < self.budget * self.requests
+
+    async def run(self, call: Callable[[], Awaitable[Any]],
+                  is_ok: Callable[[Any], bool] = lambda _: True) -> Any:
+        """(async) Выполняет вызов с хеджированием.
+        Args:
+            call: Фабрика корутины запроса (вызывается для исходного запроса и дубликата)
+            is_ok: Признак успешного результата; неуспешный ответ не побеждает,
+                   пока другой запрос еще выполняется
+        Returns:
+            Результат первого успешного запроса (или последнего, если успешных нет)
+        """
+        self.requests += 1
+        started = time.monotonic()
+        primary = asyncio.ensure_future(call())
+        tasks = [primary]
+        try:
+            delay = self.hedge_delay()
+            if delay is not None:
+                await asyncio.wait({primary}, timeout=delay)
+            if delay is None or primary.done():
+                return self._observe(await primary, started, is_ok)
+            if not self._budget_allows():
+                self.skipped += 1
+                return self._observe(await primary, started, is_ok)
+
+            self.fired += 1
+            self.logger.debug(f"Хедж [{self.name}]: запрос дольше {delay:.1f} с, отправлен дубликат")
+            hedge = asyncio.ensure_future(call())
+            tasks.append(hedge)
+            pending: set[asyncio.Future] = {primary, hedge}
+            result: Any = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # при одновременном завершении предпочитаем исходный запрос
+                for task in sorted(done, key=lambda t: t is not primary):
+                    result = task.result()
+                    if is_ok(result):
+                        if task is hedge:
+                            self.wins += 1
+                        return self._observe(result, started, is_ok)
+            return result
+        finally:
+            # проигравший запрос (или оба при отмене вызывающего) отменяется
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def _observe(self, result: Any, started: float, is_ok: Callable[[Any], bool]) -> Any:
+        """Учитывает задержку успешного ответа (от старта исходного запроса)."""
+        if is_ok(result):
+            self._latencies.append(time.monotonic() - started)
+        return result
+
+    def log_stats(self) -> None:
+        """Выводит в лог число дубликатов и побед."""
+        if not self.requests:
+            return
+        self.logger.info(
+            f"Хеджирование [{self.name}]: дубликатов {self.fired}/{self.requests} "
+            f"({self.fired / self.requests:.0%}), побед дубликата {self.wins}, "
+            f"пропущено по бюджету {self.skipped}"
+        )
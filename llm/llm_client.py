@@ -1,8 +1,25 @@
+import asyncio
 import json
+import time
+from collections import Counter
+from collections.abc import Callable
 from typing import Any
 
+import config
 from config import LlmConfig
 from llm.base_llm_client import BaseLLMClient
+from llm.batching import MicroBatcher
+from llm.chunking import ChunkPacker
+from llm.prefilter import SummaryPrefilter
+from llm.rate_limiter import estimate_tokens
+
+# Короткие ключи компактного формата чанков (LLM_CHUNK_FORMAT=compact)
+COMPACT_INPUT_KEYS = {"first_name": "f", "last_name": "l", "about": "a"}
+COMPACT_OUTPUT_KEYS = {
+    "f": "meaningful_first_name",
+    "l": "meaningful_last_name",
+    "a": "meaningful_about",
+}
 
 
 class LlmClient(BaseLLMClient):
@@ -11,6 +28,12 @@ class LlmClient(BaseLLMClient):
     из конфигурации для обработки запросов к языковым моделям.
     Attributes:
         config (LlmConfig): Конфигурация LLM клиента
+        chunk_usage (Counter): Фактический расход токенов на чанки parse_chunk
+        cascade_stats (Counter): Счетчики каскада моделей parse_chunk
+        postcheck_batcher (MicroBatcher | None): Сборщик пакетов postcheck (создается при первом вызове)
+        postcheck_size_limit (Callable[[], int] | None): Текущий предел размера пакета postcheck
+            (параллельность этапа, из которого идут проверки)
+        summary_prefilter (SummaryPrefilter): Локальный предфильтр перед postcheck
         logger: Логгер для записи событий
     """
 
@@ -20,6 +43,11 @@ class LlmClient(BaseLLMClient):
             config: Конфигурация LLM. Если не указана, используется по умолчанию.
         """
         super().__init__(config=config)
+        self.chunk_usage: Counter[str] = Counter()
+        self.cascade_stats: Counter[str] = Counter()
+        self.postcheck_batcher: MicroBatcher | None = None
+        self.postcheck_size_limit: Callable[[], int] | None = None
+        self.summary_prefilter = SummaryPrefilter()
         self.logger.debug("LlmClient инициализирован",
                           extra={"default_model": self.config.default_model})
 
@@ -43,6 +71,7 @@ class LlmClient(BaseLLMClient):
             model=self.config.default_model,
             response_format=response_format,
             temperature=temperature,
+            operation="ask_llm",
         )
         return result
 
@@ -55,28 +84,126 @@ class LlmClient(BaseLLMClient):
         Returns:
             Dict[str, Any]: Словарь с обработанными данными или пустой словарь при ошибке
         """
+        prompt = self._build_chunk_prompt(chunk)
+        if not prompt:
+            return {}
+
+        self.logger.debug("Вызов LLM для parse_chunk_to_meaningful",
+                          extra={"chunk_size": len(chunk)}
+                          )
+        response, completion = self._request_llm(
+            prompt=prompt,
+            model=self.config.default_model,
+            response_format="json_object",
+            operation="parse_chunk",
+        )
+        if not isinstance(response, dict):
+            self.logger.warning("Ожидался словарь, но получен другой тип; возвращаем {}.")
+            return {}
+        self._record_chunk_usage(len(chunk), completion)
+        return self._decode_chunk_response(chunk, response)
+
+    @property
+    def compact_chunks(self) -> bool:
+        """Используется ли компактный формат чанков (LLM_CHUNK_FORMAT=compact)."""
+        return self.config.chunk_format == "compact"
+
+    def _encode_chunk(self, chunk: dict[Any, dict[str, Any]]) -> str:
+        """Сериализует чанк для промпта.
+        В компактном формате person_id не передается (его заменяет номер записи),
+        поля получают короткие ключи, пустые поля опускаются.
+        """
+        if not self.compact_chunks:
+            return json.dumps(chunk, ensure_ascii=False)
+        compact = {
+            str(index): {
+                short: value
+                for field, short in COMPACT_INPUT_KEYS.items()
+                if (value := (row.get(field) or "").strip())
+            }
+            for index, row in chunk.items()
+        }
+        return json.dumps(compact, ensure_ascii=False, separators=(",", ":"))
+
+    def _build_chunk_prompt(self, chunk: dict[Any, dict[str, Any]]) -> str:
+        """Рендерит промпт parse_chunk для чанка (пустая строка при ошибке)."""
         try:
-            chunk_json = json.dumps(chunk, ensure_ascii=False)
+            chunk_json = self._encode_chunk(chunk)
         except Exception as exc:
             self.logger.error("Chunk не может быть сериализован в JSON; "
                             "возвращаем пустой результат.", exc_info=exc
                             )
-            return {}
-
-        prompt = self._render_prompt(
+            return ""
+        return self._render_prompt(
             "parse_chunk",
             chunk_size=len(chunk),
-            chunk_json=chunk_json
+            chunk_json=chunk_json,
+            compact=self.compact_chunks
         )
 
-        self.logger.debug("Вызов ask_llm для parse_names_and_about_chunk",
-                          extra={"chunk_size": len(chunk)}
-                          )
-        response = self.ask_llm(prompt, response_format="json_object")
-        if not isinstance(response, dict):
-            self.logger.warning("Ожидался словарь, но получен другой тип; возвращаем {}.")
-            return {}
-        return response
+    def _decode_chunk_response(self, chunk: dict[Any, dict[str, Any]],
+                               response: dict[str, Any]) -> dict[str, Any]:
+        """Приводит ответ LLM к полному формату {index: {person_id, meaningful_*}}.
+        Компактный ответ разбирается строго: принимаются только номера записей
+        из чанка и строковые значения коротких ключей, person_id
+        восстанавливается по номеру записи.
+        """
+        if not self.compact_chunks:
+            return response
+        person_ids = {str(index): row.get("person_id") for index, row in chunk.items()}
+        decoded: dict[str, Any] = {}
+        for index, item in response.items():
+            if index not in person_ids or not isinstance(item, dict):
+                self.logger.warning(f"Пропуск элемента компактного ответа с ключом {index!r}.")
+                continue
+            decoded[index] = {"person_id": person_ids[index]}
+            for short, field in COMPACT_OUTPUT_KEYS.items():
+                value = item.get(short)
+                decoded[index][field] = value.strip() if isinstance(value, str) else ""
+        return decoded
+
+    def _record_chunk_usage(self, rows: int, completion: Any) -> None:
+        """Накапливает фактический расход токенов на записи чанков (для сравнения форматов).
+        Ответы из кэша учитываются отдельно: их токены уже были оплачены и исказили бы сравнение.
+        """
+        if self.last_response_cached():
+            self.chunk_usage["cached_requests"] += 1
+            return
+        usage = getattr(completion, "usage", None)
+        if usage is None:
+            return
+        self.chunk_usage["requests"] += 1
+        self.chunk_usage["rows"] += rows
+        self.chunk_usage["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+        self.chunk_usage["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+
+    def log_chunk_usage(self) -> None:
+        """Выводит в лог средний расход токенов на запись в текущем формате чанков."""
+        rows = self.chunk_usage["rows"]
+        if not rows:
+            return
+        self.logger.info(
+            f"Формат чанков {self.config.chunk_format}: {self.chunk_usage['requests']} запросов, "
+            f"в среднем {self.chunk_usage['prompt_tokens'] / rows:.1f} токенов промпта и "
+            f"{self.chunk_usage['completion_tokens'] / rows:.1f} токенов ответа на запись "
+            f"(ответов из кэша не учтено: {self.chunk_usage['cached_requests']})."
+        )
+
+    def estimate_chunk_row_tokens(self, row: dict[str, Any]) -> int:
+        """Оценивает токены одной записи чанка: ее JSON во входе и ожидаемый ответ."""
+        input_tokens = estimate_tokens(self._encode_chunk({0: row}))
+        output_tokens = (
+            config.CHUNK_OUTPUT_TOKENS_PER_ROW
+            + estimate_tokens(f"{row.get('first_name') or ''} {row.get('last_name') or ''}")
+            + min(estimate_tokens(row.get("about")), config.CHUNK_OUTPUT_ABOUT_TOKENS)
+        )
+        return input_tokens + output_tokens
+
+    def chunk_packer(self, token_budget: int = config.CHUNK_TOKEN_BUDGET,
+                     max_size: int = config.CHUNK_SIZE) -> ChunkPacker:
+        """Создает упаковщик записей в чанки для parse_chunk по бюджету токенов."""
+        overhead_tokens = estimate_tokens(self._build_chunk_prompt({}))
+        return ChunkPacker(token_budget, max_size, overhead_tokens, self.estimate_chunk_row_tokens)
 
     def postcheck(self, text) -> bool:
         """
@@ -93,7 +220,8 @@ class LlmClient(BaseLLMClient):
         response, _raw = self._request_llm(
             prompt=prompt,
             model=self.config.check_model,
-            response_format="json_object"
+            response_format="json_object",
+            operation="postcheck"
         )
 
         if not isinstance(response, dict) or "is_valid" not in response:
@@ -105,7 +233,8 @@ class LlmClient(BaseLLMClient):
     # --- Асинхронные методы ---
     async def async_ask_llm(self, prompt: str,
                 response_format: str = "json_object",
-                temperature: float = 0.0
+                temperature: float = 0.0,
+                use_cache: bool = True
         ) -> Any:
         """(async) async_ask_llm."""
         result, _raw = await self._async_request_llm(
@@ -113,34 +242,106 @@ class LlmClient(BaseLLMClient):
             model=self.config.default_model,
             response_format=response_format,
             temperature=temperature,
+            use_cache=use_cache,
+            operation="ask_llm",
         )
         return result
 
-    async def async_parse_chunk_to_meaningful(self, chunk: dict[str, str]) -> dict[str, Any]:
-        """(async) parse_chunk_to_meaningful"""
-        try:
-            chunk_json = json.dumps(chunk, ensure_ascii=False)
-        except Exception as exc:
-            self.logger.error("Chunk не может быть сериализован в JSON; "
-                            "возвращаем пустой результат.", exc_info=exc
-            )
+    async def async_parse_chunk_to_meaningful(self, chunk: dict[str, str],
+                                              use_cache: bool = True) -> dict[str, Any]:
+        """(async) parse_chunk_to_meaningful
+        Если задана дешевая модель (LLM_CHEAP_MODEL), чанк сначала обрабатывается ею,
+        а в основную модель отправляются только записи, не прошедшие проверку
+        (см. _needs_escalation).
+        Args:
+            chunk: Словарь с данными для обработки
+            use_cache: Брать ответ из кэша (при повторных попытках кэш обходится)
+        """
+        cheap_model = self.config.cheap_model
+        if not cheap_model or cheap_model == self.config.default_model:
+            return await self._async_parse_chunk(chunk, self.config.default_model, use_cache)
+
+        result = await self._async_parse_chunk(chunk, cheap_model, use_cache, tier="cheap")
+        escalate = {
+            index: row for index, row in chunk.items()
+            if self._needs_escalation(row, result.get(str(index)))
+        }
+        self.cascade_stats["cheap_accepted"] += len(chunk) - len(escalate)
+        if not escalate:
+            return result
+
+        self.cascade_stats["escalated"] += len(escalate)
+        self.logger.debug("Эскалация записей в основную модель",
+                          extra={"escalated": len(escalate), "chunk_size": len(chunk)})
+        strong = await self._async_parse_chunk(escalate, self.config.default_model, use_cache, tier="strong")
+        for index in escalate:
+            result.pop(str(index), None)
+            if str(index) in strong:
+                result[str(index)] = strong[str(index)]
+        return result
+
+    async def _async_parse_chunk(self, chunk: dict[Any, dict[str, Any]], model: str,
+                                 use_cache: bool, tier: str | None = None) -> dict[str, Any]:
+        """(async) Один запрос parse_chunk к указанной модели."""
+        prompt = self._build_chunk_prompt(chunk)
+        if not prompt:
             return {}
 
-        prompt = self._render_prompt(
-            "parse_chunk",
-            chunk_size=len(chunk),
-            chunk_json=chunk_json
+        self.logger.debug("Асинхронный вызов LLM для async_parse_chunk_to_meaningful",
+                          extra={"chunk_size": len(chunk), "model": model}
         )
 
-        self.logger.debug("Асинхронный вызов async_ask_llm для async_parse_chunk_to_meaningful",
-                          extra={"chunk_size": len(chunk)}
+        started = time.monotonic()
+        response, completion = await self._async_request_llm(
+            prompt=prompt,
+            model=model,
+            response_format="json_object",
+            use_cache=use_cache,
+            operation="parse_chunk",
         )
-
-        response = await self.async_ask_llm(prompt, response_format="json_object")
+        if tier:
+            self.cascade_stats[f"{tier}_requests"] += 1
+            self.cascade_stats[f"{tier}_rows"] += len(chunk)
+            self.cascade_stats[f"{tier}_seconds"] += time.monotonic() - started
         if not isinstance(response, dict):
             self.logger.warning("Ожидался словарь, но получен другой тип; возвращаем {}.")
             return {}
-        return response
+        self._record_chunk_usage(len(chunk), completion)
+        return self._decode_chunk_response(chunk, response)
+
+    @staticmethod
+    def _needs_escalation(row: dict[str, Any], item: Any) -> bool:
+        """Проверяет ответ дешевой модели для одной записи.
+        Эскалируются: отсутствующий или битый элемент, чужой person_id,
+        пустое имя и описание, дословно повторяющее длинное входное.
+        """
+        if not isinstance(item, dict):
+            return True
+        if str(item.get("person_id")) != str(row.get("person_id")):
+            return True
+        if not (item.get("meaningful_first_name") or "").strip():
+            return True
+        source_about = " ".join((row.get("about") or "").split()).lower()
+        result_about = " ".join((item.get("meaningful_about") or "").split()).lower()
+        return len(source_about) >= config.CASCADE_ECHO_MIN_LENGTH and result_about == source_about
+
+    def log_cascade_stats(self) -> None:
+        """Выводит в лог долю записей и среднюю задержку по уровням каскада."""
+        stats = self.cascade_stats
+        rows = stats["cheap_rows"]
+        if not rows:
+            return
+        for tier, model in (("cheap", self.config.cheap_model), ("strong", self.config.default_model)):
+            requests = stats[f"{tier}_requests"]
+            if requests:
+                self.logger.info(
+                    f"Каскад [{tier}: {model}]: {requests} запросов, {stats[f'{tier}_rows']} записей, "
+                    f"средняя задержка {stats[f'{tier}_seconds'] / requests:.2f} с"
+                )
+        self.logger.info(
+            f"Каскад: дешевая модель приняла {stats['cheap_accepted']}/{rows} записей "
+            f"({stats['cheap_accepted'] / rows:.0%}), эскалировано {stats['escalated']}"
+        )
 
     async def async_postcheck(self, text: str) -> bool:
         """(async) postcheck"""
@@ -152,7 +353,8 @@ class LlmClient(BaseLLMClient):
         response, _raw = await self._async_request_llm(
             prompt=prompt,
             model=self.config.check_model,
-            response_format="json_object"
+            response_format="json_object",
+            operation="postcheck"
         )
 
         if not isinstance(response, dict) or "is_valid" not in response:
@@ -160,3 +362,76 @@ class LlmClient(BaseLLMClient):
             return False
 
         return response.get("is_valid", False)
+
+    async def async_postcheck_batch(self, texts: list[str]) -> list[bool]:
+        """(async) Классифицирует несколько текстов одним запросом к LLM.
+        Тексты, для которых модель не вернула булев вердикт, проверяются
+        отдельными вызовами async_postcheck параллельно (в пределах лимита модели проверки).
+        Args:
+            texts: Тексты для проверки
+        Returns:
+            List[bool]: Вердикты в порядке текстов
+        """
+        if len(texts) == 1:
+            return [await self.async_postcheck(texts[0])]
+
+        prompt = self._render_prompt(
+            "postcheck_batch",
+            count=len(texts),
+            texts_json=json.dumps({str(i): text for i, text in enumerate(texts)}, ensure_ascii=False)
+        )
+        response: Any = {}
+        if prompt:
+            response, _raw = await self._async_request_llm(
+                prompt=prompt,
+                model=self.config.check_model,
+                response_format="json_object",
+                operation="postcheck_batch"
+            )
+
+        verdicts: list[Any] = [
+            response.get(str(i)) if isinstance(response, dict) else None for i in range(len(texts))
+        ]
+        missing = [i for i, verdict in enumerate(verdicts) if not isinstance(verdict, bool)]
+        if missing:
+            self.logger.warning(f"Нет вердикта для {len(missing)}/{len(texts)} текстов "
+                                f"в пакетной проверке; проверяем отдельно.")
+            # одиночные проверки идут параллельно в пределах лимита модели проверки
+            # (этапы ограничивают параллельность по другим моделям, вложенного захвата нет)
+            limiter = self.limiter_for(self.config.check_model)
+
+            async def single(text: str) -> bool:
+                async with limiter:
+                    return await self.async_postcheck(text)
+
+            fallback = await asyncio.gather(*(single(texts[i]) for i in missing))
+            for i, verdict in zip(missing, fallback, strict=True):
+                verdicts[i] = verdict
+        return verdicts
+
+    async def async_postcheck_batched(self, text: str) -> bool:
+        """(async) postcheck через общий сборщик пакетов.
+        Одновременные вызовы из разных корутин объединяются в один запрос
+        async_postcheck_batch (по размеру пакета или по истечении короткого ожидания).
+        """
+        if self.postcheck_batcher is None:
+            self.postcheck_batcher = MicroBatcher(
+                self.async_postcheck_batch,
+                config.POSTCHECK_BATCH_SIZE,
+                config.POSTCHECK_BATCH_MAX_DELAY,
+                name="postcheck",
+                size_limit=self.postcheck_size_limit
+            )
+        return await self.postcheck_batcher.submit(text)
+
+    async def async_check_summary(self, summary: str | None, sources: int) -> bool:
+        """(async) Проверяет summary: сначала локальным предфильтром,
+        неоднозначные случаи — через пакетный postcheck.
+        Args:
+            summary: Текст ответа поиска
+            sources: Количество найденных источников (URL)
+        """
+        verdict = self.summary_prefilter.classify(summary, sources)
+        if verdict is not None:
+            return verdict
+        return await self.async_postcheck_batched(summary or "")
@@ -1,7 +1,9 @@
 from typing import Any
 
-from config import LlmConfig
+import config
+from config import SUMMARY_NO_INFO_MARKERS, LlmConfig
 from llm.base_llm_client import BaseLLMClient
+from llm.hedging import HedgePolicy
 
 
 class PerplexityClient(BaseLLMClient):
@@ -10,6 +12,8 @@ class PerplexityClient(BaseLLMClient):
     Использует Perplexity как поисковую LLM.
     Attributes:
         config (LlmConfig): Конфигурация LLM клиента
+        hedges (dict[str, HedgePolicy]): Хеджирование асинхронных запросов по моделям
+                                         (пусто, если LLM_HEDGE_ENABLED выключен)
         logger: Логгер для записи событий
     """
 
@@ -19,6 +23,7 @@ class PerplexityClient(BaseLLMClient):
             config: Конфигурация LLM. Если не указана, используется по умолчанию.
         """
         super().__init__(config=config)
+        self.hedges: dict[str, HedgePolicy] = {}
         self.logger.debug(
             "PerplexityClient инициализирован",
             extra={"perplexity_model": self.config.perplexity_model}
@@ -56,6 +61,7 @@ class PerplexityClient(BaseLLMClient):
             model=model_to_use,
             response_format=response_format,
             temperature=temperature,
+            operation="ask_perplexity",
         )
 
         if response_format == "json_object":
@@ -151,11 +157,7 @@ class PerplexityClient(BaseLLMClient):
 
     def _estimate_confidence(self, summary: str | None, sources: int) -> str:
         """Простейшая эвристика уверенности."""
-        markers_l = [
-            "поиск по запросу",
-            "найти не удалось", "данных не найдено"
-        ]
-        if not summary or not (sources) or any(m in summary.lower() for m in markers_l):
+        if not summary or not (sources) or any(m in summary.lower() for m in SUMMARY_NO_INFO_MARKERS):
             return "low"
 
         markers_m = [
@@ -201,6 +203,26 @@ class PerplexityClient(BaseLLMClient):
                               )
             return []
 
+    def hedge_for(self, model: str) -> HedgePolicy | None:
+        """Возвращает политику хеджирования для модели (None, если хеджирование выключено)."""
+        if not self.config.hedge_enabled:
+            return None
+        if model not in self.hedges:
+            self.hedges[model] = HedgePolicy(
+                name=model,
+                percentile=self.config.hedge_percentile,
+                budget=self.config.hedge_budget,
+                min_samples=config.HEDGE_MIN_SAMPLES,
+                window=config.HEDGE_LATENCY_WINDOW,
+                min_delay=config.HEDGE_MIN_DELAY_SECONDS,
+            )
+        return self.hedges[model]
+
+    def log_hedge_stats(self) -> None:
+        """Выводит в лог статистику хеджирования по моделям."""
+        for hedge in self.hedges.values():
+            hedge.log_stats()
+
     # --- Асинхронные методы ---
     async def async_ask_perplexity(
         self,
@@ -209,15 +231,26 @@ class PerplexityClient(BaseLLMClient):
         response_format: str = "text",
         temperature: float = 0.2,
     ) -> Any:
-        """(async) ask_perplexity"""
+        """(async) ask_perplexity.
+        При LLM_HEDGE_ENABLED медленный запрос дублируется (см. llm/hedging.py).
+        """
         model_to_use = model or self.config.perplexity_model
 
-        result, completion = await self._async_request_llm(
-            prompt=prompt,
-            model=model_to_use,
-            response_format=response_format,
-            temperature=temperature,
-        )
+        def call():
+            return self._async_request_llm(
+                prompt=prompt,
+                model=model_to_use,
+                response_format=response_format,
+                temperature=temperature,
+                operation="ask_perplexity",
+            )
+
+        hedge = self.hedge_for(model_to_use)
+        if hedge is None:
+            result, completion = await call()
+        else:
+            # ошибка запроса возвращается как (пусто, None) и не побеждает второй запрос
+            result, completion = await hedge.run(call, is_ok=lambda r: r[1] is not None)
 
         if response_format == "json_object":
             return result if isinstance(result, dict) else {}
@@ -0,0 +1,64 @@
+import logging
+from collections import Counter
+
+import config
+
+
+class SummaryPrefilter:
+    """Локальный классификатор summary перед проверкой через LLM (postcheck).
+    По маркерам «информация не найдена», длине текста и количеству источников
+    сразу решает очевидные случаи; неоднозначные тексты возвращает как None,
+    и их нужно проверить через LLM.
+    Attributes:
+        negative_markers (tuple[str, ...]): Маркеры заглушек «информации не найдено»
+        counters (Counter): Количество решений: positive, negative, ambiguous
+        logger: Логгер для записи событий
+    """
+
+    def __init__(self, extra_markers: tuple[str, ...] = ()) -> None:
+        """Инициализация классификатора.
+        Args:
+            extra_markers: Дополнительные маркеры заглушек к SUMMARY_NO_INFO_MARKERS
+        """
+        self.negative_markers = tuple(
+            m.lower() for m in (*config.SUMMARY_NO_INFO_MARKERS, *extra_markers)
+        )
+        self.counters: Counter[str] = Counter()
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+    def classify(self, summary: str | None, sources: int) -> bool | None:
+        """Классифицирует summary.
+        Args:
+            summary: Текст ответа поиска
+            sources: Количество найденных источников (URL)
+        Returns:
+            bool | None: True/False для очевидных случаев, None — нужна проверка LLM
+        """
+        text = (summary or "").strip()
+        lowered = text.lower()
+        has_marker = any(m in lowered for m in self.negative_markers)
+
+        if len(text) < config.PREFILTER_MIN_LENGTH or (
+            has_marker and len(text) < config.PREFILTER_STUB_MAX_LENGTH
+        ):
+            verdict: bool | None = False
+        elif (not has_marker and len(text) >= config.PREFILTER_POSITIVE_MIN_LENGTH
+              and sources >= config.PREFILTER_POSITIVE_MIN_SOURCES):
+            verdict = True
+        else:
+            verdict = None
+
+        self.counters[{True: "positive", False: "negative", None: "ambiguous"}[verdict]] += 1
+        return verdict
+
+    def log_stats(self) -> None:
+        """Выводит в лог, сколько проверок решено локально и сколько ушло в LLM."""
+        total = sum(self.counters.values())
+        if not total:
+            return
+        saved = self.counters["positive"] + self.counters["negative"]
+        self.logger.info(
+            f"Предфильтр summary: локально решено {saved}/{total} "
+            f"(положительных {self.counters['positive']}, заглушек {self.counters['negative']}), "
+            f"в LLM отправлено {self.counters['ambiguous']}"
+        )
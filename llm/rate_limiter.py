@@ -0,0 +1,121 @@
+import logging
+import math
+import threading
+import time
+from typing import Any
+
+# Грубая оценка без токенизатора: для смеси кириллицы и латиницы
+# на один токен приходится примерно 3 символа
+CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(text: str | None) -> int:
+    """Оценивает количество токенов в тексте по его длине."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class TokenBucket:
+    """Токен-бакет с резервированием наперед.
+    Резерв может увести баланс в минус — тогда вызывающий должен подождать,
+    пока бакет восполнится. Проверка и списание выполняются под блокировкой,
+    поэтому бакет можно использовать из нескольких потоков и корутин.
+    Attributes:
+        capacity (float): Емкость бакета (лимит за минуту)
+        rate (float): Скорость восполнения в секунду
+    """
+
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Списывает `amount` и возвращает, сколько секунд нужно подождать."""
+        with self._lock:
+            self._refill()
+            self._tokens -= min(amount, self.capacity)
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def adjust(self, delta: float) -> None:
+        """Корректирует баланс (например, по фактическому расходу токенов)."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens - delta)
+
+
+class ModelRateLimiter:
+    """Ограничитель RPM/TPM одной модели.
+    Перед запросом резервирует один запрос и оценку токенов промпта и ответа,
+    после ответа корректирует TPM-бакет по фактическому `completion.usage`.
+    Attributes:
+        model (str): Название модели
+        requests (TokenBucket | None): Бакет запросов в минуту
+        tokens (TokenBucket | None): Бакет токенов в минуту
+        waited_seconds (float): Суммарное время ожидания лимита
+        logger: Логгер для записи событий
+    """
+
+    def __init__(self, model: str, rpm: int, tpm: int) -> None:
+        self.model = model
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.waited_seconds = 0.0
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+    def reserve(self, estimated_tokens: int) -> float:
+        """Резервирует запрос и токены. Возвращает время ожидания в секундах."""
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(estimated_tokens))
+        if wait > 0:
+            self.waited_seconds += wait
+            self.logger.debug(f"Лимит RPM/TPM [{self.model}]: ожидание {wait:.2f} с")
+        return wait
+
+    def record_usage(self, estimated_tokens: int, completion: Any) -> None:
+        """Учитывает разницу между оценкой и фактическим расходом токенов."""
+        usage = getattr(completion, "usage", None)
+        total_tokens = getattr(usage, "total_tokens", None)
+        if self.tokens is not None and total_tokens:
+            self.tokens.adjust(total_tokens - estimated_tokens)
+
+
+_rate_limiters: dict[str, ModelRateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model: str, rpm: int, tpm: int) -> ModelRateLimiter | None:
+    """Возвращает общий для процесса ограничитель RPM/TPM модели (None, если лимиты не заданы)."""
+    if rpm <= 0 and tpm <= 0:
+        return None
+    with _rate_limiters_lock:
+        if model not in _rate_limiters:
+            _rate_limiters[model] = ModelRateLimiter(model, rpm, tpm)
+        return _rate_limiters[model]
+
+
+# Время (time.monotonic), до которого провайдер попросил не слать запросы к модели (Retry-After)
+_retry_after_until: dict[str, float] = {}
+
+
+def note_retry_after(model: str, seconds: float) -> None:
+    """Запоминает паузу из заголовка Retry-After ответа 429."""
+    until = time.monotonic() + seconds
+    with _rate_limiters_lock:
+        _retry_after_until[model] = max(until, _retry_after_until.get(model, 0.0))
+
+
+def retry_after_delay(model: str) -> float:
+    """Сколько секунд еще нужно подождать по Retry-After перед запросом к модели."""
+    return max(0.0, _retry_after_until.get(model, 0.0) - time.monotonic())
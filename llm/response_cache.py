@@ -0,0 +1,190 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any
+
+from openai.types.chat import ChatCompletion
+
+
+class ResponseCache:
+    """Персистентный кэш ответов LLM на SQLite.
+    Ключ — хэш от (model, temperature, response_format, параметры запроса, prompt),
+    значение — сериализованный объект completion. Записи старше `max_age_seconds`
+    считаются устаревшими, при превышении `max_entries` удаляются самые старые.
+    Один экземпляр безопасно использовать из нескольких потоков и корутин.
+    Attributes:
+        path (Path): Путь к файлу базы кэша
+        hits (Counter): Количество попаданий по моделям
+        misses (Counter): Количество промахов по моделям
+        logger: Логгер для записи событий
+    """
+
+    EVICTION_INTERVAL = 100
+
+    def __init__(self, path: str, max_entries: int, max_age_seconds: int,
+                 bypass_models: tuple[str, ...] = ()) -> None:
+        """Инициализация кэша.
+        Args:
+            path: Путь к файлу SQLite
+            max_entries: Максимальное количество записей
+            max_age_seconds: Максимальный возраст записи в секундах
+            bypass_models: Модели, для которых кэш не используется
+        """
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.bypass_models = set(bypass_models)
+        self.hits: Counter[str] = Counter()
+        self.misses: Counter[str] = Counter()
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self._lock = threading.Lock()
+        self._puts_since_eviction = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    completion TEXT NOT NULL
+                )
+            """)
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_model_idx ON responses (model)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_created_at_idx ON responses (created_at)"
+            )
+
+    @staticmethod
+    def make_key(model: str, temperature: float, response_format: str,
+                 prompt: str, **params: Any) -> str:
+        """Вычисляет ключ кэша для запроса.
+        Args:
+            model: Название модели
+            temperature: Температура генерации
+            response_format: Формат ответа
+            prompt: Отрендеренный промпт
+            params: Прочие параметры, влияющие на ответ (n, max_tokens, extra_body)
+        Returns:
+            str: SHA-256 от канонического JSON-представления запроса
+        """
+        payload = json.dumps(
+            {"model": model, "temperature": temperature, "response_format": response_format,
+             "prompt": prompt, "params": params},
+            ensure_ascii=False, sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def is_enabled_for(self, model: str) -> bool:
+        """Проверяет, используется ли кэш для модели."""
+        return model not in self.bypass_models
+
+    def get(self, key: str, model: str) -> ChatCompletion | None:
+        """Возвращает закэшированный completion или None при промахе.
+        Args:
+            key: Ключ кэша
+            model: Модель (для счетчиков)
+        Returns:
+            ChatCompletion | None: Восстановленный объект completion
+        """
+        min_created_at = time.time() - self.max_age_seconds
+        try:
+            with self._lock:
+                row = self._connection.execute(
+                    "SELECT completion FROM responses WHERE key = ? AND created_at >= ?",
+                    (key, min_created_at)
+                ).fetchone()
+            if row is None:
+                self.misses[model] += 1
+                return None
+            self.hits[model] += 1
+            return ChatCompletion.model_validate_json(row[0])
+        except Exception as exc:
+            self.logger.warning("Ошибка чтения кэша ответов LLM", exc_info=exc)
+            self.misses[model] += 1
+            return None
+
+    def put(self, key: str, model: str, completion: Any) -> None:
+        """Сохраняет completion в кэш.
+        Args:
+            key: Ключ кэша
+            model: Название модели
+            completion: Объект completion от OpenAI SDK
+        """
+        try:
+            serialized = completion.model_dump_json()
+            with self._lock, self._connection:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, created_at, completion) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, model, time.time(), serialized)
+                )
+                self._puts_since_eviction += 1
+                if self._puts_since_eviction >= self.EVICTION_INTERVAL:
+                    self._puts_since_eviction = 0
+                    self._evict()
+        except Exception as exc:
+            self.logger.warning("Ошибка записи в кэш ответов LLM", exc_info=exc)
+
+    def _evict(self) -> None:
+        """Удаляет устаревшие записи и самые старые записи сверх лимита.
+        Вызывается под блокировкой внутри транзакции.
+        """
+        self._connection.execute(
+            "DELETE FROM responses WHERE created_at < ?",
+            (time.time() - self.max_age_seconds,)
+        )
+        self._connection.execute(
+            """
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM responses ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,)
+        )
+
+    def invalidate(self, model: str | None = None) -> int:
+        """Удаляет записи кэша модели (или все записи, если модель не указана).
+        Args:
+            model: Название модели
+        Returns:
+            int: Количество удаленных записей
+        """
+        with self._lock, self._connection:
+            if model:
+                cursor = self._connection.execute("DELETE FROM responses WHERE model = ?", (model,))
+            else:
+                cursor = self._connection.execute("DELETE FROM responses")
+        self.logger.info(f"Кэш ответов LLM очищен ({model or 'все модели'}): удалено {cursor.rowcount} записей")
+        return cursor.rowcount
+
+    def log_stats(self) -> None:
+        """Выводит в лог счетчики попаданий и промахов по моделям."""
+        for model in sorted(set(self.hits) | set(self.misses)):
+            hits, misses = self.hits[model], self.misses[model]
+            total = hits + misses
+            self.logger.info(
+                f"Кэш LLM [{model}]: попаданий {hits}, промахов {misses} "
+                f"({hits / total:.0%} попаданий)"
+            )
+
+
+_caches: dict[str, ResponseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(path: str, max_entries: int, max_age_seconds: int,
+                       bypass_models: tuple[str, ...] = ()) -> ResponseCache:
+    """Возвращает общий для процесса экземпляр кэша для файла `path`."""
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = ResponseCache(path, max_entries, max_age_seconds, bypass_models)
+        return _caches[path]
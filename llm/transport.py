@@ -0,0 +1,79 @@
+import asyncio
+import importlib.util
+import logging
+import threading
+
+import httpx
+from config import LlmConfig
+from openai import DefaultAsyncHttpxClient, DefaultHttpxClient
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_async_client: httpx.AsyncClient | None = None
+_async_client_loop: asyncio.AbstractEventLoop | None = None
+_sync_client: httpx.Client | None = None
+
+
+def http_timeout(config: LlmConfig) -> httpx.Timeout:
+    """Таймауты запросов к LLM (передаются и в клиенты OpenAI, иначе действуют их значения по умолчанию)."""
+    return httpx.Timeout(
+        connect=config.http_connect_timeout,
+        read=config.http_read_timeout,
+        write=config.http_write_timeout,
+        pool=config.http_pool_timeout,
+    )
+
+
+def _transport_options(config: LlmConfig) -> dict:
+    """Общие настройки пула соединений, keep-alive, HTTP/2 и таймаутов."""
+    http2 = config.http2
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning("LLM_HTTP2 включен, но пакет h2 не установлен; используется HTTP/1.1")
+        http2 = False
+    return {
+        "limits": httpx.Limits(
+            max_connections=config.http_max_connections,
+            max_keepalive_connections=config.http_max_keepalive_connections,
+            keepalive_expiry=config.http_keepalive_expiry,
+        ),
+        "timeout": http_timeout(config),
+        "http2": http2,
+    }
+
+
+def get_async_http_client(config: LlmConfig) -> httpx.AsyncClient:
+    """Возвращает общий для процесса асинхронный HTTP-клиент LLM.
+    Клиент привязан к event loop, поэтому при смене loop создается заново.
+    Настройки берутся из конфигурации первого вызова.
+    """
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    with _lock:
+        if _async_client is None or _async_client_loop is not loop or _async_client.is_closed:
+            _async_client = DefaultAsyncHttpxClient(**_transport_options(config))
+            _async_client_loop = loop
+            logger.debug("Создан общий асинхронный HTTP-клиент LLM")
+        return _async_client
+
+
+def get_sync_http_client(config: LlmConfig) -> httpx.Client:
+    """Возвращает общий для процесса синхронный HTTP-клиент LLM (создается при первом вызове)."""
+    global _sync_client
+    with _lock:
+        if _sync_client is None or _sync_client.is_closed:
+            _sync_client = DefaultHttpxClient(**_transport_options(config))
+            logger.debug("Создан общий синхронный HTTP-клиент LLM")
+        return _sync_client
+
+
+async def aclose_http_clients() -> None:
+    """(async) Закрывает общие HTTP-клиенты (в конце этапа)."""
+    global _async_client, _sync_client
+    with _lock:
+        async_client, _async_client = _async_client, None
+        sync_client, _sync_client = _sync_client, None
+    if async_client is not None:
+        await async_client.aclose()
+    if sync_client is not None:
+        sync_client.close()
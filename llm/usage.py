@@ -0,0 +1,187 @@
+import contextvars
+import datetime
+import json
+import logging
+import math
+import threading
+from collections import defaultdict
+from typing import Any
+
+import config
+
+# Этап запуска (llm, search, ...), к которому относятся вызовы LLM; задается в main
+_current_stage: contextvars.ContextVar[str] = contextvars.ContextVar("llm_usage_stage", default="-")
+
+
+def set_stage(stage: str) -> None:
+    """Задает этап для учета вызовов LLM в текущем контексте (наследуется задачами asyncio)."""
+    _current_stage.set(stage)
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Перцентиль по ближайшему рангу (0.0 для пустого списка)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+
+class UsageStats:
+    """Агрегированные показатели вызовов одной операции одной модели на этапе.
+    Attributes:
+        calls (int): Запросов к провайдеру
+        errors (int): Запросов, завершившихся ошибкой
+        cache_hits (int): Ответов из кэша (без запроса к провайдеру)
+        prompt_tokens (int): Токенов промптов
+        completion_tokens (int): Токенов ответов
+        cost (float): Стоимость в USD по LLM_PRICES_PER_MILLION
+        latencies (list[float]): Задержки запросов в секундах
+    """
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.latencies: list[float] = []
+
+    def merge(self, other: "UsageStats") -> None:
+        """Добавляет показатели другой группы (для итога по этапу)."""
+        self.calls += other.calls
+        self.errors += other.errors
+        self.cache_hits += other.cache_hits
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cost += other.cost
+        self.latencies.extend(other.latencies)
+
+    def describe(self) -> str:
+        """Строка для лога: запросы, ошибки, токены, стоимость и перцентили задержки."""
+        return (
+            f"запросов {self.calls}, ошибок {self.errors}, из кэша {self.cache_hits}, "
+            f"токенов {self.prompt_tokens} + {self.completion_tokens}, ${self.cost:.4f}, "
+            f"задержка p50/p95/p99 {percentile(self.latencies, 50):.2f}/"
+            f"{percentile(self.latencies, 95):.2f}/{percentile(self.latencies, 99):.2f} с"
+        )
+
+
+class UsageTracker:
+    """Учет токенов, стоимости и задержки каждого вызова LLM.
+    Показатели копятся в памяти по (этап, операция, модель) и выводятся
+    в лог сводкой по этапам; при заданном trace_path каждый вызов
+    дописывается в JSONL-трассу.
+    Attributes:
+        prices (dict[str, tuple[float, float]]): Цены модели (вход, выход) в USD за 1M токенов
+        trace_path (str | None): Путь к JSONL-трассе вызовов
+        logger: Логгер для записи событий
+    """
+
+    def __init__(self, prices: dict[str, tuple[float, float]], trace_path: str | None = None) -> None:
+        self.prices = prices
+        self.trace_path = trace_path or None
+        self._stats: defaultdict[tuple[str, str, str], UsageStats] = defaultdict(UsageStats)
+        self._lock = threading.Lock()
+        self._trace = None
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+    def cost_of(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        """Стоимость вызова по таблице цен (0, если модели в ней нет)."""
+        price_in, price_out = self.prices.get(model, (0.0, 0.0))
+        return (prompt_tokens * price_in + completion_tokens * price_out) / 1_000_000
+
+    def record(self, operation: str, model: str, latency: float, completion: Any = None,
+               error: str | None = None, endpoint: str | None = None) -> None:
+        """Учитывает запрос к провайдеру.
+        Args:
+            operation: Операция (имя промпта или метода клиента)
+            model: Модель
+            latency: Задержка запроса в секундах
+            completion: Ответ провайдера (из него берется usage)
+            error: Имя класса исключения, если запрос завершился ошибкой
+            endpoint: Точка доступа
+        """
+        usage = getattr(completion, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+        completion_tokens = getattr(usage, "completion_tokens", None) or 0
+        cost = self.cost_of(model, prompt_tokens, completion_tokens)
+        stage = _current_stage.get()
+        with self._lock:
+            stats = self._stats[stage, operation, model]
+            stats.calls += 1
+            stats.errors += error is not None
+            stats.prompt_tokens += prompt_tokens
+            stats.completion_tokens += completion_tokens
+            stats.cost += cost
+            stats.latencies.append(latency)
+            self._write_trace({
+                "ts": datetime.datetime.now().isoformat(timespec="milliseconds"),
+                "stage": stage,
+                "operation": operation,
+                "model": model,
+                "endpoint": endpoint,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "cost": round(cost, 8),
+                "latency": round(latency, 4),
+                "error": error,
+            })
+
+    def record_cache_hit(self, operation: str, model: str) -> None:
+        """Учитывает ответ из кэша (без токенов и задержки)."""
+        with self._lock:
+            self._stats[_current_stage.get(), operation, model].cache_hits += 1
+
+    def _write_trace(self, record: dict[str, Any]) -> None:
+        if self.trace_path is None:
+            return
+        try:
+            if self._trace is None:
+                self._trace = open(self.trace_path, "a", encoding="utf-8")
+            self._trace.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as exc:
+            self.logger.error(f"Не удалось записать трассу вызовов LLM в {self.trace_path}: {exc}")
+            self.trace_path = None
+
+    def log_summary(self) -> None:
+        """Выводит в лог сводку по этапам, затем по операциям и моделям этапа."""
+        with self._lock:
+            items = sorted(self._stats.items())
+            if self._trace is not None:
+                self._trace.flush()
+        by_stage: defaultdict[str, UsageStats] = defaultdict(UsageStats)
+        for (stage, _operation, _model), stats in items:
+            by_stage[stage].merge(stats)
+        for stage, total in by_stage.items():
+            self.logger.info(f"Расход LLM [{stage}]: {total.describe()}")
+            for (item_stage, operation, model), stats in items:
+                if item_stage == stage:
+                    self.logger.info(f"  {operation} / {model}: {stats.describe()}")
+
+    def close(self) -> None:
+        """Закрывает файл трассы."""
+        with self._lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+
+
+_tracker: UsageTracker | None = None
+_tracker_lock = threading.Lock()
+
+
+def get_usage_tracker(trace_path: str | None = None) -> UsageTracker:
+    """Возвращает общий для процесса учет вызовов LLM (trace_path учитывается при первом обращении)."""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = UsageTracker(config.LLM_PRICES_PER_MILLION, trace_path)
+        return _tracker
+
+
+def log_usage_summary() -> None:
+    """Выводит в лог сводку расхода LLM и закрывает трассу (в конце этапа)."""
+    if _tracker is not None:
+        _tracker.log_summary()
+        _tracker.close()
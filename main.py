@@ -2,18 +2,31 @@ import argparse
 import asyncio
 import datetime
 import logging
+import os
+import socket
+from collections.abc import AsyncIterator, Coroutine, Iterator
+from itertools import chain, islice
 from pathlib import Path
 from typing import Any
 import base64
 import mimetypes
 
 import config
+from config import LlmConfig
 from jinja2 import Environment, FileSystemLoader
+from llm.concurrency import AdaptiveLimiter, log_limiter_stats
+from llm.endpoints import log_endpoint_stats
 from llm.llm_client import LlmClient
 from llm.perp_client import PerplexityClient
+from llm.response_cache import get_response_cache
+from llm.transport import aclose_http_clients
+from llm.usage import log_usage_summary, set_stage
 from logger import setup_logging
 from utils import cleaner
+from utils.async_db import AsyncDatabaseManager
 from utils.db import DatabaseManager
+from utils.dedupe import InputDeduplicator
+from utils.fast_path import FastPathResolver, load_first_names
 from utils.md_exporter import MarkdownExporter
 from utils.photo_processor import PhotoProcessor
 
@@ -21,77 +34,227 @@ setup_logging(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def clean_and_create_db() -> None:
+async def iter_batches(
+    rows: AsyncIterator[dict[str, Any]],
+    size: int
+) -> AsyncIterator[list[dict[str, Any]]]:
+    """(async) Группирует строки из асинхронного потокового курсора в пачки по `size` штук."""
+    batch: list[dict[str, Any]] = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def run_bounded(
+    coros: AsyncIterator[Coroutine[Any, Any, Any]],
+    semaphore: asyncio.Semaphore | AdaptiveLimiter
+) -> list[Any]:
+    """(async) Запускает корутины по мере их поступления, не больше слотов семафора одновременно.
+
+    Следующая корутина запрашивается у источника только после освобождения
+    слота, поэтому в памяти одновременно находится ограниченное число задач.
+    Вместо семафора можно передать AdaptiveLimiter — тогда число слотов
+    меняется по ходу работы.
+
+    Ошибки всех корутин (в том числе завершившихся задолго до конца) пишутся
+    в лог, после завершения остальных задач первая из них пробрасывается.
+
+    Returns:
+        Результаты корутин в порядке их завершения.
+    """
+    results: list[Any] = []
+    errors: list[BaseException] = []
+    pending: set[asyncio.Task] = set()
+
+    async def run(coro: Coroutine[Any, Any, Any]) -> None:
+        try:
+            results.append(await coro)
+        finally:
+            semaphore.release()
+
+    def on_done(task: asyncio.Task) -> None:
+        pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            errors.append(task.exception())
+            logger.error(f"❌ Задача завершилась с ошибкой: {task.exception()!r}", exc_info=task.exception())
+
+    async for coro in coros:
+        await semaphore.acquire()
+        task = asyncio.create_task(run(coro))
+        pending.add(task)
+        task.add_done_callback(on_done)
+
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    if errors:
+        raise errors[0]
+    return results
+
+
+def clean_and_create_db(incremental: bool = False) -> None:
     """Очищает исходную базу данных и создает новые рабочие таблицы.
 
     Удаляет и пересоздает таблицы `cleaned_table_name` и `result_table_name`
-    на основе конфигурации.
+    на основе конфигурации. В инкрементальном режиме таблицы не пересоздаются:
+    обновляются только персоны с данными новее сохраненного водяного знака,
+    а результаты LLM, поиска и фотографий остальных персон сохраняются.
+
+    Args:
+        incremental: Обновить таблицы инкрементально вместо пересоздания.
     """
-    logger.info("Начинаем очистку базы данных и создание новых таблиц.")
     db = DatabaseManager()
     try:
-        db.create_cleaned_table(
-            source_table_name=config.source_table_name,
-            new_table_name=config.cleaned_table_name
-        )
-        db.create_result_table(
-            source_table_name=config.cleaned_table_name,
-            result_table_name=config.result_table_name,
-            drop_table=True
-        )
+        db.create_source_indexes(config.source_table_name)
+        if incremental:
+            logger.info("Начинаем инкрементальное обновление рабочих таблиц.")
+            db.refresh_cleaned_table(
+                source_table_name=config.source_table_name,
+                new_table_name=config.cleaned_table_name,
+                watermark_table_name=config.watermark_table_name
+            )
+            db.refresh_result_table(
+                source_table_name=config.cleaned_table_name,
+                result_table_name=config.result_table_name,
+                watermark_table_name=config.watermark_table_name,
+                jobs_table_name=config.jobs_table_name
+            )
+        else:
+            logger.info("Начинаем очистку базы данных и создание новых таблиц.")
+            db.create_cleaned_table(
+                source_table_name=config.source_table_name,
+                new_table_name=config.cleaned_table_name,
+                watermark_table_name=config.watermark_table_name
+            )
+            db.create_result_table(
+                source_table_name=config.cleaned_table_name,
+                result_table_name=config.result_table_name,
+                drop_table=True,
+                watermark_table_name=config.watermark_table_name,
+                jobs_table_name=config.jobs_table_name
+            )
     finally:
         db.close()
     logger.info("База данных успешно подготовлена.")
 
 
-def pre_llm() -> None:
+def analyze_db() -> None:
+    """Обновляет статистику планировщика для рабочих таблиц после массовых загрузок."""
+    db = DatabaseManager()
+    try:
+        if db.analyze_tables(config.source_table_name, config.cleaned_table_name, config.result_table_name):
+            logger.info("✅ Статистика планировщика обновлена.")
+    finally:
+        db.close()
+
+
+def invalidate_llm_cache(model: str) -> None:
+    """Очищает персистентный кэш ответов LLM для модели (или целиком при 'all')."""
+    llm_config = LlmConfig()
+    cache = get_response_cache(
+        llm_config.cache_path,
+        llm_config.cache_max_entries,
+        llm_config.cache_max_age_seconds,
+        llm_config.cache_bypass_models
+    )
+    cache.invalidate(None if model == "all" else model)
+
+
+def clean_person_fields(person: dict[str, Any]) -> tuple:
+    """Применяет функции очистки к сырой записи о персоне.
+
+    Returns:
+        Кортеж (person_id, first_name, last_name, about) с очищенными полями.
+    """
+    person_id = cleaner.normalize_empty(person.get('person_id'))
+    first_name = cleaner.clean_name_field(cleaner.normalize_empty(person.get('first_name')))
+    last_name = cleaner.clean_second_name_field(cleaner.normalize_empty(person.get('last_name')))
+    about = cleaner.normalize_empty(person.get('about'))
+    channel_title = cleaner.normalize_empty(person.get('personal_channel_title'))
+    channel_about = cleaner.normalize_empty(person.get('personal_channel_about'))
+
+    if first_name and ' ' in first_name and not last_name:
+        parts = first_name.split(' ', 1)
+        if len(parts) == 2:
+            first_name, last_name = parts
+
+    about_clean = cleaner.merge_about_fields(about, channel_title, channel_about)
+    return person_id, first_name, last_name, about_clean
+
+
+def pre_llm(incremental: bool = False) -> None:
     """Выполняет предварительную очистку данных перед обработкой LLM.
 
     Извлекает необработанные данные, применяет к ним функции очистки
     (удаление мусора, нормализация) и обновляет "meaningful" поля в базе данных.
+    Записи обрабатываются батчами: каждый батч загружается через COPY
+    во временную таблицу и применяется одним UPDATE.
+
+    Args:
+        incremental: Обработать только новые записи с еще не заполненными
+                     "meaningful" полями, не трогая уже обработанные.
     """
-    db = DatabaseManager()
+    db = DatabaseManager(pooled=True)
+    where = ""
+    if incremental:
+        where = ("WHERE meaningful_first_name = '' AND meaningful_last_name = '' "
+                 "AND meaningful_about = ''")
+    select_query = f"""
+        SELECT person_id, first_name, last_name, about,
+               personal_channel_title, personal_channel_about
+        FROM {config.result_table_name} {where} ORDER BY person_id
+    """
+    persons = db.iter_query(select_query)
     try:
-        select_query = f"""
-            SELECT person_id, first_name, last_name, about,
-                   personal_channel_title, personal_channel_about
-            FROM {config.result_table_name} ORDER BY person_id
-        """
-        persons = db.execute_query(select_query)
-
-        for person in persons:
-            person_id = cleaner.normalize_empty(person.get('person_id'))
-            first_name = cleaner.clean_name_field(cleaner.normalize_empty(person.get('first_name')))
-            last_name = cleaner.clean_second_name_field(cleaner.normalize_empty(person.get('last_name')))
-            about = cleaner.normalize_empty(person.get('about'))
-            channel_title = cleaner.normalize_empty(person.get('personal_channel_title'))
-            channel_about = cleaner.normalize_empty(person.get('personal_channel_about'))
-
-            if first_name and ' ' in first_name and not last_name:
-                parts = first_name.split(' ', 1)
-                if len(parts) == 2:
-                    first_name, last_name = parts
-
-            about_clean = cleaner.merge_about_fields(about, channel_title, channel_about)
-            params = (first_name, last_name, about_clean, person_id)
-            db.execute_query(config.UPDATE_MEANINGFUL_FIELDS_QUERY, params)
+        total_updated = 0
+        batch_index = 0
+        while batch := list(islice(persons, config.PRE_LLM_BATCH_SIZE)):
+            batch_index += 1
+            rows = [clean_person_fields(person) for person in batch]
+            updated = db.copy_update(
+                table_name=config.result_table_name,
+                key_column="person_id",
+                columns=config.MEANINGFUL_FIELDS_COLUMNS,
+                rows=rows
+            )
+            total_updated += updated
+            logger.info(
+                f"Батч #{batch_index}: обновлено {updated}/{len(rows)} записей "
+                f"(всего обновлено {total_updated})."
+            )
     finally:
+        persons.close()
         db.close()
     logger.info("✅ Предварительная обработка завершена.")
 
 
-def export_batch_to_db(db: DatabaseManager, parsed_chunk: dict[str, dict[str, Any]]) -> int:
-    """Сохраняет результаты обработки одного батча от LLM в базу данных.
+async def export_batch_to_db(
+    db: AsyncDatabaseManager,
+    parsed_chunk: dict[str, dict[str, Any]],
+    expected_ids: set[int] | None = None,
+    dedupe: InputDeduplicator | None = None
+) -> set[int]:
+    """(async) Сохраняет результаты обработки одного батча от LLM в базу данных.
+
+    Все строки батча обновляются одним запросом `UPDATE ... FROM (VALUES ...)`
+    в одной транзакции. Если передан `dedupe`, в тот же запрос попадают
+    дубликаты представителей из батча.
 
     Args:
-        db: Экземпляр DatabaseManager для выполнения запросов.
+        db: Экземпляр AsyncDatabaseManager для выполнения запросов.
         parsed_chunk: Словарь с результатами от LLM, где ключ - индекс,
                       а значение - словарь с данными о человеке.
+        expected_ids: person_id, отправленные в LLM. Элементы с другими
+                      person_id (выдуманными моделью) отбрасываются.
+        dedupe: Дедупликатор этапа, у которого берутся дубликаты представителей.
 
     Returns:
-        Количество успешно обновленных строк в базе данных.
+        Множество person_id, успешно обновленных в базе данных (включая дубликаты).
     """
-    updated_rows_count = 0
+    rows = {}
     for data in parsed_chunk.values():
         if not isinstance(data, dict):
             logger.warning(f"Пропуск элемента: ожидался dict, получен {type(data)}")
@@ -101,143 +264,435 @@ def export_batch_to_db(db: DatabaseManager, parsed_chunk: dict[str, dict[str, An
         if not person_id:
             logger.warning("Пропуск элемента: отсутствует 'person_id'.")
             continue
+        try:
+            person_id = int(person_id)
+        except (TypeError, ValueError):
+            logger.warning(f"Пропуск элемента: некорректный person_id {person_id!r}.")
+            continue
+        if expected_ids is not None and person_id not in expected_ids:
+            logger.warning(f"Пропуск элемента: person_id {person_id} не из отправленного чанка.")
+            continue
 
         first_name = data.get('meaningful_first_name')
         last_name = data.get('meaningful_last_name')
         about = data.get('meaningful_about')
 
         is_valid = bool(first_name and last_name and about)
-        params = (first_name, last_name, about, is_valid, person_id)
-
-        try:
-            result = db.execute_query(config.UPDATE_LLM_RESULTS_QUERY, params)
-            affected_rows = result[0].get('affected_rows', 0) if result else 0
-            if affected_rows > 0:
-                updated_rows_count += 1
+        rows[person_id] = (person_id, first_name, last_name, about, is_valid)
+
+    if not rows:
+        return set()
+
+    members = {person_id: dedupe.take_members(person_id) for person_id in rows} if dedupe else {}
+    all_rows = list(rows.values()) + [
+        (member_id, *row[1:])
+        for person_id, row in rows.items() for member_id in members.get(person_id, [])
+    ]
+    result = await db.execute_bulk_update(
+        config.BULK_UPDATE_LLM_RESULTS_QUERY,
+        all_rows,
+        template=config.BULK_UPDATE_LLM_RESULTS_TEMPLATE
+    )
+    updated_ids = {row.get('person_id') for row in result}
+    for person_id in {row[0] for row in all_rows} - updated_ids:
+        logger.warning(f"Строка для person_id {person_id} не была обновлена в БД.")
+
+    if dedupe:
+        late_rows = []
+        for person_id, row in rows.items():
+            if person_id in updated_ids:
+                late_rows += [(member_id, *row[1:]) for member_id in dedupe.resolve(person_id, row[1:])]
             else:
-                logger.warning(f"Строка для person_id {person_id} не была обновлена в БД.")
-        except Exception as e:
-            logger.error(f"Ошибка обновления БД для person_id {person_id}: {e}")
+                dedupe.restore_members(person_id, members[person_id])
+        updated_ids |= await write_llm_results(db, late_rows)
 
-    return updated_rows_count
+    return updated_ids
 
 
-async def process_chunk(
-    llm: LlmClient,
-    db: DatabaseManager,
-    chunk_to_process: dict[int, dict[str, Any]],
-    chunk_index: int
-) -> bool:
+async def write_llm_results(db: AsyncDatabaseManager, rows: list[tuple]) -> set[int]:
+    """(async) Записывает готовые результаты LLM (person_id, имя, фамилия, описание, valid)
+    одним пакетным запросом. Используется для дубликатов, чей результат уже известен.
     """
-    Обрабатывает один чанк данных с логикой повторных попыток.
-    Возвращает True в случае успеха, False в случае неудачи.
+    if not rows:
+        return set()
+    result = await db.execute_bulk_update(
+        config.BULK_UPDATE_LLM_RESULTS_QUERY,
+        rows,
+        template=config.BULK_UPDATE_LLM_RESULTS_TEMPLATE
+    )
+    return {row.get('person_id') for row in result}
+
+
+def build_window_query(
+    where: str | None,
+    start_position: int,
+    row_count: int,
+    after_person_id: int | None = None
+) -> tuple[str, tuple]:
+    """Формирует запрос выборки окна персон, упорядоченного по person_id.
+
+    При заданном `after_person_id` используется keyset-пагинация
+    (`WHERE person_id > %s`), стоимость которой не растет с глубиной окна,
+    в отличие от OFFSET.
+
+    Args:
+        where: Дополнительное условие отбора (без ключевого слова WHERE).
+        start_position: Начальная позиция (OFFSET). Если 0, не используется.
+        row_count: Количество записей (LIMIT). Если -1, выбираются все.
+        after_person_id: Последний обработанный person_id предыдущего окна.
+
+    Returns:
+        Кортеж (SQL-запрос, параметры запроса).
     """
-    for attempt in range(config.MAX_RETRIES):
-        logger.info(f"Обработка чанка #{chunk_index}. Попытка {attempt + 1}/{config.MAX_RETRIES}.")
+    conditions = [where] if where else []
+    params: list[Any] = []
+    if after_person_id is not None:
+        conditions.append("person_id > %s")
+        params.append(after_person_id)
+
+    select_query = config.SELECT_PERSONS_BASE_QUERY
+    if conditions: select_query += " WHERE " + " AND ".join(conditions)
+    select_query += " ORDER BY person_id"
+    if row_count > 0: select_query += f" LIMIT {row_count}"
+    if start_position > 0: select_query += f" OFFSET {start_position}"
+    return select_query, tuple(params)
 
-        try:
-            parsed_chunk = await llm.async_parse_chunk_to_meaningful(chunk_to_process)
 
-            if not isinstance(parsed_chunk, dict) or not parsed_chunk:
-                logger.warning(
-                    f"LLM вернула некорректный результат для чанка #{chunk_index}. "
-                    f"Тип: {type(parsed_chunk)}"
-                )
-                await asyncio.sleep(0.5)
-                continue
+def log_resume_key(last_person_id: int | None) -> None:
+    """Выводит последний person_id окна для продолжения через --after-person-id."""
+    if last_person_id is not None:
+        logger.info(f"Последний person_id окна: {last_person_id}. "
+                    f"Для продолжения: --after-person-id {last_person_id}")
 
-            # синхронная функция БД в отдельном потоке, чтобы не блокировать #TODO
-            updated_count = await asyncio.to_thread(export_batch_to_db, db, parsed_chunk)
 
-            if updated_count == len(chunk_to_process):
-                logger.info(
-                    f"✅ Чанк #{chunk_index} успешно обработан и сохранен в БД "
-                    f"({updated_count} строк)."
-                )
-                return True
-            else:
-                logger.warning(
-                    f"БД обработала чанк #{chunk_index} не полностью "
-                    f"(обновлено {updated_count}/{len(chunk_to_process)}). "
-                )
-                await asyncio.sleep(0.5)
+def get_worker_id() -> str:
+    """Идентификатор текущего воркера очереди: хост и PID процесса."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def enqueue_stage(db: DatabaseManager, stage: str) -> None:
+    """Ставит в очередь задачи этапа для всех подходящих персон.
+
+    Операция идемпотентна: уже поставленные задачи не дублируются, поэтому
+    ее может выполнять каждый воркер при старте. Просроченные задачи,
+    исчерпавшие попытки, помечаются как failed.
+
+    Args:
+        db: Экземпляр DatabaseManager.
+        stage: Этап обработки (ключ JOB_STAGE_FILTERS).
+    """
+    db.execute_query(config.CREATE_JOBS_TABLE_QUERY)
+    db.execute_query(config.FAIL_EXPIRED_JOBS_QUERY, (stage, config.JOB_MAX_ATTEMPTS))
+    enqueue_query = config.ENQUEUE_JOBS_QUERY.format(where=config.JOB_STAGE_FILTERS[stage])
+    result = db.execute_query(enqueue_query, (stage,))
+    added = result[0].get('affected_rows', 0) if result else 0
+    logger.info(f"Очередь '{stage}': добавлено {added} новых задач.")
+
+
+def iter_claimed_rows(
+    db: DatabaseManager,
+    stage: str,
+    worker_id: str,
+    batch_size: int
+) -> Iterator[dict[str, Any]]:
+    """Забирает задачи этапа из очереди пачками и отдает соответствующие записи персон.
+
+    Задачи захватываются через `FOR UPDATE SKIP LOCKED` с арендой
+    `JOB_LEASE_SECONDS`, поэтому несколько воркеров на разных машинах
+    получают непересекающиеся пачки, а задачи упавших воркеров
+    возвращаются в работу по истечении аренды.
+    """
+    while claimed := db.execute_query(
+        config.CLAIM_JOBS_QUERY,
+        (worker_id, config.JOB_LEASE_SECONDS, stage,
+         config.JOB_MAX_ATTEMPTS, config.JOB_MAX_ATTEMPTS, batch_size)
+    ):
+        person_ids = [row.get('person_id') for row in claimed]
+        logger.debug(f"Очередь '{stage}': захвачено {len(person_ids)} задач.")
+        yield from db.execute_query(config.SELECT_PERSONS_BY_IDS_QUERY, (person_ids,))
+
+
+def complete_jobs(
+    db: DatabaseManager,
+    stage: str,
+    worker_id: str,
+    person_ids: list[int],
+    success: bool
+) -> None:
+    """Помечает задачи этапа выполненными (done) или неудачными (failed)."""
+    status = config.JOB_STATUS_DONE if success else config.JOB_STATUS_FAILED
+    db.execute_query(config.COMPLETE_JOBS_QUERY, (status, stage, person_ids, worker_id))
+
+
+async def async_enqueue_stage(db: AsyncDatabaseManager, stage: str) -> None:
+    """(async) enqueue_stage"""
+    await db.execute_query(config.CREATE_JOBS_TABLE_QUERY)
+    await db.execute_query(config.FAIL_EXPIRED_JOBS_QUERY, (stage, config.JOB_MAX_ATTEMPTS))
+    enqueue_query = config.ENQUEUE_JOBS_QUERY.format(where=config.JOB_STAGE_FILTERS[stage])
+    result = await db.execute_query(enqueue_query, (stage,))
+    added = result[0].get('affected_rows', 0) if result else 0
+    logger.info(f"Очередь '{stage}': добавлено {added} новых задач.")
+
+
+async def async_iter_claimed_rows(
+    db: AsyncDatabaseManager,
+    stage: str,
+    worker_id: str,
+    batch_size: int
+) -> AsyncIterator[dict[str, Any]]:
+    """(async) iter_claimed_rows"""
+    while claimed := await db.execute_query(
+        config.CLAIM_JOBS_QUERY,
+        (worker_id, config.JOB_LEASE_SECONDS, stage,
+         config.JOB_MAX_ATTEMPTS, config.JOB_MAX_ATTEMPTS, batch_size)
+    ):
+        person_ids = [row.get('person_id') for row in claimed]
+        logger.debug(f"Очередь '{stage}': захвачено {len(person_ids)} задач.")
+        for row in await db.execute_query(config.SELECT_PERSONS_BY_IDS_QUERY, (person_ids,)):
+            yield row
+
+
+async def async_complete_jobs(
+    db: AsyncDatabaseManager,
+    stage: str,
+    worker_id: str,
+    person_ids: list[int],
+    success: bool
+) -> None:
+    """(async) complete_jobs"""
+    status = config.JOB_STATUS_DONE if success else config.JOB_STATUS_FAILED
+    await db.execute_query(config.COMPLETE_JOBS_QUERY, (status, stage, person_ids, worker_id))
+
+
+async def run_job(
+    db: AsyncDatabaseManager,
+    stage: str,
+    worker_id: str,
+    person_ids: list[int],
+    coro: Coroutine[Any, Any, Any]
+) -> Any:
+    """(async) Выполняет обработку и закрывает задачи очереди по ее результату.
+
+    Результат False считается неудачей, любой другой — успехом.
+    """
+    result = await coro
+    await async_complete_jobs(db, stage, worker_id, person_ids, result is not False)
+    return result
+
+
+async def process_chunk(
+    llm: LlmClient,
+    db: AsyncDatabaseManager,
+    chunk_to_process: dict[int, dict[str, Any]],
+    chunk_index: int,
+    use_cache: bool = True,
+    dedupe: InputDeduplicator | None = None
+) -> list[dict[str, Any]]:
+    """
+    Обрабатывает один чанк данных: один запрос к LLM и пакетная запись в БД
+    (вместе с дубликатами записей чанка, если передан `dedupe`).
+    Возвращает записи чанка, которые не удалось обработать (LLM их пропустила
+    или они не записались в БД), — их нужно отправить повторно.
+    """
+    rows = list(chunk_to_process.values())
+    logger.info(f"Обработка чанка #{chunk_index} ({len(rows)} записей).")
+    try:
+        parsed_chunk = await llm.async_parse_chunk_to_meaningful(chunk_to_process, use_cache=use_cache)
 
-        except Exception as e:
-            logger.error(f"Ошибка при обработке чанка #{chunk_index} на попытке {attempt + 1}: {e}", exc_info=True)
-            await asyncio.sleep(1)
+        if not isinstance(parsed_chunk, dict) or not parsed_chunk:
+            logger.warning(
+                f"LLM вернула некорректный результат для чанка #{chunk_index}. "
+                f"Тип: {type(parsed_chunk)}"
+            )
+            return rows
 
-    logger.error(f"❌ Не удалось обработать чанк #{chunk_index} после {config.MAX_RETRIES} попыток. Пропускаем.")
-    return False
+        expected_ids = {row["person_id"] for row in rows}
+        updated_ids = await export_batch_to_db(db, parsed_chunk, expected_ids, dedupe)
+    except Exception as e:
+        logger.error(f"Ошибка при обработке чанка #{chunk_index}: {e}", exc_info=True)
+        return rows
+
+    stragglers = [row for row in rows if row["person_id"] not in updated_ids]
+    if stragglers:
+        logger.warning(
+            f"Чанк #{chunk_index} обработан не полностью "
+            f"(обновлено {len(rows) - len(stragglers)}/{len(rows)}), "
+            f"на повтор: {[row['person_id'] for row in stragglers]}."
+        )
+    else:
+        logger.info(
+            f"✅ Чанк #{chunk_index} успешно обработан и сохранен в БД "
+            f"({len(rows)} строк)."
+        )
+    return stragglers
 
 
-async def test_llm(start_position: int, row_count: int) -> None:
+def build_chunk_row(row: dict[str, Any]) -> dict[str, Any]:
+    """Формирует запись чанка для LLM из строки таблицы результатов.
+    Слишком длинное описание обрезается до MAX_ABOUT_CHARS символов.
+    """
+    about = row.get('meaningful_about') or ''
+    if len(about) > config.MAX_ABOUT_CHARS:
+        about = about[:config.MAX_ABOUT_CHARS] + '…'
+    return {
+        "person_id": row.get('person_id'),
+        "first_name": row.get('meaningful_first_name', ''),
+        "last_name": row.get('meaningful_last_name', ''),
+        "about": about
+    }
+
+
+async def test_llm(start_position: int, row_count: int, after_person_id: int | None, use_queue: bool) -> None:
     """(async) Обрабатывает записи партиями (батчами) через LLM для очистки данных.
 
-    Функция выбирает записи из `result_table_name`, формирует из них батчи
-    и отправляет в LlmClient для извлечения осмысленных полей
+    Функция выбирает записи из `result_table_name`, упаковывает их в чанки
+    по бюджету токенов (CHUNK_TOKEN_BUDGET) и отправляет в LlmClient для извлечения осмысленных полей
     (имя, фамилия, описание). Результаты сохраняются обратно в БД.
-    Реализован механизм повторных попыток для неудачно обработанных батчей.
+    Записи, которые LLM пропустила или которые не записались в БД, собираются
+    из всех чанков и повторно отправляются новыми чанками (до MAX_RETRIES попыток).
 
     Args:
         start_position: Начальная позиция (OFFSET) для выборки записей из БД.
         row_count: Количество записей (LIMIT) для обработки. Если -1, обрабатываются все.
+        after_person_id: Обрабатывать только записи с person_id больше указанного (keyset-окно).
+        use_queue: Брать записи из общей очереди задач вместо окна (для нескольких воркеров).
     """
     logger.info("Начинаем обработку записей через LLM.")
-
-    select_query = (
-        f"{config.SELECT_PERSONS_BASE_QUERY} "
-        f"ORDER BY person_id"
-    )
-    if row_count > 0: select_query += f" LIMIT {row_count}"
-    if start_position > 0: select_query += f" OFFSET {start_position}"
-
-    db = DatabaseManager()
+    set_stage("llm")
+
+    db = AsyncDatabaseManager()
+    await db.open()
+    worker_id = get_worker_id()
+    if use_queue:
+        await async_enqueue_stage(db, "llm")
+        records = async_iter_claimed_rows(db, "llm", worker_id, config.CHUNK_SIZE)
+    else:
+        select_query, params = build_window_query(None, start_position, row_count, after_person_id)
+        records = db.iter_query(select_query, params or None)
+    last_person_id = None
     try:
-        records = db.execute_query(select_query)
-        total = len(records)
-        if total == 0:
-            logger.info("Нет записей для обработки.")
-            return
-
         llm = LlmClient()
-        CHUNK_SIZE: int = config.CHUNK_SIZE
-
-        all_chunks = []
-        for i in range(0, total, CHUNK_SIZE):
-            right_index = min(i + CHUNK_SIZE, total)
-            chunk = {
-                index: {
-                    "person_id": row.get('person_id'),
-                    "first_name": row.get('meaningful_first_name', ''),
-                    "last_name": row.get('meaningful_last_name', ''),
-                    "about": row.get('meaningful_about', '')
-                } for index, row in enumerate(records[i:right_index])
-            }
-            all_chunks.append(chunk)
-
-        logger.info(f"Подготовлено {len(all_chunks)} чанков для обработки.")
-
-        semaphore = asyncio.Semaphore(config.ASYNC_LLM_REQUESTS_WORKERS)
+        # с каскадом (LLM_CHEAP_MODEL) каждый чанк сначала идет в дешевую модель,
+        # поэтому параллельность этапа подстраивается по ее сигналам перегрузки
+        stage_model = llm.config.cheap_model or llm.config.default_model
+        limiter = llm.limiter_for(stage_model, config.ASYNC_LLM_REQUESTS_WORKERS)
+        chunk_index = 0
+        total_records = 0
+        stragglers: list[dict[str, Any]] = []
+        # в режиме очереди записи распределены между воркерами, дедупликация не используется
+        dedupe = InputDeduplicator(config.DEDUPE_MAX_RESULTS) if config.DEDUPE_ENABLED and not use_queue else None
+        fast_path = None
+        if config.FAST_PATH_ENABLED:
+            fast_path = FastPathResolver(load_first_names(config.FIRST_NAMES_LEXICON_PATH))
+        # готовые результаты без запроса к LLM (быстрый путь и поздние дубликаты)
+        ready_rows: list[tuple] = []
+
+        async def flush_ready() -> None:
+            written_ids = await write_llm_results(db, ready_rows)
+            if use_queue and written_ids:
+                await async_complete_jobs(db, "llm", worker_id, list(written_ids), True)
+            ready_rows.clear()
+
+        async def handle_chunk(chunk: dict[int, dict[str, Any]], use_cache: bool) -> None:
+            nonlocal chunk_index
+            index = chunk_index
+            chunk_index += 1
+            failed = await process_chunk(llm, db, chunk, index, use_cache, dedupe)
+            if use_queue:
+                failed_ids = {row["person_id"] for row in failed}
+                done_ids = [row["person_id"] for row in chunk.values() if row["person_id"] not in failed_ids]
+                if done_ids:
+                    await async_complete_jobs(db, "llm", worker_id, done_ids, True)
+            stragglers.extend(failed)
+
+        async def chunks():
+            nonlocal last_person_id, total_records
+            packer = llm.chunk_packer()
+            async for row in records:
+                last_person_id = row.get('person_id')
+                total_records += 1
+                if len(ready_rows) >= config.DEDUPE_FANOUT_BATCH_SIZE:
+                    await flush_ready()
+                if fast_path is not None and (resolved := fast_path.resolve(
+                    row.get('meaningful_first_name'), row.get('meaningful_last_name'), row.get('meaningful_about')
+                )):
+                    ready_rows.append((row.get('person_id'), *resolved))
+                    continue
+                if dedupe is not None:
+                    key = dedupe.make_key(row.get('meaningful_first_name'), row.get('meaningful_last_name'),
+                                          row.get('meaningful_about'))
+                    status, result = dedupe.admit(key, row.get('person_id'))
+                    if status == "done":
+                        ready_rows.append((row.get('person_id'), *result))
+                    if status != "new":
+                        continue
+                if batch := packer.add(build_chunk_row(row)):
+                    yield handle_chunk(dict(enumerate(batch)), use_cache=True)
+            if batch := packer.flush():
+                yield handle_chunk(dict(enumerate(batch)), use_cache=True)
+            if packer.chunks:
+                logger.info(
+                    f"Записи упакованы в {packer.chunks} чанков "
+                    f"(в среднем {packer.rows / packer.chunks:.1f} записей на чанк)."
+                )
 
-        async def worker_with_semaphore(chunk, index):
-            async with semaphore:
-                return await process_chunk(llm, db, chunk, index)
+        async def retry_chunks(pending: list[dict[str, Any]], delay: float):
+            # недообработанные записи из разных чанков собираются в новые чанки;
+            # повторы идут в обход кэша, иначе вернется тот же неудачный ответ
+            await asyncio.sleep(delay)
+            for batch in llm.chunk_packer().pack(pending):
+                yield handle_chunk(dict(enumerate(batch)), use_cache=False)
 
-        tasks = [
-            worker_with_semaphore(chunk, i)
-            for i, chunk in enumerate(all_chunks)
-        ]
+        await run_bounded(chunks(), limiter)
+        await flush_ready()
+        if not total_records:
+            logger.info("Нет записей для обработки.")
+            return
 
-        results = await asyncio.gather(*tasks)
+        for attempt in range(1, config.MAX_RETRIES):
+            if not stragglers:
+                break
+            pending, stragglers = stragglers, []
+            delay = max(config.RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1),
+                        llm.retry_delay(stage_model), llm.retry_delay(llm.config.default_model))
+            logger.info(
+                f"Повтор {attempt}/{config.MAX_RETRIES - 1}: {len(pending)} записей, "
+                f"пауза {delay:.1f} с."
+            )
+            await run_bounded(retry_chunks(pending, delay), limiter)
+
+        failed_ids = [row["person_id"] for row in stragglers]
+        if dedupe is not None:
+            failed_ids += [member_id for row in stragglers for member_id in dedupe.fail(row["person_id"])]
+        if failed_ids:
+            logger.error(
+                f"❌ Не удалось обработать {len(failed_ids)} записей после "
+                f"{config.MAX_RETRIES} попыток: {failed_ids}."
+            )
+            if use_queue:
+                await async_complete_jobs(db, "llm", worker_id, failed_ids, False)
 
-        successful_chunks = sum(1 for res in results if res)
         logger.info(
             f"✅ Обработка завершена. Успешно обработано: "
-            f"{successful_chunks}/{len(all_chunks)} чанков."
+            f"{total_records - len(failed_ids)}/{total_records} записей."
         )
+        if fast_path is not None:
+            fast_path.log_stats()
+        if dedupe is not None:
+            dedupe.log_stats("llm")
+        llm.log_chunk_usage()
+        llm.log_cascade_stats()
+        llm.log_cache_stats()
+        log_limiter_stats()
+        log_endpoint_stats()
+        log_usage_summary()
+        if not use_queue:
+            log_resume_key(last_person_id)
 
     finally:
-        db.close()
+        await records.aclose()
+        await db.close()
+        await aclose_http_clients()
     logger.info("✅ Обработка записей через LLM завершена.")
 
 
@@ -268,11 +723,14 @@ async def process_person_for_search(
     person: dict,
     perp_client: PerplexityClient,
     check_llm: LlmClient,
-    db: DatabaseManager,
-    exporter: MarkdownExporter | None
-) -> None:
+    db: AsyncDatabaseManager,
+    exporter: MarkdownExporter | None,
+    dedupe: InputDeduplicator | None = None
+) -> bool:
     """
     Выполняет полный цикл поиска и сохранения информации для одной персоны.
+    Если передан `dedupe`, результат одним запросом записывается и дубликатам персоны.
+    Возвращает True в случае успеха, False в случае ошибки.
     """
     person_id = person.get('person_id')
     try:
@@ -285,15 +743,18 @@ async def process_person_for_search(
 
         summary = search_result.get("summary")
         if not summary: summary = ''
-        is_summary_valid = await check_llm.async_postcheck(summary)
+        is_summary_valid = await check_llm.async_check_summary(summary, len(search_result.get("urls") or []))
 
         params = (
             summary if is_summary_valid else None,
             search_result.get("urls"),
-            search_result.get("confidence") if is_summary_valid else "low",
-            person_id
+            search_result.get("confidence") if is_summary_valid else "low"
         )
-        await asyncio.to_thread(db.execute_query, config.UPDATE_SUMMARY_QUERY, params)
+        member_ids = dedupe.take_members(person_id) if dedupe else []
+        await write_summary_results(db, [(pid, *params) for pid in (person_id, *member_ids)])
+        if dedupe:
+            late_ids = dedupe.resolve(person_id, params)
+            await write_summary_results(db, [(pid, *params) for pid in late_ids])
 
         if exporter and is_summary_valid:
             await asyncio.to_thread(
@@ -304,11 +765,31 @@ async def process_person_for_search(
                 urls=search_result.get("urls", [])
             )
         logger.info(f"✅ Успешно обработан person_id: {person_id}")
+        return True
     except Exception as e:
         logger.error(f"❌ Ошибка при обработке person_id {person_id}: {e}", exc_info=True)
+        if dedupe and (member_ids := dedupe.fail(person_id)):
+            logger.error(f"❌ Без результата остались дубликаты person_id {person_id}: {member_ids}")
+        return False
+
+
+async def write_summary_results(db: AsyncDatabaseManager, rows: list[tuple]) -> None:
+    """(async) Записывает результаты поиска (person_id, summary, urls, confidence) одним пакетным запросом."""
+    if rows:
+        await db.execute_bulk_update(
+            config.BULK_UPDATE_SUMMARY_QUERY,
+            rows,
+            template=config.BULK_UPDATE_SUMMARY_TEMPLATE
+        )
 
 
-async def test_perpsearch(start_position: int, row_count: int, md_flag: bool) -> None:
+async def test_perpsearch(
+    start_position: int,
+    row_count: int,
+    md_flag: bool,
+    after_person_id: int | None,
+    use_queue: bool
+) -> None:
     """(async) Выполняет поиск информации о персонах через Perplexity и сохраняет результаты.
 
     Для каждой "валидной" персоны из БД формируется поисковый запрос.
@@ -320,25 +801,25 @@ async def test_perpsearch(start_position: int, row_count: int, md_flag: bool) ->
         start_position: Начальная позиция (OFFSET) для выборки записей.
         row_count: Количество записей (LIMIT) для обработки.
         md_flag: Флаг, разрешающий экспорт результатов в Markdown файлы.
+        after_person_id: Обрабатывать только записи с person_id больше указанного (keyset-окно).
+        use_queue: Брать записи из общей очереди задач вместо окна (для нескольких воркеров).
     """
     logger.info("Начинаем поиск информации через PerplexityClient.")
-
-    select_query = (
-        f"{config.SELECT_PERSONS_BASE_QUERY} "
-        f"WHERE valid ORDER BY person_id"
-    )
-    if row_count > 0: select_query += f" LIMIT {row_count}"
-    if start_position > 0: select_query += f" OFFSET {start_position}"
-
-    db = DatabaseManager()
+    set_stage("search")
+
+    db = AsyncDatabaseManager()
+    await db.open()
+    worker_id = get_worker_id()
+    if use_queue:
+        await async_enqueue_stage(db, "search")
+        persons = async_iter_claimed_rows(db, "search", worker_id, config.ASYNC_SEARCH_REQUESTS_WORKERS)
+    else:
+        select_query, params = build_window_query("valid", start_position, row_count, after_person_id)
+        persons = db.iter_query(select_query, params or None)
+    last_person_id = None
+    check_llm = None
 
     try:
-        persons = db.execute_query(select_query)
-        total = len(persons)
-        if total == 0:
-            logger.info("Не найдено валидных персон для поиска информации.")
-            return
-
         perp_client = PerplexityClient()
         check_llm = LlmClient()
         exporter = None
@@ -346,27 +827,138 @@ async def test_perpsearch(start_position: int, row_count: int, md_flag: bool) ->
             date_str = datetime.datetime.now().strftime("%Y-%m-%d-%H%M")
             exporter = MarkdownExporter(f"data/{date_str}_person_reports")
 
-        semaphore = asyncio.Semaphore(config.ASYNC_SEARCH_REQUESTS_WORKERS)
+        # Узкое место этапа — запросы к Perplexity, по ним и подстраивается параллельность
+        limiter = perp_client.limiter_for(perp_client.config.perplexity_model,
+                                          config.ASYNC_SEARCH_REQUESTS_WORKERS)
+        # пакет postcheck не больше числа одновременных поисков, иначе он всегда ждет таймаут
+        check_llm.postcheck_size_limit = lambda: int(limiter.limit)
+
+        # в режиме очереди записи распределены между воркерами, дедупликация не используется
+        dedupe = InputDeduplicator(config.DEDUPE_MAX_RESULTS) if config.DEDUPE_ENABLED and not use_queue else None
+        fanout_rows: list[tuple] = []
+
+        async def searches():
+            nonlocal last_person_id
+            async for batch in iter_batches(persons, config.ASYNC_SEARCH_REQUESTS_WORKERS):
+                last_person_id = batch[-1].get('person_id')
+                for person in batch:
+                    if dedupe is not None:
+                        key = dedupe.make_key(person.get('meaningful_first_name'),
+                                              person.get('meaningful_last_name'),
+                                              person.get('meaningful_about'))
+                        status, result = dedupe.admit(key, person.get('person_id'))
+                        if status == "done":
+                            fanout_rows.append((person.get('person_id'), *result))
+                        if status != "new":
+                            continue
+                    coro = process_person_for_search(person, perp_client, check_llm, db, exporter, dedupe)
+                    if use_queue:
+                        coro = run_job(db, "search", worker_id, [person.get('person_id')], coro)
+                    yield coro
+                if len(fanout_rows) >= config.DEDUPE_FANOUT_BATCH_SIZE:
+                    await write_summary_results(db, fanout_rows)
+                    fanout_rows.clear()
+
+        results = await run_bounded(searches(), limiter)
+        await write_summary_results(db, fanout_rows)
+        if dedupe is not None:
+            dedupe.log_stats("search")
+        check_llm.summary_prefilter.log_stats()
+        if check_llm.postcheck_batcher is not None:
+            check_llm.postcheck_batcher.log_stats()
+        if not results:
+            logger.info("Не найдено валидных персон для поиска информации.")
+            return
 
-        async def worker_with_semaphore(person):
-            async with semaphore:
-                await process_person_for_search(person, perp_client, check_llm, db, exporter)
+        logger.info(f"Обработано {len(results)} записей.")
+        perp_client.log_cache_stats()
+        perp_client.log_hedge_stats()
+        log_limiter_stats()
+        log_endpoint_stats()
+        log_usage_summary()
+        if not use_queue:
+            log_resume_key(last_person_id)
 
-        tasks = [worker_with_semaphore(person) for person in persons]
+    finally:
+        if check_llm is not None and check_llm.postcheck_batcher is not None:
+            await check_llm.postcheck_batcher.aclose()
+        await persons.aclose()
+        await db.close()
+        await aclose_http_clients()
+    logger.info("✅ Поиск информации завершен.")
 
-        await asyncio.gather(*tasks)
 
-        logger.info(f"Обработано {total} записей.")
+def process_person_photos(person: dict[str, Any], photo_processor: PhotoProcessor, db: DatabaseManager) -> None:
+    """
+    Ищет, анализирует и кластеризует фото одной персоны и сохраняет результат в БД.
+    """
+    person_id = person.get("person_id")
+    person_urls = person.get("urls", [])
+
+    web_image_urls = []
+    if person_urls:
+        for url in person_urls:
+            web_image_urls.extend(photo_processor.extract_image_urls_from_page(url))
+        logger.debug(f"Найдено {len(web_image_urls)} изображений в вебе для person_id: {person_id}")
+
+    local_avatars = []
+    avatars_dir = Path(config.PATH_PRM_MEDIA) / str(person_id) / config.PATH_PERSON_TG_AVATARS
+    if avatars_dir.is_dir():
+        found_files = list(avatars_dir.glob('*.jpg'))
+        local_avatars = [str(p) for p in found_files]
+        logger.debug(f"Найдено {len(local_avatars)} локальных аватаров в {avatars_dir} для person_id: {person_id}")
+
+    web_human_face_images = [
+        url for url in set(web_image_urls)
+        if photo_processor.is_single_human_face(url)
+    ]
+
+    local_human_face_images = [
+        path for path in set(local_avatars)
+        if photo_processor.is_single_human_face(path)
+    ]
+
+    all_human_face_images = web_human_face_images + local_human_face_images
+    
+    if not all_human_face_images:
+        logger.warning(f"❌ Найдено {len(web_human_face_images)} веб-фото с лицом и {len(local_human_face_images)} локальных фото с лицом для person_id: {person_id}.")
+        return
 
-    finally:
-        db.close()
-    logger.info("✅ Поиск информации завершен.")
+    logger.info(f"Найдено {len(web_human_face_images)} веб-фото с лицом и {len(local_human_face_images)} локальных фото с лицом для person_id: {person_id}.")
+
+    clusters = photo_processor.cluster_faces(all_human_face_images)
+    if not clusters:
+        logger.warning("❌ Кластеры не сформированы. Проверяем наличие локальных фото с лицами.")
+        if local_human_face_images:
+            logger.info(f"❌✅ Сохраняем {len(local_human_face_images)} локальных фото с лицами как запасной вариант.")
+            params = (local_human_face_images, person_id)
+            db.execute_query(config.UPDATE_PHOTOS_QUERY, params)
+        else:
+            logger.info("❌❌ Локальных фото с лицами для сохранения не найдено.")
+        return
+
+    main_cluster = max(clusters, key=len)
+    if len(main_cluster) >= config.MIN_PHOTOS_IN_CLUSTER:
+        params = (main_cluster, person_id)
+        db.execute_query(config.UPDATE_PHOTOS_QUERY, params)
+        logger.info(
+            f"✅ Для {person_id} найден и сохранен кластер из {len(main_cluster)} фотографий."
+        )
+    else:
+        logger.warning(f"Самый большой кластер ({len(main_cluster)} фото) слишком мал. Проверяем локальные фото.")
+        if local_human_face_images:
+            logger.info(f"Сохраняем {len(local_human_face_images)} локальных фото с лицами вместо маленького кластера.")
+            params = (local_human_face_images, person_id)
+            db.execute_query(config.UPDATE_PHOTOS_QUERY, params)
 
 
-def test_searching_photos() -> None:
+def test_searching_photos(use_queue: bool) -> None:
     """
     Ищет, анализирует и кластеризует фото из веба и файлов.
     Если кластер не найден, сохраняет локальные фото с лицами.
+
+    Args:
+        use_queue: Брать записи из общей очереди задач (для нескольких воркеров).
     """
     logger.info("Начинаем поиск и анализ фотографий.")
 
@@ -378,144 +970,108 @@ def test_searching_photos() -> None:
 
     db = DatabaseManager()
     try:
+        photo_processor = PhotoProcessor()
+        if use_queue:
+            worker_id = get_worker_id()
+            enqueue_stage(db, "photos")
+            processed = 0
+            for person in iter_claimed_rows(db, "photos", worker_id, batch_size=1):
+                person_id = person.get("person_id")
+                processed += 1
+                logger.info(f"[{processed}] Обработка фотографий для person_id: {person_id}")
+                try:
+                    process_person_photos(person, photo_processor, db)
+                    complete_jobs(db, "photos", worker_id, [person_id], success=True)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка обработки фотографий для person_id {person_id}: {e}", exc_info=True)
+                    complete_jobs(db, "photos", worker_id, [person_id], success=False)
+            return
+
         persons = db.execute_query(select_query)
         if not persons:
             logger.info("Не найдено персон для поиска фотографий.")
             return
 
-        photo_processor = PhotoProcessor()
         total = len(persons)
 
         for i, person in enumerate(persons, 1):
-            person_id = person.get("person_id")
-            person_urls = person.get("urls", [])
-
-            logger.info(f"[{i}/{total}] Обработка фотографий для person_id: {person_id}")
-
-            web_image_urls = []
-            if person_urls:
-                for url in person_urls:
-                    web_image_urls.extend(photo_processor.extract_image_urls_from_page(url))
-                logger.debug(f"Найдено {len(web_image_urls)} изображений в вебе для person_id: {person_id}")
-
-            local_avatars = []
-            avatars_dir = Path(config.PATH_PRM_MEDIA) / str(person_id) / config.PATH_PERSON_TG_AVATARS
-            if avatars_dir.is_dir():
-                found_files = list(avatars_dir.glob('*.jpg'))
-                local_avatars = [str(p) for p in found_files]
-                logger.debug(f"Найдено {len(local_avatars)} локальных аватаров в {avatars_dir} для person_id: {person_id}")
-
-            web_human_face_images = [
-                url for url in set(web_image_urls)
-                if photo_processor.is_single_human_face(url)
-            ]
-
-            local_human_face_images = [
-                path for path in set(local_avatars)
-                if photo_processor.is_single_human_face(path)
-            ]
-
-            all_human_face_images = web_human_face_images + local_human_face_images
-            
-            if not all_human_face_images:
-                logger.warning(f"❌ Найдено {len(web_human_face_images)} веб-фото с лицом и {len(local_human_face_images)} локальных фото с лицом для person_id: {person_id}.")
-                continue
-
-            logger.info(f"Найдено {len(web_human_face_images)} веб-фото с лицом и {len(local_human_face_images)} локальных фото с лицом для person_id: {person_id}.")
-
-            clusters = photo_processor.cluster_faces(all_human_face_images)
-            if not clusters:
-                logger.warning("❌ Кластеры не сформированы. Проверяем наличие локальных фото с лицами.")
-                if local_human_face_images:
-                    logger.info(f"❌✅ Сохраняем {len(local_human_face_images)} локальных фото с лицами как запасной вариант.")
-                    params = (local_human_face_images, person_id)
-                    db.execute_query(config.UPDATE_PHOTOS_QUERY, params)
-                else:
-                    logger.info("❌❌ Локальных фото с лицами для сохранения не найдено.")
-                continue
-
-            main_cluster = max(clusters, key=len)
-            if len(main_cluster) >= config.MIN_PHOTOS_IN_CLUSTER:
-                params = (main_cluster, person_id)
-                db.execute_query(config.UPDATE_PHOTOS_QUERY, params)
-                logger.info(
-                    f"✅ Для {person_id} найден и сохранен кластер из {len(main_cluster)} фотографий."
-                )
-            else:
-                logger.warning(f"Самый большой кластер ({len(main_cluster)} фото) слишком мал. Проверяем локальные фото.")
-                if local_human_face_images:
-                    logger.info(f"Сохраняем {len(local_human_face_images)} локальных фото с лицами вместо маленького кластера.")
-                    params = (local_human_face_images, person_id)
-                    db.execute_query(config.UPDATE_PHOTOS_QUERY, params)
+            logger.info(f"[{i}/{total}] Обработка фотографий для person_id: {person.get('person_id')}")
+            process_person_photos(person, photo_processor, db)
     finally:
         db.close()
     logger.info("Поиск и анализ фотографий завершен.")
 
 
+def prepare_person_for_html(person: dict[str, Any]) -> dict[str, Any]:
+    """
+    Готовит запись о персоне к выводу в HTML: чистит summary
+    и разделяет фотографии на локальные (base64) и веб-ссылки.
+    """
+    person['summary'] = cleaner.clean_summary(person.get('summary', ''))
+    photo_sources = person.get('photos') or []
+    local_photos = []
+    web_photos = []
+    for src in photo_sources:
+        if src and src.startswith('prm_media/'):
+            try:
+                file_path = Path(src)
+                mime_type, _ = mimetypes.guess_type(file_path)
+                if not mime_type: mime_type = 'image/jpeg'
+
+                encoded_data = base64.b64encode(file_path.read_bytes()).decode('ascii')
+                base64_uri = f"data:{mime_type};base64,{encoded_data}"
+                if base64_uri:
+                    local_photos.append(base64_uri)
+            except FileNotFoundError:
+                logger.warning(f"Локальный файл не найден, пропуск: {src}")
+            except Exception as e:
+                logger.error(f"Ошибка кодирования файла {src}: {e}")
+        elif src:
+            web_photos.append(src)
+    person['web_photos'] = web_photos
+    person['local_photos'] = local_photos
+    return person
+
+
 def export_to_html() -> None:
     """
     Экспортирует данные о персонах из БД в единый HTML-файл,
     используя шаблонизатор Jinja2 для генерации разметки.
+    Записи читаются потоково и сразу рендерятся в файл.
     """
     logger.info("Начинаем экспорт людей в html таблицу.")
     db = DatabaseManager()
+    select_query: str = f"""
+        {config.SELECT_PERSONS_BASE_QUERY}
+        WHERE valid AND summary IS NOT NULL
+        AND TRIM(summary) != '' ORDER BY person_id
+    """
+    persons = db.iter_query(select_query)
     try:
-        select_query: str = f"""
-            {config.SELECT_PERSONS_BASE_QUERY}
-            WHERE valid AND summary IS NOT NULL
-            AND TRIM(summary) != '' ORDER BY person_id
-        """
-        persons = db.execute_query(select_query)
-    finally:
-        db.close()
-
-    if not persons:
-        logger.warning("Не найдено персон для экспорта.")
-        return
+        first_person = next(persons, None)
+        if first_person is None:
+            logger.warning("Не найдено персон для экспорта.")
+            return
 
-    try:
         env = Environment(loader=FileSystemLoader('templates/'), autoescape=True)
         template = env.get_template('template.html')
         css_content = Path('templates/style.css').read_text(encoding='utf-8')
 
-        for person in persons:
-            person['summary'] = cleaner.clean_summary(person.get('summary', ''))
-            photo_sources = person.get('photos') or []
-            local_photos = []
-            web_photos = []
-            for src in photo_sources:
-                if src and src.startswith('prm_media/'):
-                    try:
-                        file_path = Path(src)
-                        mime_type, _ = mimetypes.guess_type(file_path)
-                        if not mime_type: mime_type = 'image/jpeg'
-                    
-                        encoded_data = base64.b64encode(file_path.read_bytes()).decode('ascii')
-                        base64_uri = f"data:{mime_type};base64,{encoded_data}"
-                        if base64_uri:
-                            local_photos.append(base64_uri)
-                    except FileNotFoundError:
-                        logger.warning(f"Локальный файл не найден, пропуск: {src}")
-                    except Exception as e:
-                        logger.error(f"Ошибка кодирования файла {src}: {e}")
-                elif src:
-                    web_photos.append(src)
-            person['web_photos'] = web_photos
-            person['local_photos'] = local_photos
-
-        final_html = template.render(
-            people=persons,
-            css_content=css_content
-        )
-
         result_filename = "people_analysis.html"
-        Path(result_filename).write_text(final_html, encoding='utf-8')
+        with Path(result_filename).open('w', encoding='utf-8') as html_file:
+            html_file.writelines(template.generate(
+                people=map(prepare_person_for_html, chain([first_person], persons)),
+                css_content=css_content
+            ))
         logger.info(f"✅ HTML-таблица успешно сохранена в файл: {result_filename}")
 
     except FileNotFoundError as e:
         logger.error(f"Ошибка: файл шаблона или стилей не найден: {e}")
     except Exception as e:
         logger.error(f"Неожиданная ошибка при создании HTML: {e}")
+    finally:
+        persons.close()
+        db.close()
 
 
 async def main() -> None:
@@ -526,6 +1082,9 @@ async def main() -> None:
     parser.add_argument("--clean-db", action="store_true",
                         help="Очистка и подготовка базы данных"
     )
+    parser.add_argument("--incremental", action="store_true",
+                        help="С --clean-db/--pre-llm: обработать только новые и изменившиеся записи"
+    )
     parser.add_argument("--pre-llm", action="store_true",
                         help="Предобработка данных"
     )
@@ -544,29 +1103,49 @@ async def main() -> None:
     parser.add_argument("--count", type=int, default=-1,
                         help="Количество записей"
     )
+    parser.add_argument("--queue", action="store_true",
+                        help="С --llm/--search/--photos: брать задачи из общей очереди в БД (несколько воркеров)"
+    )
+    parser.add_argument("--after-person-id", type=int, default=None,
+                        help="Обрабатывать записи с person_id больше указанного (keyset-окно вместо --start)"
+    )
     parser.add_argument("--md", action="store_true", default=False,
                         help="Разрешить экспорт в md"
     )
     parser.add_argument("--to-html", action="store_true",
                         help="Экспорт в html таблицу"
     )
+    parser.add_argument("--invalidate-cache", nargs="?", const="all", default=None, metavar="MODEL",
+                        help="Очистить кэш ответов LLM для модели (без аргумента — весь кэш)"
+    )
+    parser.add_argument("--analyze", action="store_true",
+                        help="Обновить статистику планировщика (ANALYZE) после выполнения"
+    )
     args = parser.parse_args()
 
+    if args.invalidate_cache:
+        invalidate_llm_cache(args.invalidate_cache)
+
     if args.clean_db:
-        clean_and_create_db()
+        clean_and_create_db(incremental=args.incremental)
     elif args.pre_llm:
-        pre_llm()
+        pre_llm(incremental=args.incremental)
     elif args.llm:
-        await test_llm(start_position=args.start, row_count=args.count)
+        await test_llm(start_position=args.start, row_count=args.count,
+                       after_person_id=args.after_person_id, use_queue=args.queue)
     elif args.search:
-        await test_perpsearch(start_position=args.start, row_count=args.count, md_flag=args.md)
+        await test_perpsearch(start_position=args.start, row_count=args.count, md_flag=args.md,
+                              after_person_id=args.after_person_id, use_queue=args.queue)
     elif args.photos:
-        test_searching_photos()
+        test_searching_photos(use_queue=args.queue)
     elif args.to_html:
         export_to_html()
-    else:
+    elif not (args.analyze or args.invalidate_cache):
         parser.print_help()
 
+    if args.analyze:
+        analyze_db()
+
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,212 @@
+import logging
+import uuid
+from collections.abc import AsyncGenerator
+from typing import Any
+
+from config import DB_POOL_MIN_CONNECTIONS, DatabaseConfig
+from psycopg import Error as PsycopgError
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+
+class AsyncDatabaseManager:
+    """Асинхронный менеджер для работы с базой данных PostgreSQL.
+    Асинхронный аналог DatabaseManager с тем же набором операций
+    (execute_query, execute_bulk_update, iter_query) поверх собственного
+    пула асинхронных соединений psycopg 3. Позволяет async-этапам
+    ожидать ввод-вывод БД напрямую, без asyncio.to_thread.
+    Attributes:
+        config (DatabaseConfig): Конфигурация подключения к БД
+        pool: Пул асинхронных соединений
+        logger: Логгер для записи событий
+    """
+
+    def __init__(self, config: DatabaseConfig | None = None) -> None:
+        """Инициализация асинхронного менеджера базы данных.
+        Пул создается закрытым, его нужно открыть через `await open()`.
+        Args:
+            config: Конфигурация подключения к БД. Если не указана,
+                   используется конфигурация по умолчанию.
+        Raises:
+            ValueError: Если DB_POOL_MAX_SIZE меньше DB_POOL_MIN_CONNECTIONS.
+        """
+        self.config = config or DatabaseConfig()
+        self.logger = logging.getLogger(__name__)
+        self._is_connected = False
+        if self.config.pool_max_size < DB_POOL_MIN_CONNECTIONS:
+            raise ValueError(
+                f"DB_POOL_MAX_SIZE={self.config.pool_max_size}: пулу нужно не меньше "
+                f"{DB_POOL_MIN_CONNECTIONS} соединений (iter_query держит одно на весь этап, "
+                f"запись берет второе), иначе записи будут отваливаться по таймауту пула"
+            )
+        min_size = max(0, self.config.pool_min_size)
+        self.pool = AsyncConnectionPool(
+            make_conninfo(
+                host=self.config.host,
+                dbname=self.config.database,
+                user=self.config.user,
+                password=self.config.password,
+                port=self.config.port
+            ),
+            min_size=min_size,
+            max_size=max(min_size, self.config.pool_max_size),
+            kwargs={"row_factory": dict_row},
+            check=AsyncConnectionPool.check_connection if self.config.pool_health_check else None,
+            open=False
+        )
+
+    async def open(self) -> bool:
+        """(async) Открытие пула соединений.
+        Returns:
+            bool: True если пул открыт успешно, иначе False.
+        """
+        try:
+            await self.pool.open(wait=True)
+            self._is_connected = True
+            self.logger.debug(
+                f"Открыт асинхронный пул соединений к БД: {self.config.host}:"
+                f"{self.config.port}/{self.config.database}"
+            )
+            return True
+        except Exception as e:
+            self.logger.error(f"Ошибка открытия асинхронного пула соединений: {e}")
+            self._is_connected = False
+            return False
+
+    async def execute_query(self, query: str,
+                            params: tuple | None = None
+                            ) -> list[dict[str, Any]]:
+        """(async) execute_query
+        Изменяющие запросы коммитятся; если у них есть RETURNING,
+        возвращаются строки RETURNING, иначе [{"affected_rows": N}].
+        Args:
+            query: SQL-запрос для выполнения
+            params: Параметры для запроса
+        Returns:
+            List[Dict]: Результаты запроса в виде списка словарей
+        """
+        if not self.is_connected:
+            self.logger.warning("Попытка выполнить запрос без активного подключения")
+            return []
+
+        try:
+            async with self.pool.connection() as connection, connection.cursor() as cursor:
+                self.logger.debug(f"Выполнение запроса: {query} с параметрами: {params}")
+                await cursor.execute(query, params)
+
+                if query.strip().upper().startswith('SELECT'):
+                    results = await cursor.fetchall()
+                    self.logger.info(f"Получено {len(results)} записей")
+                elif cursor.description is not None:
+                    results = await cursor.fetchall()
+                    self.logger.debug(f"Запрос выполнен, возвращено строк: {len(results)}")
+                else:
+                    results = [{"affected_rows": cursor.rowcount}]
+                    self.logger.debug(f"Запрос выполнен, затронуто строк: {cursor.rowcount}")
+                return results
+        except PsycopgError as e:
+            self.logger.error(f"Ошибка выполнения запроса: {e}")
+            return []
+        except Exception as e:
+            self.logger.error(f"Неожиданная ошибка при выполнении запроса: {e}")
+            return []
+
+    async def execute_bulk_update(self, query: str,
+                                  rows: list[tuple],
+                                  template: str | None = None,
+                                  page_size: int = 1000
+                                  ) -> list[dict[str, Any]]:
+        """(async) execute_bulk_update
+        Плейсхолдер `VALUES %s` раскрывается в список строк по шаблону
+        `template`; все страницы выполняются в одной транзакции.
+        Args:
+            query: SQL-запрос с плейсхолдером `%s` для списка значений
+            rows: Список кортежей значений
+            template: Шаблон одной строки значений, например "(%s::bigint, %s)"
+            page_size: Максимальное количество строк в одном выражении VALUES
+        Returns:
+            List[Dict]: Строки из RETURNING (или пустой список при ошибке)
+        """
+        if not rows:
+            return []
+        if not self.is_connected:
+            self.logger.warning("Попытка выполнить запрос без активного подключения")
+            return []
+
+        row_template = template or "(" + ", ".join(["%s"] * len(rows[0])) + ")"
+        prefix, suffix = query.split("%s", 1)
+        fetch = "RETURNING" in query.upper()
+        results: list[dict[str, Any]] = []
+        try:
+            async with self.pool.connection() as connection, connection.cursor() as cursor:
+                self.logger.debug(f"Выполнение пакетного запроса: {query}, строк: {len(rows)}")
+                for start in range(0, len(rows), page_size):
+                    page = rows[start:start + page_size]
+                    page_query = prefix + ", ".join([row_template] * len(page)) + suffix
+                    await cursor.execute(page_query, [value for row in page for value in row])
+                    if fetch:
+                        results.extend(await cursor.fetchall())
+            self.logger.debug(f"Пакетный запрос выполнен, возвращено строк: {len(results)}")
+            return results
+        except PsycopgError as e:
+            self.logger.error(f"Ошибка выполнения пакетного запроса: {e}")
+            return []
+        except Exception as e:
+            self.logger.error(f"Неожиданная ошибка при выполнении пакетного запроса: {e}")
+            return []
+
+    async def iter_query(self, query: str,
+                         params: tuple | None = None,
+                         itersize: int | None = None
+                         ) -> AsyncGenerator[dict[str, Any]]:
+        """(async) iter_query
+        Потоково выполняет SELECT через именованный (серверный) курсор,
+        забирая строки с сервера пачками по `itersize`.
+        Args:
+            query: SQL-запрос для выполнения
+            params: Параметры для запроса
+            itersize: Количество строк, забираемых с сервера за раз.
+                      Если не указано, берется из конфигурации.
+        Yields:
+            Dict: Очередная строка результата
+        """
+        if not self.is_connected:
+            self.logger.warning("Попытка выполнить запрос без активного подключения")
+            return
+
+        fetched = 0
+        try:
+            async with self.pool.connection() as connection:
+                cursor = connection.cursor(name=f"iter_query_{uuid.uuid4().hex}")
+                cursor.itersize = itersize or self.config.itersize
+                try:
+                    self.logger.debug(f"Потоковое выполнение запроса: {query} с параметрами: {params}")
+                    await cursor.execute(query, params)
+                    async for row in cursor:
+                        fetched += 1
+                        yield row
+                    self.logger.info(f"Потоково получено {fetched} записей")
+                finally:
+                    await cursor.close()
+        except PsycopgError as e:
+            self.logger.error(f"Ошибка потокового выполнения запроса: {e}")
+        except Exception as e:
+            self.logger.error(f"Неожиданная ошибка при потоковом выполнении запроса: {e}")
+
+    async def close(self) -> None:
+        """(async) Закрытие пула соединений с базой данных."""
+        try:
+            await self.pool.close()
+            self._is_connected = False
+            self.logger.info("Асинхронный пул соединений с БД успешно закрыт")
+        except Exception as e:
+            self.logger.error(f"Ошибка при закрытии асинхронного пула соединений: {e}")
+
+    @property
+    def is_connected(self) -> bool:
+        """Проверка активности пула соединений с БД.
+        Returns:
+            bool: True если пул открыт, иначе False.
+        """
+        return self._is_connected
@@ -1,35 +1,49 @@
-import csv
 import logging
+import threading
+import uuid
+from collections.abc import Generator
+from contextlib import contextmanager
 from io import StringIO
 from typing import Any
 
 import pandas as pd
 import psycopg2
-from config import DatabaseConfig
-from psycopg2.extras import RealDictCursor
+from config import DB_POOL_MIN_CONNECTIONS, DatabaseConfig
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
 
 
 class DatabaseManager:
     """Менеджер для работы с базой данных PostgreSQL.
     Обеспечивает подключение к БД, выполнение запросов, создание таблиц
     и другие операции с базой данных.
+    В режиме пула (pooled=True) каждый вызов берет отдельное соединение
+    из потокобезопасного пула, поэтому один экземпляр можно безопасно
+    использовать из нескольких потоков (например, через asyncio.to_thread).
     Attributes:
         config (DatabaseConfig): Конфигурация подключения к БД
-        connection: Соединение с базой данных
+        connection: Соединение с базой данных (только в режиме без пула)
+        pool: Пул соединений (только в режиме пула)
         logger: Логгер для записи событий
     """
 
-    def __init__(self, config: DatabaseConfig | None = None) -> None:
+    def __init__(self, config: DatabaseConfig | None = None, pooled: bool = False) -> None:
         """Инициализация менеджера базы данных.
         Args:
             config: Конфигурация подключения к БД. Если не указана,
                    используется конфигурация по умолчанию.
+            pooled: Использовать пул соединений вместо одного соединения.
         """
         self.config = config or DatabaseConfig()
         self.connection = None
+        self.pool: ThreadedConnectionPool | None = None
+        self._pool_slots: threading.BoundedSemaphore | None = None
         self.logger = logging.getLogger(__name__)
         self._is_connected = False
-        self._connect()
+        if pooled:
+            self._create_pool()
+        else:
+            self._connect()
 
     def _connect(self) -> bool:
         """Установка соединения с базой данных.
@@ -59,6 +73,103 @@ class DatabaseManager:
             self._is_connected = False
             return False
 
+    def _create_pool(self) -> bool:
+        """Создание пула соединений с базой данных.
+        Returns:
+            bool: True если пул создан успешно, иначе False.
+        Raises:
+            ValueError: Если DB_POOL_MAX_SIZE меньше DB_POOL_MIN_CONNECTIONS.
+        """
+        if self.config.pool_max_size < DB_POOL_MIN_CONNECTIONS:
+            raise ValueError(
+                f"DB_POOL_MAX_SIZE={self.config.pool_max_size}: пулу нужно не меньше "
+                f"{DB_POOL_MIN_CONNECTIONS} соединений (потоковое чтение держит одно, "
+                f"запись берет второе), иначе этап зависнет в ожидании соединения"
+            )
+        min_size = max(0, self.config.pool_min_size)
+        max_size = max(min_size, self.config.pool_max_size)
+        try:
+            self.pool = ThreadedConnectionPool(
+                min_size,
+                max_size,
+                host=self.config.host,
+                database=self.config.database,
+                user=self.config.user,
+                password=self.config.password,
+                port=self.config.port
+            )
+            # ThreadedConnectionPool не ждет освобождения соединения, а падает с PoolError,
+            # поэтому ограничиваем число одновременных заимствований семафором.
+            self._pool_slots = threading.BoundedSemaphore(max_size)
+            self._is_connected = True
+            self.logger.debug(
+                f"Создан пул соединений ({min_size}..{max_size}) к БД: "
+                f"{self.config.host}:{self.config.port}/{self.config.database}"
+            )
+            return True
+        except psycopg2.OperationalError as e:
+            self.logger.error(f"Ошибка создания пула соединений: {e}")
+            self._is_connected = False
+            return False
+        except Exception as e:
+            self.logger.error(f"Неожиданная ошибка при создании пула соединений: {e}")
+            self._is_connected = False
+            return False
+
+    def _is_healthy(self, connection: Any) -> bool:
+        """Проверка работоспособности соединения, взятого из пула.
+        Args:
+            connection: Соединение для проверки
+        Returns:
+            bool: True если соединение пригодно для работы, иначе False.
+        """
+        if connection.closed:
+            return False
+        if not self.config.pool_health_check:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error as e:
+            self.logger.warning(f"Соединение из пула не прошло проверку: {e}")
+            return False
+
+    def _get_pooled_connection(self) -> Any:
+        """Берет из пула рабочее соединение, заменяя разорванные.
+        Returns:
+            Соединение с базой данных.
+        """
+        for _ in range(self.config.pool_max_size + 1):
+            connection = self.pool.getconn()
+            if self._is_healthy(connection):
+                return connection
+            self.pool.putconn(connection, close=True)
+        raise psycopg2.OperationalError("Не удалось получить рабочее соединение из пула")
+
+    @contextmanager
+    def _acquire(self) -> Generator[Any]:
+        """Контекстный менеджер, выдающий соединение на время одной операции.
+        В режиме пула соединение берется из пула и возвращается обратно,
+        иначе используется единственное соединение менеджера.
+        Yields:
+            Соединение с базой данных или None, если подключения нет.
+        """
+        if self.pool is None:
+            yield self.connection
+            return
+
+        self._pool_slots.acquire()
+        connection = None
+        try:
+            connection = self._get_pooled_connection()
+            yield connection
+        finally:
+            if connection is not None:
+                self.pool.putconn(connection, close=bool(connection.closed))
+            self._pool_slots.release()
+
     def _execute_with_transaction(self, query: str, operation_name: str) -> bool:
         """Универсальный метод для выполнения SQL-запросов с обработкой транзакций.
         Args:
@@ -67,33 +178,38 @@ class DatabaseManager:
         Returns:
             bool: True если операция успешна, иначе False.
         """
-        if not self.connection:
+        if not self.is_connected:
             self.logger.error("Нет подключения к БД")
             return False
 
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query)
-            self.connection.commit()
-            cursor.close()
-            self.logger.info(f"Операция '{operation_name}' выполнена успешно")
-            return True
-        except psycopg2.Error as e:
-            self.logger.error(f"Ошибка при операции '{operation_name}': {e}")
-            if self.connection:
-                self.connection.rollback()
-            return False
+            with self._acquire() as connection:
+                try:
+                    cursor = connection.cursor()
+                    cursor.execute(query)
+                    connection.commit()
+                    cursor.close()
+                    self.logger.info(f"Операция '{operation_name}' выполнена успешно")
+                    return True
+                except psycopg2.Error as e:
+                    self.logger.error(f"Ошибка при операции '{operation_name}': {e}")
+                    connection.rollback()
+                    return False
         except Exception as e:
             self.logger.error(f"Неожиданная ошибка при операции '{operation_name}': {e}")
             return False
 
-    def create_cleaned_table(self, source_table_name: str, new_table_name: str) -> bool:
+    def create_cleaned_table(self, source_table_name: str, new_table_name: str,
+                             watermark_table_name: str | None = None) -> bool:
         """Создание таблицы с очищенными данными.
         Создает новую таблицу с уникальными записями по telegram_id,
         оставляя только последние записи по fetch_date.
         Args:
             source_table_name: Имя исходной таблицы
             new_table_name: Имя новой таблицы с очищенными данными
+            watermark_table_name: Таблица водяных знаков. Если указана, в нее
+                                  записывается максимальный fetch_date для
+                                  последующего инкрементального обновления.
         Returns:
             bool: True если таблица создана успешно, иначе False.
         """
@@ -104,20 +220,70 @@ class DatabaseManager:
             FROM {source_table_name}
             WHERE data ? 'about'
             ORDER BY (data->>'telegram_id')::bigint, fetch_date DESC;
+            CREATE INDEX {new_table_name}_telegram_id_idx
+            ON {new_table_name} (((data->>'telegram_id')::bigint));
         """.strip()
+        if watermark_table_name:
+            query += self._set_watermark_sql(watermark_table_name, new_table_name, new_table_name, replace=True)
 
         return self._execute_with_transaction(
             query,
             f"создание очищенной таблицы {new_table_name}"
         )
 
+    def refresh_cleaned_table(self, source_table_name: str, new_table_name: str,
+                              watermark_table_name: str) -> bool:
+        """Инкрементальное обновление таблицы с очищенными данными.
+        Заменяет записи только тех telegram_id, у которых в исходной таблице
+        появились записи новее сохраненного водяного знака fetch_date.
+        Если таблицы еще нет, создает ее целиком.
+        Args:
+            source_table_name: Имя исходной таблицы
+            new_table_name: Имя таблицы с очищенными данными
+            watermark_table_name: Имя таблицы водяных знаков
+        Returns:
+            bool: True если обновление прошло успешно, иначе False.
+        """
+        if not self.table_exists(new_table_name):
+            return self.create_cleaned_table(source_table_name, new_table_name, watermark_table_name)
+
+        query = f"""
+            {self._create_watermark_table_sql(watermark_table_name)}
+            CREATE INDEX IF NOT EXISTS {new_table_name}_telegram_id_idx
+            ON {new_table_name} (((data->>'telegram_id')::bigint));
+            CREATE TEMP TABLE refresh_{new_table_name} ON COMMIT DROP AS
+            SELECT DISTINCT ON ((data->>'telegram_id')::bigint) *
+            FROM {source_table_name}
+            WHERE data ? 'about'
+            AND fetch_date > {self._watermark_sql(watermark_table_name, new_table_name)}
+            ORDER BY (data->>'telegram_id')::bigint, fetch_date DESC;
+            DELETE FROM {new_table_name} AS c
+            USING refresh_{new_table_name} AS r
+            WHERE (c.data->>'telegram_id')::bigint = (r.data->>'telegram_id')::bigint;
+            INSERT INTO {new_table_name} SELECT * FROM refresh_{new_table_name};
+        """.strip()
+        query += self._set_watermark_sql(watermark_table_name, new_table_name, f"refresh_{new_table_name}")
+
+        return self._execute_with_transaction(
+            query,
+            f"инкрементальное обновление очищенной таблицы {new_table_name}"
+        )
+
     def create_result_table(self, source_table_name: str,
-                           result_table_name: str, drop_table: bool = False) -> bool:
+                           result_table_name: str, drop_table: bool = False,
+                           watermark_table_name: str | None = None,
+                           jobs_table_name: str | None = None) -> bool:
         """Создание таблицы с результатами анализа данных.
         Args:
             source_table_name: Имя исходной таблицы
             result_table_name: Имя результирующей таблицы
             drop_table: Флаг необходимости удаления таблицы если существует
+            watermark_table_name: Таблица водяных знаков. Если указана, в нее
+                                  записывается максимальный fetch_date для
+                                  последующего инкрементального обновления.
+            jobs_table_name: Таблица очереди задач. Если указана, ее задачи
+                             удаляются: результаты этапов пересозданной таблицы
+                             пусты, и этапы --queue должны поставить их заново.
         Returns:
             bool: True если таблица создана успешно, иначе False.
         """
@@ -128,6 +294,82 @@ class DatabaseManager:
 
         query = f"""
         CREATE TABLE {result_table_name} AS
+        {self._result_select_sql(source_table_name)};
+        {self._result_keys_sql(result_table_name)}
+        """.strip()
+        if watermark_table_name:
+            query += self._set_watermark_sql(watermark_table_name, result_table_name, result_table_name,
+                                            replace=True)
+        if jobs_table_name and self.table_exists(jobs_table_name):
+            query += f"\nDELETE FROM {jobs_table_name};"
+
+        return self._execute_with_transaction(
+            query,
+            f"создание результирующей таблицы {result_table_name}"
+        )
+
+    def refresh_result_table(self, source_table_name: str, result_table_name: str,
+                             watermark_table_name: str, jobs_table_name: str | None = None) -> bool:
+        """Инкрементальное обновление таблицы с результатами.
+        Пересоздает строки только тех telegram_id, чьи данные в очищенной
+        таблице новее сохраненного водяного знака. Для остальных персон
+        результаты LLM, поиска и фотографий (meaningful_*, summary, urls,
+        photos и т.д.) сохраняются. Если таблицы еще нет, создает ее целиком;
+        у существующей таблицы создаются недостающие первичный ключ и индексы.
+        Args:
+            source_table_name: Имя таблицы с очищенными данными
+            result_table_name: Имя результирующей таблицы
+            watermark_table_name: Имя таблицы водяных знаков
+            jobs_table_name: Таблица очереди задач. Если указана, задачи
+                             пересозданных персон удаляются, чтобы --queue
+                             поставил их заново вместо старых done.
+        Returns:
+            bool: True если обновление прошло успешно, иначе False.
+        """
+        if not self.table_exists(result_table_name):
+            return self.create_result_table(
+                source_table_name, result_table_name,
+                watermark_table_name=watermark_table_name,
+                jobs_table_name=jobs_table_name
+            )
+
+        reset_jobs = ""
+        if jobs_table_name and self.table_exists(jobs_table_name):
+            reset_jobs = f"""
+            DELETE FROM {jobs_table_name} AS j
+            USING {result_table_name} AS t, refresh_{result_table_name} AS r
+            WHERE t.telegram_id = r.telegram_id AND j.person_id = t.person_id;
+            DELETE FROM {jobs_table_name}
+            WHERE person_id IN (SELECT person_id FROM refresh_{result_table_name});"""
+
+        where = f"fetch_date > {self._watermark_sql(watermark_table_name, result_table_name)}"
+        query = f"""
+            {self._create_watermark_table_sql(watermark_table_name)}
+            {self._result_keys_sql(result_table_name)}
+            CREATE TEMP TABLE refresh_{result_table_name} ON COMMIT DROP AS
+            {self._result_select_sql(source_table_name, where)};{reset_jobs}
+            DELETE FROM {result_table_name} AS t
+            USING refresh_{result_table_name} AS r
+            WHERE t.telegram_id = r.telegram_id;
+            INSERT INTO {result_table_name} SELECT * FROM refresh_{result_table_name};
+        """.strip()
+        query += self._set_watermark_sql(watermark_table_name, result_table_name, f"refresh_{result_table_name}")
+
+        return self._execute_with_transaction(
+            query,
+            f"инкрементальное обновление результирующей таблицы {result_table_name}"
+        )
+
+    def _result_select_sql(self, source_table_name: str, where: str | None = None) -> str:
+        """Формирует SELECT, раскладывающий JSON исходных данных по колонкам результата.
+        Args:
+            source_table_name: Имя таблицы с очищенными данными
+            where: Дополнительное условие отбора строк
+        Returns:
+            str: SQL запрос выборки
+        """
+        extra_condition = f"AND {where}" if where else ""
+        return f"""
         SELECT
             person_id::bigint AS person_id,
             fetch_date::timestamp without time zone AS fetch_date,
@@ -167,27 +409,137 @@ class DatabaseManager:
             FROM public.channel_subscribers
             WHERE channel_id = -1002240495824
         )
+        {extra_condition}
+        """
+
+    @staticmethod
+    def _result_keys_sql(result_table_name: str) -> str:
+        """SQL создания первичного ключа и индексов результирующей таблицы, если их еще нет.
+        Частичные индексы соответствуют фильтрам этапов (--search, --photos, --to-html),
+        индекс по telegram_id нужен инкрементальному обновлению. Идемпотентен, поэтому
+        выполняется и при обновлении таблиц, созданных до появления ключей.
+        """
+        return f"""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE conrelid = '{result_table_name}'::regclass AND contype = 'p'
+            ) THEN
+                ALTER TABLE {result_table_name} ADD PRIMARY KEY (person_id);
+            END IF;
+        END $$;
+        CREATE INDEX IF NOT EXISTS {result_table_name}_telegram_id_idx
+        ON {result_table_name} (telegram_id);
+        CREATE INDEX IF NOT EXISTS {result_table_name}_valid_idx
+        ON {result_table_name} (person_id) WHERE valid;
+        CREATE INDEX IF NOT EXISTS {result_table_name}_summary_idx
+        ON {result_table_name} (person_id)
+        WHERE valid AND summary IS NOT NULL AND TRIM(summary) != '';
+        """
+
+    def create_source_indexes(self, source_table_name: str) -> bool:
+        """Создание индексов исходной таблицы, если их еще нет.
+        Индекс по выражению (data->>'telegram_id')::bigint, fetch_date DESC
+        ускоряет DISTINCT ON при построении очищенной таблицы, индекс по
+        fetch_date — отбор новых записей при инкрементальном обновлении.
+        Args:
+            source_table_name: Имя исходной таблицы
+        Returns:
+            bool: True если индексы созданы (или уже существуют), иначе False.
         """
+        query = f"""
+            CREATE INDEX IF NOT EXISTS {source_table_name}_telegram_id_fetch_date_idx
+            ON {source_table_name} (((data->>'telegram_id')::bigint), fetch_date DESC)
+            WHERE data ? 'about';
+            CREATE INDEX IF NOT EXISTS {source_table_name}_fetch_date_idx
+            ON {source_table_name} (fetch_date);
+        """.strip()
 
         return self._execute_with_transaction(
             query,
-            f"создание результирующей таблицы {result_table_name}"
+            f"создание индексов исходной таблицы {source_table_name}"
         )
 
+    def analyze_tables(self, *table_names: str) -> bool:
+        """Обновление статистики планировщика (ANALYZE) после массовых загрузок.
+        Args:
+            table_names: Имена таблиц для анализа
+        Returns:
+            bool: True если статистика обновлена успешно, иначе False.
+        """
+        query = "\n".join(f"ANALYZE {table_name};" for table_name in table_names)
+        return self._execute_with_transaction(
+            query,
+            f"обновление статистики таблиц {', '.join(table_names)}"
+        )
+
+    @staticmethod
+    def _create_watermark_table_sql(watermark_table_name: str) -> str:
+        """SQL создания таблицы водяных знаков (последний обработанный fetch_date)."""
+        return f"""
+            CREATE TABLE IF NOT EXISTS {watermark_table_name} (
+                table_name text PRIMARY KEY,
+                watermark timestamp without time zone
+            );
+        """
+
+    @staticmethod
+    def _watermark_sql(watermark_table_name: str, table_name: str) -> str:
+        """SQL-выражение со значением водяного знака таблицы.
+        Если записи водяного знака нет (таблица создана до его появления), берется
+        max(fetch_date) самой таблицы, иначе первое обновление пересоздало бы все
+        строки и стерло результаты этапов. -infinity — только для пустой таблицы.
+        """
+        return f"""COALESCE(
+                (SELECT watermark FROM {watermark_table_name} WHERE table_name = '{table_name}'),
+                (SELECT max(fetch_date)::timestamp FROM {table_name}),
+                '-infinity'::timestamp
+            )"""
+
+    def _set_watermark_sql(self, watermark_table_name: str, table_name: str, batch_table_name: str,
+                           replace: bool = False) -> str:
+        """SQL сдвига водяного знака таблицы до максимального fetch_date из batch_table_name.
+        При replace (полное пересоздание) водяной знак перезаписывается, а не только
+        растет: иначе после перезагрузки источника с более старыми fetch_date старый
+        водяной знак остался бы и инкрементальные обновления пропускали бы строки.
+        """
+        watermark = "EXCLUDED.watermark"
+        if not replace:
+            watermark = f"GREATEST({watermark_table_name}.watermark, {watermark})"
+        return f"""
+            {self._create_watermark_table_sql(watermark_table_name)}
+            INSERT INTO {watermark_table_name} (table_name, watermark)
+            SELECT '{table_name}', max(fetch_date)::timestamp FROM {batch_table_name}
+            ON CONFLICT (table_name) DO UPDATE
+            SET watermark = {watermark};
+        """
+
+    def table_exists(self, table_name: str) -> bool:
+        """Проверка существования таблицы.
+        Args:
+            table_name: Имя таблицы
+        Returns:
+            bool: True если таблица существует, иначе False.
+        """
+        result = self.execute_query("SELECT to_regclass(%s) IS NOT NULL AS exists", (table_name,))
+        return bool(result and result[0].get("exists"))
+
     def test_connection(self) -> bool:
         """Тестирование подключения к базе данных.
         Returns:
             bool: True если подключение активно и тест пройден, иначе False.
         """
-        if not self.connection:
+        if not self.is_connected:
             self.logger.warning("Нет активного подключения для тестирования")
             return False
 
         try:
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT version(), current_database(), current_user")
-            db_info = cursor.fetchone()
-            cursor.close()
+            with self._acquire() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT version(), current_database(), current_user")
+                db_info = cursor.fetchone()
+                cursor.close()
 
             if db_info:
                 self.logger.info(
@@ -208,39 +560,217 @@ class DatabaseManager:
                       params: tuple | None = None
                       ) -> list[dict[str, Any]]:
         """Универсальный метод для выполнения произвольных SQL запросов.
+        Изменяющие запросы коммитятся; если у них есть RETURNING,
+        возвращаются строки RETURNING, иначе [{"affected_rows": N}].
         Args:
             query: SQL-запрос для выполнения
             params: Параметры для запроса
         Returns:
             List[Dict]: Результаты запроса в виде списка словарей
         """
-        if not self.connection:
+        if not self.is_connected:
             self.logger.warning("Попытка выполнить запрос без активного подключения")
             return []
 
         try:
-            cursor = self.connection.cursor(cursor_factory=RealDictCursor)
-            self.logger.debug(f"Выполнение запроса: {query} с параметрами: {params}")
-            cursor.execute(query, params)
-
-            if query.strip().upper().startswith('SELECT'):
-                results = cursor.fetchall()
-                self.logger.info(f"Получено {len(results)} записей")
-            else:
-                self.connection.commit()
-                results = [{"affected_rows": cursor.rowcount}]
-                self.logger.debug(f"Запрос выполнен, затронуто строк: {cursor.rowcount}")
-
-            cursor.close()
-            return results
-        except psycopg2.Error as e:
-            self.logger.error(f"Ошибка выполнения запроса: {e}")
-            self.connection.rollback()
-            return []
+            with self._acquire() as connection:
+                try:
+                    cursor = connection.cursor(cursor_factory=RealDictCursor)
+                    self.logger.debug(f"Выполнение запроса: {query} с параметрами: {params}")
+                    cursor.execute(query, params)
+
+                    if query.strip().upper().startswith('SELECT'):
+                        results = cursor.fetchall()
+                        self.logger.info(f"Получено {len(results)} записей")
+                    elif cursor.description is not None:
+                        results = cursor.fetchall()
+                        connection.commit()
+                        self.logger.debug(f"Запрос выполнен, возвращено строк: {len(results)}")
+                    else:
+                        connection.commit()
+                        results = [{"affected_rows": cursor.rowcount}]
+                        self.logger.debug(f"Запрос выполнен, затронуто строк: {cursor.rowcount}")
+
+                    cursor.close()
+                    return results
+                except psycopg2.Error as e:
+                    self.logger.error(f"Ошибка выполнения запроса: {e}")
+                    connection.rollback()
+                    return []
         except Exception as e:
             self.logger.error(f"Неожиданная ошибка при выполнении запроса: {e}")
             return []
 
+    def iter_query(self, query: str,
+                   params: tuple | None = None,
+                   itersize: int | None = None
+                   ) -> Generator[dict[str, Any]]:
+        """Потоково выполняет SELECT через именованный (серверный) курсор.
+        В отличие от execute_query, строки не загружаются в память целиком:
+        курсор забирает их с сервера пачками по `itersize` строк.
+        В режиме без пула курсор создается WITH HOLD, чтобы коммиты других
+        запросов на том же соединении не закрывали его.
+        Args:
+            query: SQL-запрос для выполнения
+            params: Параметры для запроса
+            itersize: Количество строк, забираемых с сервера за раз.
+                      Если не указано, берется из конфигурации.
+        Yields:
+            Dict: Очередная строка результата
+        """
+        if not self.is_connected:
+            self.logger.warning("Попытка выполнить запрос без активного подключения")
+            return
+
+        fetched = 0
+        try:
+            with self._acquire() as connection:
+                cursor = connection.cursor(
+                    name=f"iter_query_{uuid.uuid4().hex}",
+                    cursor_factory=RealDictCursor,
+                    withhold=self.pool is None
+                )
+                cursor.itersize = itersize or self.config.itersize
+                try:
+                    self.logger.debug(f"Потоковое выполнение запроса: {query} с параметрами: {params}")
+                    cursor.execute(query, params)
+                    for row in cursor:
+                        fetched += 1
+                        yield row
+                    cursor.close()
+                    connection.commit()
+                    self.logger.info(f"Потоково получено {fetched} записей")
+                except psycopg2.Error as e:
+                    self.logger.error(f"Ошибка потокового выполнения запроса: {e}")
+                    connection.rollback()
+                finally:
+                    if not cursor.closed:
+                        cursor.close()
+        except Exception as e:
+            self.logger.error(f"Неожиданная ошибка при потоковом выполнении запроса: {e}")
+
+    def execute_bulk_update(self, query: str,
+                            rows: list[tuple],
+                            template: str | None = None,
+                            page_size: int = 1000
+                            ) -> list[dict[str, Any]]:
+        """Выполняет многострочный UPDATE/INSERT одним запросом в одной транзакции.
+        Запрос должен содержать один плейсхолдер `VALUES %s`, который заполняется
+        строками `rows` через psycopg2.extras.execute_values. Если в запросе есть
+        RETURNING, возвращаются строки, затронутые запросом.
+        Args:
+            query: SQL-запрос с плейсхолдером `%s` для списка значений
+            rows: Список кортежей значений
+            template: Шаблон одной строки значений, например "(%s::bigint, %s)"
+            page_size: Максимальное количество строк в одном выражении VALUES
+        Returns:
+            List[Dict]: Строки из RETURNING (или пустой список при ошибке)
+        """
+        if not rows:
+            return []
+        if not self.is_connected:
+            self.logger.warning("Попытка выполнить запрос без активного подключения")
+            return []
+
+        try:
+            with self._acquire() as connection:
+                try:
+                    cursor = connection.cursor(cursor_factory=RealDictCursor)
+                    self.logger.debug(f"Выполнение пакетного запроса: {query}, строк: {len(rows)}")
+                    results = execute_values(
+                        cursor, query, rows,
+                        template=template, page_size=page_size,
+                        fetch="RETURNING" in query.upper()
+                    )
+                    connection.commit()
+                    cursor.close()
+                    results = [dict(row) for row in results or []]
+                    self.logger.debug(f"Пакетный запрос выполнен, возвращено строк: {len(results)}")
+                    return results
+                except psycopg2.Error as e:
+                    self.logger.error(f"Ошибка выполнения пакетного запроса: {e}")
+                    connection.rollback()
+                    return []
+        except Exception as e:
+            self.logger.error(f"Неожиданная ошибка при выполнении пакетного запроса: {e}")
+            return []
+
+    def copy_update(self, table_name: str,
+                    key_column: str,
+                    columns: dict[str, str],
+                    rows: list[tuple]
+                    ) -> int:
+        """Массово обновляет таблицу через COPY во временную staging-таблицу.
+        В одной транзакции создает временную таблицу (удаляется при коммите),
+        загружает в нее строки через COPY и применяет их одним
+        `UPDATE ... FROM staging` по ключевой колонке.
+        Args:
+            table_name: Имя обновляемой таблицы
+            key_column: Колонка, по которой строки staging сопоставляются с таблицей
+            columns: Колонки staging-таблицы и их типы, начиная с ключевой
+                     (например {"person_id": "bigint", "about": "text"})
+            rows: Кортежи значений в порядке `columns`
+        Returns:
+            int: Количество обновленных строк (0 при ошибке)
+        """
+        if not rows:
+            return 0
+        if not self.is_connected:
+            self.logger.warning("Попытка выполнить запрос без активного подключения")
+            return 0
+
+        staging_name = f"staging_{table_name}"
+        columns_ddl = ", ".join(f"{name} {pg_type}" for name, pg_type in columns.items())
+        column_names = ", ".join(columns)
+        set_sql = ", ".join(f"{name} = s.{name}" for name in columns if name != key_column)
+
+        buffer = StringIO()
+        for row in rows:
+            buffer.write(",".join(self._to_csv_field(value) for value in row))
+            buffer.write("\n")
+        buffer.seek(0)
+
+        try:
+            with self._acquire() as connection:
+                try:
+                    cursor = connection.cursor()
+                    cursor.execute(
+                        f"CREATE TEMP TABLE {staging_name} ({columns_ddl}) ON COMMIT DROP"
+                    )
+                    cursor.copy_expert(
+                        f"COPY {staging_name} ({column_names}) FROM STDIN (FORMAT csv)",
+                        buffer
+                    )
+                    cursor.execute(f"""
+                        UPDATE {table_name} AS t
+                        SET {set_sql}
+                        FROM {staging_name} AS s
+                        WHERE t.{key_column} = s.{key_column}
+                    """)
+                    updated = cursor.rowcount
+                    connection.commit()
+                    cursor.close()
+                    self.logger.debug(f"COPY-обновление {table_name}: затронуто строк: {updated}")
+                    return updated
+                except psycopg2.Error as e:
+                    self.logger.error(f"Ошибка COPY-обновления таблицы {table_name}: {e}")
+                    connection.rollback()
+                    return 0
+        except Exception as e:
+            self.logger.error(f"Неожиданная ошибка при COPY-обновлении таблицы {table_name}: {e}")
+            return 0
+
+    @staticmethod
+    def _to_csv_field(value: Any) -> str:
+        """Кодирует значение в поле CSV для COPY.
+        None передается как пустое поле без кавычек (NULL в формате csv),
+        остальные значения всегда берутся в кавычки, поэтому пустая строка
+        остается пустой строкой, а не NULL.
+        """
+        if value is None:
+            return ""
+        return '"' + str(value).replace('"', '""') + '"'
+
     def get_table_info(self, table_name: str) -> list[dict[str, Any]]:
         """Получение информации о структуре таблицы.
         Args:
@@ -257,49 +787,68 @@ class DatabaseManager:
         return self.execute_query(query, (table_name,))
 
     def create_table_from_csv(self, csv_file_path: str, table_name: str,
-                             delimiter: str = ',', encoding: str = 'utf-8') -> bool:
+                             delimiter: str = ',', encoding: str = 'utf-8',
+                             sample_rows: int = 10000,
+                             chunk_size: int = 1024 * 1024) -> bool:
         """Создает таблицу в БД из CSV файла.
+        Типы колонок определяются по первым `sample_rows` строкам, после чего
+        файл целиком передается в `COPY ... FROM STDIN (FORMAT csv)` порциями
+        по `chunk_size` байт, поэтому потребление памяти не зависит от размера файла.
         Args:
             csv_file_path: Путь к CSV файлу
             table_name: Имя создаваемой таблицы
             delimiter: Разделитель в CSV файле
             encoding: Кодировка файла
+            sample_rows: Количество строк для определения типов колонок
+            chunk_size: Размер порции (в байтах), передаваемой в COPY за раз
         Returns:
             bool: True если таблица создана успешно, иначе False.
         """
-        if not self.connection:
+        if not self.is_connected:
             self.logger.error("Нет подключения к БД")
             return False
 
         try:
-            self.logger.info(f"Чтение CSV файла: {csv_file_path}")
-            df = pd.read_csv(csv_file_path, delimiter=delimiter, encoding=encoding)
-            self.logger.info(f"Прочитано {len(df)} строк, {len(df.columns)} колонок")
-            self.logger.info(f"Колонки: {list(df.columns)}")
-
-            drop_sql = f'DROP TABLE IF EXISTS "{table_name}";'
-            create_table_sql = self._generate_create_table_sql(df, table_name)
-
-            cursor = self.connection.cursor()
-            cursor.execute(drop_sql)
-            self.logger.info(f"Таблица {table_name} удалена (replace mode)")
-
-            cursor.execute(create_table_sql)
-            self.logger.info(f"Таблица {table_name} создана")
-
-            if not df.empty:
-                self._insert_data_from_dataframe(cursor, df, table_name)
-
-            self.connection.commit()
-            cursor.close()
-            self.logger.info(f"Таблица {table_name} успешно создана из CSV файла")
-            self.logger.info(f"Добавлено {len(df)} записей")
-            return True
+            with self._acquire() as connection:
+                try:
+                    self.logger.info(f"Чтение образца CSV файла: {csv_file_path} ({sample_rows} строк)")
+                    # NULL для COPY — только пустое поле, поэтому и образец читается так же:
+                    # иначе "NA"/"null" дали бы числовой тип, а COPY отверг бы эти строки
+                    sample_df = pd.read_csv(csv_file_path, delimiter=delimiter,
+                                            encoding=encoding, nrows=sample_rows,
+                                            keep_default_na=False, na_values=[''])
+                    self.logger.info(f"Колонки ({len(sample_df.columns)}): {list(sample_df.columns)}")
+
+                    drop_sql = f'DROP TABLE IF EXISTS "{table_name}";'
+                    create_table_sql = self._generate_create_table_sql(sample_df, table_name)
+
+                    cursor = connection.cursor()
+                    cursor.execute(drop_sql)
+                    self.logger.info(f"Таблица {table_name} удалена (replace mode)")
+
+                    cursor.execute(create_table_sql)
+                    self.logger.info(f"Таблица {table_name} создана")
+
+                    quoted_delimiter = delimiter.replace("'", "''")
+                    copy_sql = (
+                        f'COPY "{table_name}" FROM STDIN WITH '
+                        f"(FORMAT csv, HEADER true, DELIMITER '{quoted_delimiter}')"
+                    )
+                    with open(csv_file_path, encoding=encoding, newline='') as csv_file:
+                        cursor.copy_expert(copy_sql, csv_file, size=chunk_size)
+                    copied_rows = cursor.rowcount
+
+                    connection.commit()
+                    cursor.close()
+                    self.logger.info(f"Таблица {table_name} успешно создана из CSV файла")
+                    self.logger.info(f"Добавлено {copied_rows} записей")
+                    return True
+                except Exception:
+                    connection.rollback()
+                    raise
 
         except Exception as e:
             self.logger.error(f"Ошибка создания таблицы из CSV: {e}")
-            if self.connection:
-                self.connection.rollback()
             return False
 
     def _generate_create_table_sql(self, df: pd.DataFrame, table_name: str) -> str:
@@ -329,25 +878,16 @@ class DatabaseManager:
 
         return create_table_sql
 
-    def _insert_data_from_dataframe(self, cursor: Any,
-                                    df: pd.DataFrame, table_name: str
-                                    ) -> None:
-        """Вставляет данные из DataFrame в таблицу.
-        Args:
-            cursor: Курсор базы данных
-            df: DataFrame с данными
-            table_name: Имя таблицы для вставки
-        """
-        output = StringIO()
-        df.to_csv(output, sep='\t', header=False, index=False,
-                  quoting=csv.QUOTE_NONE, escapechar='\\')
-        output.seek(0)
-        cursor.copy_from(output, table_name, null='', sep='\t')
-        self.logger.info(f"Данные скопированы в таблицу {table_name}")
-
     def close(self) -> None:
-        """Закрытие соединения с базой данных."""
-        if self.connection:
+        """Закрытие соединения (или всех соединений пула) с базой данных."""
+        if self.pool is not None:
+            try:
+                self.pool.closeall()
+                self._is_connected = False
+                self.logger.info("Пул соединений с БД успешно закрыт")
+            except Exception as e:
+                self.logger.error(f"Ошибка при закрытии пула соединений: {e}")
+        elif self.connection:
             try:
                 self.connection.close()
                 self._is_connected = False
@@ -0,0 +1,103 @@
+import hashlib
+import logging
+import re
+from collections import OrderedDict
+from typing import Any
+
+
+class InputDeduplicator:
+    """Дедупликация одинаковых входных данных персон в рамках одного прогона этапа.
+    Записи группируются по хэшу нормализованных (имя, фамилия, описание).
+    Первая запись группы (представитель) отправляется в LLM, остальные ждут
+    его результата; результат затем записывается сразу для всей группы.
+    Результаты завершенных групп хранятся в ограниченном LRU, чтобы дубликаты,
+    пришедшие позже, получали результат без запроса к LLM.
+    Attributes:
+        max_results (int): Сколько результатов завершенных групп хранить
+        rows (int): Всего учтенных записей
+        representatives (int): Записей, отправленных в LLM
+        duplicates (int): Записей, получивших результат представителя
+        logger: Логгер для записи событий
+    """
+
+    def __init__(self, max_results: int) -> None:
+        self.max_results = max_results
+        self.rows = 0
+        self.representatives = 0
+        self.duplicates = 0
+        self._members: dict[int, list[int]] = {}
+        self._key_of: dict[int, str] = {}
+        self._rep_of: dict[str, int] = {}
+        self._results: OrderedDict[str, Any] = OrderedDict()
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+    @staticmethod
+    def make_key(*fields: str | None) -> str:
+        """Хэш нормализованных полей (регистр и пробелы не учитываются)."""
+        normalized = "\x1f".join(re.sub(r"\s+", " ", (f or "")).strip().lower() for f in fields)
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def admit(self, key: str, person_id: int) -> tuple[str, Any]:
+        """Учитывает запись.
+        Returns:
+            ("new", None) — запись стала представителем группы и должна уйти в LLM;
+            ("pending", None) — представитель группы уже в работе, запись ждет его;
+            ("done", result) — результат группы уже известен.
+        """
+        self.rows += 1
+        if key in self._results:
+            self._results.move_to_end(key)
+            self.duplicates += 1
+            return "done", self._results[key]
+        if key in self._rep_of:
+            self._members[self._rep_of[key]].append(person_id)
+            self.duplicates += 1
+            return "pending", None
+        self._rep_of[key] = person_id
+        self._key_of[person_id] = key
+        self._members[person_id] = []
+        self.representatives += 1
+        return "new", None
+
+    def take_members(self, person_id: int) -> list[int]:
+        """Забирает текущих участников группы представителя для записи результата."""
+        if person_id not in self._members:
+            return []
+        members, self._members[person_id] = self._members[person_id], []
+        return members
+
+    def restore_members(self, person_id: int, members: list[int]) -> None:
+        """Возвращает участников группе, если запись результата не удалась."""
+        if person_id in self._members:
+            self._members[person_id][:0] = members
+
+    def resolve(self, person_id: int, result: Any) -> list[int]:
+        """Запоминает результат группы и закрывает ее.
+        Returns:
+            Участники, добавленные после take_members (им результат нужно дописать).
+        """
+        key = self._key_of.pop(person_id, None)
+        late = self._members.pop(person_id, [])
+        if key is None:
+            return late
+        self._rep_of.pop(key, None)
+        self._results[key] = result
+        if len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+        return late
+
+    def fail(self, person_id: int) -> list[int]:
+        """Закрывает группу без результата. Returns: участники группы."""
+        key = self._key_of.pop(person_id, None)
+        if key is not None:
+            self._rep_of.pop(key, None)
+        return self._members.pop(person_id, [])
+
+    def log_stats(self, stage: str) -> None:
+        """Выводит в лог долю дубликатов."""
+        if not self.rows:
+            return
+        self.logger.info(
+            f"Дедупликация [{stage}]: {self.duplicates}/{self.rows} записей — дубликаты "
+            f"({self.duplicates / self.rows:.0%}), в LLM отправлено {self.representatives}"
+        )
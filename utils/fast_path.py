@@ -0,0 +1,103 @@
+import logging
+import re
+from collections import Counter
+from pathlib import Path
+
+import config
+from config import EMOJI_PATTERN
+from utils import cleaner
+
+CYRILLIC_NAME_PATTERN = re.compile(r'^[А-ЯЁ][а-яё]+(?:-[А-ЯЁ][а-яё]+)?$')
+LATIN_NAME_PATTERN = re.compile(r'^[A-Z][a-z]+(?:-[A-Z][a-z]+)?$')
+
+
+def load_first_names(path: str | None) -> frozenset[str] | None:
+    """Загружает словарь имен (одно имя на строку, # — комментарий).
+    Returns:
+        frozenset | None: Имена в нижнем регистре или None, если файла нет
+    """
+    if not path or not Path(path).is_file():
+        return None
+    with open(path, encoding="utf-8") as f:
+        return frozenset(
+            line.strip().lower() for line in f
+            if line.strip() and not line.startswith("#")
+        )
+
+
+class FastPathResolver:
+    """Детерминированный быстрый путь для этапа --llm.
+    Запись разрешается без LLM, если после pre_llm она уже чистая: имя и фамилия —
+    по одному слову одной письменности (кириллица или латиница) с заглавной буквы,
+    не меняющиеся при очистке cleaner, имя есть в словаре (если словарь загружен),
+    а описание короткое, однострочное и содержит маркер роли отдельным словом
+    (подстрока не считается: "cto" в "Electoral", "инженер" в "инженера").
+    Attributes:
+        first_names (frozenset | None): Словарь имен
+        counters (Counter): Количество записей по путям: fast_path, llm
+        logger: Логгер для записи событий
+    """
+
+    def __init__(self, first_names: frozenset[str] | None = None) -> None:
+        """Инициализация.
+        Args:
+            first_names: Словарь имен в нижнем регистре. Если не указан,
+                         проверяется только форма имени.
+        """
+        self.first_names = first_names
+        self.role_markers = tuple(m.lower() for m in config.FAST_PATH_ROLE_MARKERS)
+        self._role_pattern = re.compile(
+            r"(?<![\w-])(?:" + "|".join(map(re.escape, self.role_markers)) + r")(?![\w-])"
+        )
+        self.counters: Counter[str] = Counter()
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+    def _name_script(self, value: str | None) -> str | None:
+        """Возвращает письменность чистого имени ("cyr"/"lat") или None."""
+        if not value or cleaner.clean_second_name_field(value) != value:
+            return None
+        if CYRILLIC_NAME_PATTERN.match(value):
+            return "cyr"
+        if LATIN_NAME_PATTERN.match(value):
+            return "lat"
+        return None
+
+    def _is_clean_about(self, about: str | None) -> bool:
+        if not about or len(about) > config.FAST_PATH_MAX_ABOUT_LENGTH:
+            return False
+        if "\n" in about or "|" in about or EMOJI_PATTERN.search(about):
+            return False
+        return self._role_pattern.search(about.lower()) is not None
+
+    def resolve(self, first_name: str | None, last_name: str | None,
+                about: str | None) -> tuple[str, str, str, bool] | None:
+        """Пытается разрешить запись без LLM.
+        Returns:
+            (имя, фамилия, описание, valid) или None, если запись нужно отправить в LLM
+        """
+        first_name, last_name, about = (
+            cleaner.normalize_empty(first_name),
+            cleaner.normalize_empty(last_name),
+            cleaner.normalize_empty(about),
+        )
+        script = self._name_script(first_name)
+        resolved = (
+            script is not None
+            and self._name_script(last_name) == script
+            and (self.first_names is None or first_name.lower() in self.first_names)
+            and (self.first_names is None or last_name.lower() not in self.first_names)
+            and self._is_clean_about(about)
+        )
+        self.counters["fast_path" if resolved else "llm"] += 1
+        return (first_name, last_name, about, True) if resolved else None
+
+    def log_stats(self) -> None:
+        """Выводит в лог долю записей по каждому пути."""
+        total = sum(self.counters.values())
+        if not total:
+            return
+        self.logger.info(
+            f"Быстрый путь: {self.counters['fast_path']}/{total} записей "
+            f"({self.counters['fast_path'] / total:.0%}) без LLM, "
+            f"{self.counters['llm']} ({self.counters['llm'] / total:.0%}) — через LLM"
+        )